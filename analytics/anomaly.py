@@ -0,0 +1,172 @@
+import math
+from collections import namedtuple
+import numpy as np
+
+# Metrics watched for outliers, per screen table.
+WATCHED_METRICS = {
+    "control_panel2": [
+        "OIL_HEATER_Actual_Temp_1", "OIL_HEATER_Actual_Temp_2", "HOT_AIR_Actual_Temp",
+        "Torque_1", "Torque_2", "Torque_3",
+    ],
+    "control_panel3": ["CutTension_kg"],
+    "control_panel4": [
+        "OilHeater1_Temp_C", "OilHeater2_Temp_C", "Godet1_temp_C", "Godet2_current_A", "Godet3_current_A",
+        "Godet4_current_A", "Godet4_torque_percent", "Zone1_temp_C", "Zone2_temp_C", "Zone2_torque_percent",
+    ],
+    "control_panel5": ["CutTension_kg"],
+    "control_panel6": [
+        "Extruder_Nm", "Z1_temp", "Z2_temp", "Z3_temp", "Z4_temp", "Z5_temp", "Z6_temp",
+        "Z11_temp", "Z13_temp", "Z14_temp",
+    ],
+}
+
+# Fastest physically plausible change, in units per second. Heated oil and barrel
+# zones have too much thermal mass to move faster; a bigger jump is a misread.
+SLEW_LIMITS = {
+    "OIL_HEATER_Actual_Temp_1": 2.0, "OIL_HEATER_Actual_Temp_2": 2.0, "HOT_AIR_Actual_Temp": 2.0,
+    "OilHeater1_Temp_C": 2.0, "OilHeater2_Temp_C": 2.0, "Godet1_temp_C": 2.0,
+    "Zone1_temp_C": 2.0, "Zone2_temp_C": 2.0,
+    "Z1_temp": 2.0, "Z2_temp": 2.0, "Z3_temp": 2.0, "Z4_temp": 2.0, "Z5_temp": 2.0, "Z6_temp": 2.0,
+    "Z11_temp": 2.0, "Z13_temp": 2.0, "Z14_temp": 2.0,
+}
+
+# kind is "misread" (likely an extraction error) or "excursion" (the process really moved).
+Anomaly = namedtuple("Anomaly", "machine_id table metric captured_at value expected zscore rate kind")
+
+class MetricStats:
+    """Rolling statistics of one metric on one machine, kept in a fixed-size ring buffer."""
+
+    __slots__ = ("buffer", "size", "pos", "total", "total_sq", "ewma", "last_value", "last_time", "pending")
+
+    def __init__(self, window):
+        self.buffer = np.zeros(window)
+        self.size = 0
+        self.pos = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.ewma = None
+        self.last_value = None
+        self.last_time = None
+        # Outliers held back from the baseline until the next readings classify them.
+        self.pending = []
+
+    def push(self, value, captured_at, alpha):
+        window = len(self.buffer)
+        if self.size == window:
+            old = float(self.buffer[self.pos])
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.size += 1
+        self.buffer[self.pos] = value
+        self.total += value
+        self.total_sq += value * value
+        self.pos = (self.pos + 1) % window
+        if self.pos == 0:
+            # Re-sum once per lap so the running sums don't drift.
+            values = self.buffer[:self.size]
+            self.total = float(values.sum())
+            self.total_sq = float(values @ values)
+        self.ewma = value if self.ewma is None else self.ewma + alpha * (value - self.ewma)
+        self.last_value = value
+        self.last_time = captured_at
+
+    def mean_std(self):
+        mean = self.total / self.size
+        return mean, math.sqrt(max(self.total_sq / self.size - mean * mean, 0.0))
+
+def _power_of_ten_slip(value, baseline, tolerance=0.15):
+    """True when value is baseline off by a factor of 10 or 100, e.g. a dropped decimal point."""
+    if value == 0 or baseline == 0 or (value > 0) != (baseline > 0):
+        return False
+    exponent = math.log10(abs(value / baseline))
+    nearest = round(exponent)
+    return 1 <= abs(nearest) <= 2 and abs(exponent - nearest) < math.log10(1 + tolerance)
+
+def print_anomaly(anomaly):
+    print(f"Anomaly ({anomaly.kind}) on {anomaly.machine_id} {anomaly.table}.{anomaly.metric} at "
+          f"{anomaly.captured_at}: {anomaly.value} (expected ~{anomaly.expected:.2f}, z={anomaly.zscore:.1f})")
+
+class AnomalyDetector:
+    """Online outlier detection over readings as they arrive.
+
+    Each machine/metric keeps an EWMA and a rolling mean and standard deviation
+    over the last window readings. A reading more than z_threshold deviations
+    from the rolling mean is an outlier. It is a misread when it is the baseline
+    off by a power of ten, moves faster than the metric's slew limit, or reverts
+    on the next reading. It is an excursion when confirm_after consecutive
+    readings deviate the same way; those readings then join the baseline.
+    """
+
+    def __init__(self, window=120, alpha=0.1, z_threshold=4.0, min_samples=10, confirm_after=2,
+                 rel_std_floor=0.01, metrics=WATCHED_METRICS, on_anomaly=print_anomaly):
+        self.window = window
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.confirm_after = confirm_after
+        self.rel_std_floor = rel_std_floor
+        self.metrics = metrics
+        self.on_anomaly = on_anomaly
+        self._stats = {}
+
+    def stats(self, machine_id, table, metric):
+        key = (machine_id, table, metric)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = MetricStats(self.window)
+        return stats
+
+    def observe_row(self, table, row, machine_id):
+        """Feeds one stored row in. Usable as a reading listener. Returns the anomalies it settled."""
+        anomalies = []
+        for metric in self.metrics.get(table, ()):
+            value = row.get(metric)
+            if value is None or value != value:
+                continue
+            anomalies.extend(self.observe(machine_id, table, metric, row["captured_at"], float(value)))
+        if self.on_anomaly is not None:
+            for anomaly in anomalies:
+                self.on_anomaly(anomaly)
+        return anomalies
+
+    def observe(self, machine_id, table, metric, captured_at, value):
+        stats = self.stats(machine_id, table, metric)
+        if stats.size < self.min_samples:
+            stats.push(value, captured_at, self.alpha)
+            return []
+        mean, std = stats.mean_std()
+        std = max(std, abs(mean) * self.rel_std_floor, 1e-9)
+        zscore = (value - mean) / std
+        rate = None
+        if stats.last_time is not None and captured_at is not None:
+            elapsed = (captured_at - stats.last_time).total_seconds()
+            if elapsed > 0:
+                rate = (value - stats.last_value) / elapsed
+
+        def anomaly(kind, at=captured_at, v=value, z=zscore, r=rate):
+            return Anomaly(machine_id, table, metric, at, v, stats.ewma, z, r, kind)
+
+        if abs(zscore) <= self.z_threshold:
+            # Back to normal: whatever was pending was a one-off misread.
+            settled = [anomaly("misread", *p) for p in stats.pending]
+            stats.pending = []
+            stats.push(value, captured_at, self.alpha)
+            return settled
+
+        slew_limit = SLEW_LIMITS.get(metric)
+        if _power_of_ten_slip(value, mean) or (rate is not None and slew_limit is not None
+                                               and abs(rate) > slew_limit and not stats.pending):
+            return [anomaly("misread")]
+
+        settled = []
+        if stats.pending and (stats.pending[0][2] > 0) != (zscore > 0):
+            settled = [anomaly("misread", *p) for p in stats.pending]
+            stats.pending = []
+        stats.pending.append((captured_at, value, zscore, rate))
+        if len(stats.pending) >= self.confirm_after:
+            settled.extend(anomaly("excursion", *p) for p in stats.pending)
+            for at, v, _, _ in stats.pending:
+                stats.push(v, at, self.alpha)
+            stats.pending = []
+        return settled
@@ -0,0 +1,200 @@
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque, namedtuple
+import numpy as np
+from processors.common import frame_captured_at
+
+# Target/actual pairs checked on each screen: (name, target field, actual field).
+DEVIATION_PAIRS = {
+    "control_panel2": [
+        ("oil_heater_1", "OIL_HEATER_Target_Temp_1", "OIL_HEATER_Actual_Temp_1"),
+        ("oil_heater_2", "OIL_HEATER_Target_Temp_2", "OIL_HEATER_Actual_Temp_2"),
+        ("hot_air", "HOT_AIR_Target_Temp", "HOT_AIR_Actual_Temp"),
+    ],
+}
+
+# Deviation (actual - target, absolute) above which a pair is out of band, per pair.
+DEVIATION_THRESHOLDS = {
+    "oil_heater_1": 5.0,
+    "oil_heater_2": 5.0,
+    "hot_air": 5.0,
+}
+
+# kind is "deviation" when a pair has been out of band for the hold time, "cleared" when it is back.
+Alert = namedtuple("Alert", "machine_id table pair kind target actual deviation started_at captured_at "
+                            "duration_s latency_s")
+
+def print_sink(alert):
+    if alert.kind == "deviation":
+        print(f"ALERT {alert.machine_id} {alert.pair}: actual {alert.actual} vs target {alert.target} "
+              f"({alert.deviation:+.1f}) for {alert.duration_s:.0f}s")
+    else:
+        print(f"Cleared {alert.machine_id} {alert.pair} after {alert.duration_s:.0f}s")
+
+def _alert_dict(alert):
+    record = alert._asdict()
+    for key in ("started_at", "captured_at"):
+        record[key] = record[key].isoformat() if record[key] is not None else None
+    return record
+
+class JsonLinesSink:
+    """Appends alerts to a JSON lines file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, alert):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(_alert_dict(alert)) + "\n")
+
+class WebhookSink:
+    """POSTs alerts as JSON to a URL, e.g. a chat or paging webhook.
+
+    Alerts are posted from a background thread, so a slow or unreachable
+    webhook never holds up storing the reading that raised them. Up to
+    max_pending alerts wait; beyond that new ones are dropped and counted.
+    """
+
+    def __init__(self, url, timeout=2.0, max_pending=100):
+        self.url = url
+        self.timeout = timeout
+        self.dropped = 0
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._post_loop, name="alert-webhook", daemon=True)
+        self._thread.start()
+
+    def __call__(self, alert):
+        try:
+            self._pending.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+            print(f"Alert webhook backlog full, dropped {self.dropped} alerts so far")
+
+    def _post_loop(self):
+        while True:
+            alert = self._pending.get()
+            try:
+                self.post(alert)
+            except Exception as e:
+                print(f"Alert webhook failed: {e}")
+            finally:
+                self._pending.task_done()
+
+    def post(self, alert):
+        request = urllib.request.Request(self.url, data=json.dumps(_alert_dict(alert)).encode(),
+                                         headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+    def flush(self):
+        """Waits until the alerts queued so far have been posted."""
+        self._pending.join()
+
+def sinks_from_env():
+    """Prints alerts, plus ALERT_LOG (JSON lines file) and ALERT_WEBHOOK_URL when set."""
+    sinks = [print_sink]
+    if os.getenv("ALERT_LOG"):
+        sinks.append(JsonLinesSink(os.getenv("ALERT_LOG")))
+    if os.getenv("ALERT_WEBHOOK_URL"):
+        sinks.append(WebhookSink(os.getenv("ALERT_WEBHOOK_URL")))
+    return sinks
+
+class LatencyStats:
+    """Capture-to-alert latencies of the last size alerts, checked against a budget in seconds."""
+
+    def __init__(self, budget=5.0, size=1000):
+        self.budget = budget
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def report(self):
+        if not self.samples:
+            return {"count": 0, "budget_s": self.budget}
+        values = np.fromiter(self.samples, dtype=np.float64)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            "count": len(values),
+            "budget_s": self.budget,
+            "p50_s": float(p50),
+            "p95_s": float(p95),
+            "p99_s": float(p99),
+            "max_s": float(values.max()),
+            "over_budget": int((values > self.budget).sum()),
+        }
+
+class DeviationTracker:
+    """Tracks target/actual deviations per machine as readings are written and raises alerts.
+
+    A pair goes out of band when |actual - target| exceeds its threshold and
+    comes back once it drops below clear_ratio of it, so a value hovering at the
+    threshold doesn't flap. An alert is raised once the pair has been out of
+    band for hold_s seconds of screen time, and a "cleared" alert when it
+    returns. Every alert goes to each sink and carries its capture-to-alert
+    latency, which is also collected in latency for report().
+    """
+
+    def __init__(self, sinks=(print_sink,), thresholds=DEVIATION_THRESHOLDS, pairs=DEVIATION_PAIRS,
+                 hold_s=0.0, clear_ratio=0.8, latency_budget=5.0):
+        self.sinks = list(sinks)
+        self.thresholds = thresholds
+        self.pairs = pairs
+        self.hold_s = hold_s
+        self.clear_ratio = clear_ratio
+        self.latency = LatencyStats(latency_budget)
+        # (machine_id, table, pair) -> [started_at, alerted]
+        self._open = {}
+
+    def observe_row(self, table, row, machine_id):
+        """Feeds one stored row in. Usable as a reading listener. Returns the alerts raised."""
+        alerts = []
+        at = row.get("captured_at")
+        for pair, target_field, actual_field in self.pairs.get(table, ()):
+            target, actual = row.get(target_field), row.get(actual_field)
+            if target is None or actual is None or at is None:
+                continue
+            deviation = actual - target
+            threshold = self.thresholds.get(pair, 5.0)
+            key = (machine_id, table, pair)
+            state = self._open.get(key)
+            if state is None:
+                if abs(deviation) <= threshold:
+                    continue
+                state = self._open[key] = [at, False]
+            elif abs(deviation) < threshold * self.clear_ratio:
+                del self._open[key]
+                if state[1]:
+                    alerts.append(self._alert(machine_id, table, pair, "cleared", target, actual, deviation,
+                                              state[0], at))
+                continue
+            if not state[1] and (at - state[0]).total_seconds() >= self.hold_s:
+                state[1] = True
+                alerts.append(self._alert(machine_id, table, pair, "deviation", target, actual, deviation,
+                                          state[0], at))
+        for alert in alerts:
+            self._emit(alert)
+        return alerts
+
+    def _alert(self, machine_id, table, pair, kind, target, actual, deviation, started_at, at):
+        # Frame capture time when the pipeline recorded one, else the screen clock.
+        captured = frame_captured_at()
+        if captured is None:
+            captured = at.timestamp()
+        return Alert(machine_id, table, pair, kind, target, actual, deviation, started_at, at,
+                     (at - started_at).total_seconds(), time.time() - captured)
+
+    def _emit(self, alert):
+        self.latency.record(alert.latency_s)
+        for sink in self.sinks:
+            try:
+                sink(alert)
+            except Exception as e:
+                print(f"Alert sink failed: {e}")
+
+    def open_deviations(self, machine_id=None):
+        """Returns {(machine_id, table, pair): started_at} for pairs currently out of band."""
+        return {key: state[0] for key, state in self._open.items() if machine_id is None or key[0] == machine_id}
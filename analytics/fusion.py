@@ -0,0 +1,206 @@
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from database.backends import get_backend
+from database.db_setup import get_db_connection, DEFAULT_MACHINE_ID
+from database.migrations import ensure_schema
+from database.queries import stream_chunks
+
+# Quantities shown on more than one screen: name -> (table, field) per screen.
+FUSED_QUANTITIES = {
+    "oil_heater_temp_1": [("control_panel2", "OIL_HEATER_Actual_Temp_1"), ("control_panel4", "OilHeater1_Temp_C")],
+    "oil_heater_temp_2": [("control_panel2", "OIL_HEATER_Actual_Temp_2"), ("control_panel4", "OilHeater2_Temp_C")],
+    # The overview screens label line speed rpm, but display the same m/min figure as the extruder screen.
+    "line_speed": [
+        ("control_panel3", "LineSpeed_rpm"), ("control_panel5", "LineSpeed_rpm"), ("control_panel6", "LineSpeed_m_min"),
+    ],
+    "extruder_speed": [
+        ("control_panel3", "ExtruderSpeed_rpm"), ("control_panel5", "ExtruderSpeed_rpm"),
+        ("control_panel6", "Extruder_rpm"), ("control_panel4", "Extruder_speed_rpm"),
+    ],
+    "take_off_speed": [("control_panel3", "TakeOffSpeed_mpm"), ("control_panel5", "TakeOffSpeed_mpm")],
+}
+
+# Allowed disagreement per quantity: (absolute, relative to the reference value).
+TOLERANCES = {
+    "oil_heater_temp_1": (2.0, 0.01),
+    "oil_heater_temp_2": (2.0, 0.01),
+    "line_speed": (1.0, 0.02),
+    "extruder_speed": (1.0, 0.02),
+    "take_off_speed": (1.0, 0.02),
+}
+
+DEFAULT_WINDOW = timedelta(seconds=60)
+
+FUSED_COLUMNS = ["captured_at", "quantity", "value", "source_count", "spread", "conflict"]
+SUSPECT_COLUMNS = ["screen", "reading_id", "field", "source_image_hash", "captured_at", "value", "expected"]
+
+def load_fields(table, fields, start, end, machine_id=DEFAULT_MACHINE_ID, conn=None):
+    """Reads the given fields of one screen table into a DataFrame ordered by captured_at."""
+    columns = ["id", "captured_at", "source_image_hash", *fields]
+    sql = f'''SELECT {", ".join(columns)} FROM {table}
+              WHERE machine_id = %s AND captured_at >= %s AND captured_at < %s
+              ORDER BY captured_at'''
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        chunks = [pd.DataFrame.from_records(rows, columns=columns)
+                  for rows in stream_chunks(conn, sql, (machine_id, start, end))]
+    finally:
+        if own_conn:
+            conn.close()
+    frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    frame["captured_at"] = pd.to_datetime(frame["captured_at"]).astype("datetime64[ns]")
+    for field in fields:
+        frame[field] = pd.to_numeric(frame[field], errors="coerce").astype(np.float64)
+    return frame
+
+def _concat(frames, columns):
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True)[columns] if frames else pd.DataFrame(columns=columns)
+
+def _source_series(frame, table, field):
+    series = frame[["captured_at", "id", "source_image_hash", field]].rename(columns={field: "value"})
+    series = series.dropna(subset=["value"]).reset_index(drop=True)
+    # How far each reading jumped from the screen's previous one; the steadier screen wins a tie.
+    series["jump"] = series["value"].diff().abs().fillna(0.0)
+    series["reading_at"] = series["captured_at"]
+    return series
+
+def fuse_quantity(quantity, frames, window=DEFAULT_WINDOW):
+    """Aligns one quantity across its screens and returns (fused, suspects) DataFrames.
+
+    Every reading time of any screen becomes a row, joined as-of (nearest within
+    window) with each screen's reading. With three or more screens the median is
+    the reference; with two, the screen whose value moved less since its previous
+    reading is. Screens further than the tolerance from the reference are suspect
+    and the fused value is the mean of the others. When every screen is suspect,
+    as when four split into two disagreeing pairs, the fused value is the median
+    and the row is marked as a conflict.
+    """
+    series = [(table, field, _source_series(frames[table], table, field))
+              for table, field in FUSED_QUANTITIES[quantity] if table in frames]
+    series = [(table, field, s) for table, field, s in series if not s.empty]
+    if not series:
+        return pd.DataFrame(columns=FUSED_COLUMNS), pd.DataFrame(columns=SUSPECT_COLUMNS)
+    anchor = pd.DataFrame({"captured_at": np.unique(np.concatenate(
+        [s["captured_at"].to_numpy() for _, _, s in series]))})
+    aligned = [pd.merge_asof(anchor, s, on="captured_at", direction="nearest", tolerance=window)
+               for _, _, s in series]
+    values = np.column_stack([a["value"].to_numpy(np.float64) for a in aligned])
+    present = ~np.isnan(values)
+    counts = present.sum(axis=1)
+
+    jumps = np.where(present, np.column_stack([a["jump"].to_numpy(np.float64) for a in aligned]), np.inf)
+    steadier = values[np.arange(len(values)), np.argmin(jumps, axis=1)]
+    reference = np.where(counts == 2, steadier, np.nanmedian(values, axis=1))
+    absolute, relative = TOLERANCES[quantity]
+    tolerance = np.maximum(absolute, relative * np.abs(reference))
+    suspect = present & (np.abs(values - reference[:, None]) > tolerance[:, None]) & (counts >= 2)[:, None]
+
+    trusted = present & ~suspect
+    trusted_counts = trusted.sum(axis=1)
+    mean = np.divide(np.where(trusted, values, 0.0).sum(axis=1), trusted_counts,
+                     out=np.full(len(values), np.nan), where=trusted_counts > 0)
+    conflict = trusted_counts == 0
+    fused = pd.DataFrame({
+        "captured_at": anchor["captured_at"],
+        "quantity": quantity,
+        "value": np.where(conflict, reference, mean),
+        "source_count": counts,
+        "spread": np.nanmax(values, axis=1) - np.nanmin(values, axis=1),
+        "conflict": conflict,
+    })
+
+    suspects = []
+    for (table, field, _), a, column in zip(series, aligned, suspect.T):
+        if not column.any():
+            continue
+        flagged = a.loc[column, ["id", "source_image_hash", "reading_at", "value"]].copy()
+        flagged["expected"] = reference[column]
+        flagged = flagged.rename(columns={"id": "reading_id", "reading_at": "captured_at"})
+        flagged["screen"], flagged["field"] = table, field
+        suspects.append(flagged.drop_duplicates("reading_id"))
+    return fused, _concat(suspects, SUSPECT_COLUMNS)
+
+def fuse(start, end, machine_id=DEFAULT_MACHINE_ID, window=DEFAULT_WINDOW, conn=None):
+    """Fuses every quantity in FUSED_QUANTITIES over [start, end). Returns (fused, suspects)."""
+    fields = {}
+    for sources in FUSED_QUANTITIES.values():
+        for table, field in sources:
+            fields.setdefault(table, []).append(field)
+    frames = {table: load_fields(table, table_fields, start, end, machine_id, conn)
+              for table, table_fields in fields.items()}
+    results = [fuse_quantity(quantity, frames, window) for quantity in FUSED_QUANTITIES]
+    return (_concat([f for f, _ in results], FUSED_COLUMNS),
+            _concat([s for _, s in results], SUSPECT_COLUMNS))
+
+def _py(value):
+    """Converts pandas/NumPy scalars to the plain Python values database drivers accept."""
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def store_fusion(conn, machine_id, fused, suspects):
+    """Upserts fused values and suspect fields. Suspects already handled keep their status."""
+    backend = get_backend()
+    with conn.cursor() as c:
+        if not fused.empty:
+            suffix = backend.upsert_suffix(("machine_id", "quantity", "captured_at"),
+                                           {"value": "replace", "source_count": "replace", "spread": "replace",
+                                            "conflict": "replace"})
+            c.executemany(f'''INSERT INTO fused_readings (machine_id, {", ".join(FUSED_COLUMNS)})
+                              VALUES ({", ".join(["%s"] * (len(FUSED_COLUMNS) + 1))}) {suffix}''',
+                          [(machine_id, *map(_py, row)) for row in fused[FUSED_COLUMNS].itertuples(index=False)])
+        if not suspects.empty:
+            suffix = backend.upsert_suffix(("screen", "reading_id", "field"),
+                                           {"value": "replace", "expected": "replace"})
+            c.executemany(f'''INSERT INTO suspect_fields (machine_id, {", ".join(SUSPECT_COLUMNS)})
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s) {suffix}''',
+                          [(machine_id, *map(_py, row)) for row in suspects[SUSPECT_COLUMNS].itertuples(index=False)])
+
+def run_fusion(start, end, machine_id=DEFAULT_MACHINE_ID, window=DEFAULT_WINDOW):
+    """Fuses a time range and stores the result. Returns (fused, suspects)."""
+    ensure_schema()
+    with get_backend().transaction() as conn:
+        fused, suspects = fuse(start, end, machine_id, window, conn)
+        store_fusion(conn, machine_id, fused, suspects)
+    return fused, suspects
+
+def pending_reextractions(limit=100, conn=None):
+    """Returns suspect fields still waiting for a re-extraction, oldest first."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute(f'''SELECT id, machine_id, screen, reading_id, field, source_image_hash, captured_at,
+                                 value, expected
+                          FROM suspect_fields WHERE status = 'pending'
+                          ORDER BY captured_at LIMIT {int(limit)}''')
+            columns = [d[0] for d in c.description]
+            return [dict(zip(columns, row)) for row in c.fetchall()]
+    finally:
+        if own_conn:
+            conn.close()
+
+def mark_suspect(suspect_id, status):
+    """Records the outcome of a re-extraction, e.g. "confirmed" or "corrected"."""
+    with get_backend().transaction() as conn:
+        with conn.cursor() as c:
+            c.execute("UPDATE suspect_fields SET status = %s WHERE id = %s", (status, suspect_id))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fuse quantities shown on several screens and flag misreads.")
+    parser.add_argument("--minutes", type=int, default=60, help="How far back to fuse")
+    parser.add_argument("--machine", default=DEFAULT_MACHINE_ID, help="Machine id")
+    parser.add_argument("--window", type=int, default=60, help="As-of join window in seconds")
+    args = parser.parse_args()
+    end = datetime.now()
+    fused, suspects = run_fusion(end - timedelta(minutes=args.minutes), end, args.machine,
+                                 timedelta(seconds=args.window))
+    print(f"Fused {len(fused)} values, {len(suspects)} suspect fields marked for re-extraction.")
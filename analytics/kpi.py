@@ -0,0 +1,191 @@
+from collections import deque
+from datetime import timedelta
+
+# Hours at which shifts start; a shift runs until the next start.
+SHIFT_START_HOURS = (6, 14, 22)
+
+# Resolution of an hour counter shown as H:MM; one interval can show up to this much more than its length.
+HOUR_COUNTER_RESOLUTION_S = 60.0
+
+# Screens the KPI engine tracks, and the kind of machine they show.
+KPI_TABLES = {
+    "control_panel9": "loom",
+    "control_panel6": "extruder",
+}
+
+def shift_start(at, start_hours=SHIFT_START_HOURS):
+    """Returns the start of the shift at falls in."""
+    day = at.replace(hour=0, minute=0, second=0, microsecond=0)
+    earlier = [day + timedelta(hours=h) for h in start_hours if day + timedelta(hours=h) <= at]
+    if earlier:
+        return earlier[-1]
+    return day - timedelta(days=1) + timedelta(hours=start_hours[-1])
+
+def parse_hours(value):
+    """Reads an hour counter shown as 1234.5 or 1234:30. Returns hours as a float, or None."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().lower().replace("h", "").replace(",", ".").strip()
+    try:
+        if ":" in text:
+            hours, minutes = text.split(":")[:2]
+            return int(hours) + int(minutes) / 60
+        return float(text)
+    except ValueError:
+        return None
+
+def counter_delta(previous, current):
+    """Increase of a cumulative counter. A drop means it was reset, so the new value is the increase."""
+    if previous is None or current is None:
+        return 0.0
+    return current - previous if current >= previous else current
+
+class ShiftKPI:
+    """Running totals of one machine screen over one shift."""
+
+    def __init__(self, machine_id, table, start):
+        self.machine_id = machine_id
+        self.table = table
+        self.start = start
+        self.last_at = None
+        self.observed_s = 0.0
+        self.running_s = 0.0
+        self.counted_s = 0.0
+        self.counted_observed_s = 0.0
+        self.output = 0.0
+        self.breaks = 0.0
+        self.rate_seconds = 0.0
+        self.rate_weight_s = 0.0
+        self.readings = 0
+
+    @property
+    def running_total_s(self):
+        """Running time, with the hour counter's increases capped once at the time they were observed over."""
+        return self.running_s + min(self.counted_s, self.counted_observed_s)
+
+    def snapshot(self, rated_rate=None):
+        """Returns the shift's KPIs: availability, performance, output rate, break rate and OEE.
+
+        OEE leaves out quality, which the screens don't show.
+        """
+        running_s = self.running_total_s
+        availability = running_s / self.observed_s if self.observed_s else None
+        running_h = running_s / 3600
+        mean_rate = self.rate_seconds / self.rate_weight_s if self.rate_weight_s else None
+        performance = mean_rate / rated_rate if mean_rate is not None and rated_rate else None
+        return {
+            "machine_id": self.machine_id,
+            "table": self.table,
+            "shift_start": self.start,
+            "last_reading": self.last_at,
+            "readings": self.readings,
+            "availability": availability,
+            "performance": performance,
+            "output": self.output,
+            "output_rate": self.output / (self.observed_s / 3600) if self.observed_s else None,
+            "break_rate": self.breaks / running_h if running_h else None,
+            "oee": availability * performance if availability is not None and performance is not None else None,
+        }
+
+class KPIEngine:
+    """Per machine and shift KPIs, updated incrementally from each reading as it lands.
+
+    Looms (control_panel9) run while their operating-hours counter advances,
+    produce Fabric_Mtr metres and count warp and weft breaks; performance is
+    mean picks/min against rated_picks_per_min. Extruders (control_panel6) run
+    while LineSpeed_m_min is above zero and produce Output_kg, read as a
+    cumulative counter; performance is kg/h while running against
+    rated_output_kg_h. Counters that drop were reset. Intervals longer than
+    max_gap (missed frames, downtime of the capture itself) are not counted.
+    The current shift is served from memory, with the last history shifts kept.
+    """
+
+    def __init__(self, rated_picks_per_min=None, rated_output_kg_h=None, start_hours=SHIFT_START_HOURS,
+                 max_gap=timedelta(minutes=15), history=21):
+        self.rated_picks_per_min = rated_picks_per_min or {}
+        self.rated_output_kg_h = rated_output_kg_h or {}
+        self.start_hours = start_hours
+        self.max_gap = max_gap
+        self.history = history
+        self._previous = {}
+        self._current = {}
+        self._past = {}
+
+    def observe_row(self, table, row, machine_id):
+        """Feeds one stored row in. Usable as a reading listener."""
+        kind = KPI_TABLES.get(table)
+        at = row.get("captured_at")
+        if kind is None or at is None:
+            return
+        key = (machine_id, table)
+        previous = self._previous.get(key)
+        if previous is not None and at <= previous["captured_at"]:
+            return
+        shift = self._shift_for(key, at)
+        shift.readings += 1
+        shift.last_at = at
+        self._previous[key] = row
+        if previous is None:
+            return
+        elapsed = (at - previous["captured_at"]).total_seconds()
+        if elapsed > self.max_gap.total_seconds():
+            return
+        shift.observed_s += elapsed
+        if kind == "loom":
+            self._accrue_loom(shift, previous, row, elapsed)
+        else:
+            self._accrue_extruder(shift, previous, row, elapsed)
+
+    def _shift_for(self, key, at):
+        start = shift_start(at, self.start_hours)
+        shift = self._current.get(key)
+        if shift is None or shift.start != start:
+            if shift is not None:
+                self._past.setdefault(key, deque(maxlen=self.history)).append(shift)
+            shift = self._current[key] = ShiftKPI(key[0], key[1], start)
+        return shift
+
+    def _accrue_loom(self, shift, previous, row, elapsed):
+        operating = parse_hours(row.get("OperatingTime_Hrs"))
+        if operating is not None:
+            # The counter ticks in whole minutes, so single intervals over- and undershoot;
+            # only the shift total is capped. An increase no tick can explain is a misread.
+            running = counter_delta(parse_hours(previous.get("OperatingTime_Hrs")), operating) * 3600
+            if running > elapsed + HOUR_COUNTER_RESOLUTION_S:
+                running = elapsed
+            shift.counted_s += running
+            shift.counted_observed_s += elapsed
+        else:
+            running = elapsed if (row.get("Picks_per_Min") or 0) > 0 else 0.0
+            shift.running_s += running
+        shift.output += counter_delta(previous.get("Fabric_Mtr"), row.get("Fabric_Mtr"))
+        shift.breaks += (counter_delta(previous.get("WarpBreak"), row.get("WarpBreak"))
+                         + counter_delta(previous.get("WeftBreak"), row.get("WeftBreak")))
+        shift.rate_seconds += (row.get("Picks_per_Min") or 0) * running
+        shift.rate_weight_s += running
+
+    def _accrue_extruder(self, shift, previous, row, elapsed):
+        if (previous.get("LineSpeed_m_min") or 0) <= 0:
+            return
+        shift.running_s += elapsed
+        produced = counter_delta(previous.get("Output_kg"), row.get("Output_kg"))
+        shift.output += produced
+        shift.rate_seconds += produced * 3600
+        shift.rate_weight_s += elapsed
+
+    def _rated(self, machine_id, table):
+        rated = self.rated_picks_per_min if KPI_TABLES[table] == "loom" else self.rated_output_kg_h
+        return rated.get(machine_id)
+
+    def current(self, machine_id, table=None):
+        """Returns snapshots of the current shift for machine_id, one per tracked screen."""
+        return [shift.snapshot(self._rated(m, t)) for (m, t), shift in self._current.items()
+                if m == machine_id and (table is None or t == table)]
+
+    def shifts(self, machine_id, table):
+        """Returns snapshots of the kept past shifts, oldest first, then the current one."""
+        key = (machine_id, table)
+        shifts = list(self._past.get(key, ())) + ([self._current[key]] if key in self._current else [])
+        return [shift.snapshot(self._rated(machine_id, table)) for shift in shifts]
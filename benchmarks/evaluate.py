@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import importlib
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PIL import Image
+
+# Where each screen processor lives; image7-10 create their own Gemini model, which the runner swaps out.
+PROCESSOR_MODULES = {
+    "image1": "processors.image1",
+    "imag2": "processors.imag2",
+    "imag3": "processors.imag3",
+    "imag6": "processors.imag6",
+    "extrusion_line_overview_processor": "processors.extrusion_line_overview_processor",
+    "extruder_details_processor": "processors.extruder_details_processor",
+    "image7": "image7",
+    "image8": "image8",
+    "image9": "image9",
+    "image10": "image10",
+}
+STANDALONE = {"image7", "image8", "image9", "image10"}
+
+def _terse(prompt):
+    """Field names only, without descriptions or the JSON example."""
+    prompt = prompt.split("Required JSON Format Example")[0]
+    return re.sub(r"^\* \**([A-Za-z0-9_]+)\**:.*$", r"* \1", prompt, flags=re.MULTILINE)
+
+def _loose(prompt):
+    """Without the instructions to return bare numbers, which processors.normalize now takes care of."""
+    return re.sub(r"Ensure (?:all )?numeric values are numbers[^.]*\.\s*", "", prompt)
+
+# Prompt variant -> rewrite of a processor's module-level prompt.
+PROMPT_VARIANTS = {
+    "default": lambda prompt: prompt,
+    "terse": _terse,
+    "loose": _loose,
+}
+
+def create_model(spec):
+    """Builds a chat model from {"provider": "ollama" | "google" | "replay", "name": ...}."""
+    provider = spec.get("provider", "ollama")
+    if provider == "ollama":
+        from langchain_ollama import ChatOllama
+        return ChatOllama(model=spec["name"], reasoning=False)
+    if provider == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model=spec["name"], google_api_key=os.getenv("GOOGLE_API_KEY"))
+    if provider == "replay":
+        from benchmarks.fake_llm import LatencyModel, ReplayChatModel
+        return ReplayChatModel.from_file(spec.get("recordings", "benchmarks/recordings.json"),
+                                         LatencyModel(spec.get("latency", "fixed:0")))
+    raise ValueError(f"Unknown model provider {provider}")
+
+class UsageMeter:
+    """Passes calls through to llm, adding up the token usage its replies report."""
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or ""
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def _count(self, response):
+        usage = getattr(response, "usage_metadata", None) or {}
+        self.input_tokens += usage.get("input_tokens", 0)
+        self.output_tokens += usage.get("output_tokens", 0)
+
+    def stream(self, messages):
+        response = None
+        for chunk in self.llm.stream(messages):
+            response = chunk if response is None else response + chunk
+            yield chunk
+        self._count(response)
+
+    def invoke(self, messages):
+        response = self.llm.invoke(messages)
+        self._count(response)
+        return response
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return None
+
+def _text(value):
+    return re.sub(r"[^0-9a-z]", "", str(value).lower())
+
+def field_correct(expected, actual):
+    """Numbers match within 0.5%, text ignoring case, spacing and punctuation, lists element by element."""
+    if expected is None:
+        return actual is None
+    if actual is None:
+        return False
+    if isinstance(expected, list):
+        if not isinstance(actual, list):
+            return False
+        found = {_text(item) for item in actual}
+        return all(_text(item) in found for item in expected)
+    expected_number, actual_number = _number(expected), _number(actual)
+    if expected_number is not None and actual_number is not None:
+        return abs(expected_number - actual_number) <= max(1e-6, 0.005 * abs(expected_number))
+    return _text(expected) == _text(actual)
+
+def score(fields, reply):
+    """Returns (correct, null, labelled) field counts of a reply's first item against the labels."""
+    items = reply.get("items") if isinstance(reply, dict) else None
+    item = items[0] if items and isinstance(items[0], dict) else {}
+    correct = sum(field_correct(expected, item.get(field)) for field, expected in fields.items())
+    null = sum(item.get(field) is None for field, expected in fields.items() if expected is not None)
+    return correct, null, len(fields)
+
+def resize(image, width):
+    if not width or image.width <= width:
+        return image
+    return image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+def _init_worker():
+    workdir = tempfile.mkdtemp(prefix="woven-eval-")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "eval.db")
+    os.environ["SPOOL_DIR"] = os.path.join(workdir, "spool")
+    os.environ.setdefault("GOOGLE_API_KEY", "evaluation")
+    from database.migrations import ensure_schema
+    ensure_schema()
+
+def run_job(job):
+    """Runs one processor on one labelled image under one configuration. Returns the result record."""
+    module = importlib.import_module(PROCESSOR_MODULES[job["processor"]])
+    module.prompt = PROMPT_VARIANTS[job["prompt"]](module.__dict__.setdefault("_original_prompt", module.prompt))
+    llm = UsageMeter(create_model(job["model"]))
+    with Image.open(job["image"]) as img:
+        image = resize(img.convert("RGB"), job["width"])
+    started = time.perf_counter()
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            if job["processor"] in STANDALONE:
+                module.ChatGoogleGenerativeAI = lambda **kwargs: llm
+                reply = module.generate(image)
+            else:
+                reply = module.generate(image, llm)
+        except Exception as e:
+            reply, error = None, str(e)
+    if reply is None and error is None:
+        error = "No reply parsed"
+    seconds = time.perf_counter() - started
+    correct, null, labelled = score(job["fields"], reply or {})
+    return {"key": job["key"], "model": job["model"]["name"], "prompt": job["prompt"], "width": job["width"],
+            "image": job["image"], "processor": job["processor"], "correct": correct, "null": null,
+            "labelled": labelled, "input_tokens": llm.input_tokens, "output_tokens": llm.output_tokens,
+            "seconds": seconds, "error": error}
+
+def build_jobs(grid, labels, repeats):
+    jobs = []
+    for model, prompt, width, (image, label), repeat in itertools.product(
+            grid["models"], grid.get("prompts", ["default"]), grid.get("widths", [None]), labels.items(),
+            range(repeats)):
+        key = f"{model['name']}|{prompt}|{width}|{image}|{repeat}"
+        jobs.append({"key": key, "model": model, "prompt": prompt, "width": width, "image": image,
+                     "processor": label["processor"], "fields": label["fields"]})
+    return jobs
+
+def load_results(path):
+    """Results already in the JSON-lines file at path, by job key. Failed jobs are left out, so they run again."""
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record["error"] is None:
+                        results[record["key"]] = record
+    return results
+
+def summarize(records):
+    """Per configuration: accuracy, null rate, tokens and seconds per frame, plus whether it is Pareto-optimal."""
+    configs = {}
+    for record in records:
+        configs.setdefault((record["model"], record["prompt"], record["width"]), []).append(record)
+    rows = []
+    for (model, prompt, width), group in sorted(configs.items(), key=lambda item: str(item[0])):
+        labelled = sum(r["labelled"] for r in group)
+        rows.append({
+            "model": model, "prompt": prompt, "width": width, "frames": len(group),
+            "errors": sum(r["error"] is not None for r in group),
+            "accuracy": sum(r["correct"] for r in group) / labelled if labelled else 0.0,
+            "null_rate": sum(r["null"] for r in group) / labelled if labelled else 0.0,
+            "input_tokens": float(np.mean([r["input_tokens"] for r in group])),
+            "output_tokens": float(np.mean([r["output_tokens"] for r in group])),
+            "seconds_per_frame": float(np.mean([r["seconds"] for r in group])),
+            "p95_seconds": float(np.percentile([r["seconds"] for r in group], 95)),
+        })
+    for row in rows:
+        row["pareto"] = not any(
+            other["accuracy"] >= row["accuracy"] and other["seconds_per_frame"] <= row["seconds_per_frame"]
+            and (other["accuracy"] > row["accuracy"] or other["seconds_per_frame"] < row["seconds_per_frame"])
+            for other in rows)
+    return rows
+
+def print_summary(rows):
+    print(f"{'model':<24} {'prompt':<10} {'width':>6} {'acc':>6} {'null':>6} {'in tok':>8} {'out tok':>8} "
+          f"{'s/frame':>8} pareto")
+    for row in sorted(rows, key=lambda row: row["seconds_per_frame"]):
+        print(f"{row['model']:<24} {row['prompt']:<10} {str(row['width'] or 'full'):>6} {row['accuracy']:6.1%} "
+              f"{row['null_rate']:6.1%} {row['input_tokens']:8.0f} {row['output_tokens']:8.0f} "
+              f"{row['seconds_per_frame']:8.2f} {'*' if row['pareto'] else ''}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score screen processors across models, prompts and resolutions.")
+    parser.add_argument("--grid", default="benchmarks/grid.json",
+                        help='JSON: {"models": [{"provider", "name"}], "prompts": [...], "widths": [null, 1280]}')
+    parser.add_argument("--labels", default="benchmarks/labels.json", help="Ground truth per sample image")
+    parser.add_argument("--results", default="benchmarks/results/evaluation.jsonl",
+                        help="Results so far; finished jobs are skipped")
+    parser.add_argument("--summary", help="Write the per-configuration summary as JSON here")
+    parser.add_argument("--workers", type=int, default=2, help="Jobs run in parallel")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per image and configuration")
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+    with open(args.labels) as f:
+        labels = json.load(f)
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    done = load_results(args.results)
+    jobs = [job for job in build_jobs(grid, labels, args.repeats) if job["key"] not in done]
+    print(f"{len(done)} results already in {args.results}, {len(jobs)} jobs to run.")
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker) as pool, open(args.results, "a") as out:
+        for future in as_completed([pool.submit(run_job, job) for job in jobs]):
+            record = future.result()
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            done[record["key"]] = record
+            if record["error"]:
+                print(f"{record['key']} failed: {record['error']}")
+    rows = summarize(done.values())
+    print_summary(rows)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(rows, f, indent=2)
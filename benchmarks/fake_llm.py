@@ -0,0 +1,160 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from langchain_core.messages import AIMessageChunk
+from metrics import current_processor
+
+# Tokens a replayed image is billed as, roughly what a hosted vision model charges for one screen photo.
+IMAGE_TOKENS = 258
+
+def estimate_usage(messages, reply):
+    """Rough token counts of a replayed call, about four characters a token."""
+    text = images = 0
+    for message in messages:
+        parts = message.content if isinstance(message.content, list) else [message.content]
+        for part in parts:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                images += 1
+            elif isinstance(part, dict):
+                text += len(part.get("text", ""))
+            else:
+                text += len(part)
+    input_tokens = text // 4 + images * IMAGE_TOKENS
+    output_tokens = max(len(reply) // 4, 1)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+            "input_token_details": {"image": images * IMAGE_TOKENS}}
+
+def image_key(messages):
+    """Returns the SHA-256 of the first image data URL in messages, or "" when there is none."""
+    for message in messages:
+        if isinstance(message.content, list):
+            for part in message.content:
+                if isinstance(part, dict) and part.get("type") == "image_url":
+                    url = part["image_url"]
+                    url = url["url"] if isinstance(url, dict) else url
+                    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return ""
+
+class LatencyModel:
+    """Seconds a model takes to reply, drawn from a spec.
+
+    "fixed:2.0", "uniform:1.0,3.0" or "lognormal:2.0,0.4" (median seconds and
+    sigma of the log). first_token is the share of the reply time spent before
+    the first chunk arrives.
+    """
+
+    def __init__(self, spec="fixed:0", first_token=0.6, seed=0):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",")] if params else [0.0]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {spec}")
+        self.first_token = first_token
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.kind == "uniform":
+                return self._random.uniform(*self.params)
+            if self.kind == "lognormal":
+                median, sigma = self.params
+                return median * self._random.lognormvariate(0.0, sigma)
+            return self.params[0]
+
+class ReplayChatModel:
+    """Chat model stand-in that replays recorded replies with a configurable latency.
+
+    recordings maps processor name -> image key -> reply text, as written by
+    RecordingChatModel. The processor is the one labelled on the calling thread
+    (metrics.label_stages). A frame that was never recorded, like a synthetic
+    variant, gets one of the processor's recorded replies picked by its image
+    key, so replays stay deterministic.
+    """
+
+    model = "replay"
+
+    def __init__(self, recordings, latency=None, chunks=4):
+        self.recordings = recordings
+        self.latency = latency or LatencyModel()
+        self.chunks = chunks
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path, latency=None):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), latency)
+
+    def reply(self, messages):
+        processor = current_processor()
+        replies = self.recordings.get(processor)
+        if not replies:
+            raise KeyError(f"No recorded replies for processor {processor!r}")
+        key = image_key(messages)
+        if key in replies:
+            return replies[key]
+        ordered = sorted(replies)
+        return replies[ordered[int(key or "0", 16) % len(ordered)]]
+
+    def stream(self, messages):
+        self.calls += 1
+        text = self.reply(messages)
+        seconds = self.latency.sample()
+        time.sleep(seconds * self.latency.first_token)
+        size = max(len(text) // self.chunks, 1)
+        pieces = [text[start:start + size] for start in range(0, len(text), size)] or [""]
+        rest = seconds * (1 - self.latency.first_token) / max(len(pieces) - 1, 1)
+        for position, piece in enumerate(pieces):
+            if position:
+                time.sleep(rest)
+            last = position == len(pieces) - 1
+            yield AIMessageChunk(content=piece, usage_metadata=estimate_usage(messages, text) if last else None)
+
+    def invoke(self, messages):
+        response = None
+        for chunk in self.stream(messages):
+            response = chunk if response is None else response + chunk
+        return response
+
+class RecordingChatModel:
+    """Wraps a real chat model and records its replies in the layout ReplayChatModel reads.
+
+    Call save() after the run to write them to path, merged with what is there.
+    """
+
+    def __init__(self, llm, path):
+        self.llm = llm
+        self.path = path
+        self.model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or ""
+        self.recordings = {}
+        self._lock = threading.Lock()
+
+    def _record(self, messages, text):
+        with self._lock:
+            self.recordings.setdefault(current_processor(), {})[image_key(messages)] = text
+
+    def stream(self, messages):
+        response = None
+        for chunk in self.llm.stream(messages):
+            response = chunk if response is None else response + chunk
+            yield chunk
+        if response is not None:
+            self._record(messages, response.content)
+
+    def invoke(self, messages):
+        response = self.llm.invoke(messages)
+        self._record(messages, response.content)
+        return response
+
+    def save(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                recordings = json.load(f)
+        except FileNotFoundError:
+            recordings = {}
+        for processor, replies in self.recordings.items():
+            recordings.setdefault(processor, {}).update(replies)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(recordings, f, indent=2, ensure_ascii=False, sort_keys=True)
@@ -0,0 +1,73 @@
+import argparse
+import importlib
+import json
+import os
+import time
+import numpy as np
+import json_repair
+
+# What the processors did before processors.common.parse_json and validate_items: repair every reply, validate item by item.
+def legacy_parse(text):
+    return json_repair.loads(text)
+
+def legacy_validate(model, items):
+    return [model(**item) for item in items]
+
+def variants(text):
+    """The recorded reply as it came, inside a ```json fence, and with trailing chatter only repair gets past."""
+    bare = text.strip()
+    if bare.startswith("```"):
+        bare = bare.strip("`").removeprefix("json").strip()
+    return {"plain": bare, "fenced": f"```json\n{bare}\n```", "chatter": bare + "\nLet me know if you need more."}
+
+def per_call(function, repeat):
+    """Median seconds of function() over repeat calls."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return float(np.median(times))
+
+def run(recordings, repeat):
+    from benchmarks.evaluate import PROCESSOR_MODULES
+    from processors.common import parse_json, validate_items
+    rows = []
+    for processor, replies in sorted(recordings.items()):
+        if processor not in PROCESSOR_MODULES:
+            continue
+        module = importlib.import_module(PROCESSOR_MODULES[processor])
+        model = getattr(module, "ControlPanelData", None) or module.ControlPanelData2
+        for kind in ("plain", "fenced", "chatter"):
+            texts = [variants(text)[kind] for text in replies.values()]
+            items = [parse_json(text)["items"] for text in texts]
+            rows.append({
+                "processor": processor,
+                "reply": kind,
+                "responses": len(texts),
+                "legacy_parse_us": np.mean([per_call(lambda: legacy_parse(text), repeat) for text in texts]) * 1e6,
+                "parse_us": np.mean([per_call(lambda: parse_json(text), repeat) for text in texts]) * 1e6,
+                "legacy_validate_us": np.mean([per_call(lambda: legacy_validate(model, reply), repeat)
+                                               for reply in items]) * 1e6,
+                "validate_us": np.mean([per_call(lambda: validate_items(model, reply), repeat)
+                                        for reply in items]) * 1e6,
+            })
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time parsing and validating model replies, old path against new.")
+    parser.add_argument("--recordings", default="benchmarks/recordings.json", help="Recorded model replies")
+    parser.add_argument("--repeat", type=int, default=200, help="Calls timed per reply")
+    parser.add_argument("--output", help="Write the results as JSON here")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    with open(args.recordings, encoding="utf-8") as f:
+        rows = run(json.load(f), args.repeat)
+    print(f"{'processor':<36} {'reply':<8} {'parse us':>18} {'validate us':>18}")
+    for row in rows:
+        print(f"{row['processor']:<36} {row['reply']:<8} {row['legacy_parse_us']:8.1f} -> {row['parse_us']:7.1f} "
+              f"{row['legacy_validate_us']:8.1f} -> {row['validate_us']:7.1f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,184 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+import numpy as np
+from PIL import Image, ImageEnhance
+
+SAMPLE_IMAGES = [f"images/{number}.jpg" for number in range(1, 11)]
+
+# Screens of the standalone scripts (image7-10.py), which pick their own model instead of being classified.
+DIRECT_SCREENS = {"7.jpg": "image7", "8.jpg": "image8", "9.jpg": "image9", "10.jpg": "image10"}
+
+class StageRecorder:
+    """Span listener keeping every stage timing of a run."""
+
+    def __init__(self):
+        self.seconds = defaultdict(list)
+        self.cpu_seconds = defaultdict(float)
+        self.peak_bytes = defaultdict(int)
+
+    def __call__(self, stage, processor, model, seconds, cpu_seconds, peak_bytes):
+        self.seconds[stage].append(seconds)
+        if cpu_seconds is not None:
+            self.cpu_seconds[stage] += cpu_seconds
+        if peak_bytes is not None:
+            self.peak_bytes[stage] = max(self.peak_bytes[stage], peak_bytes)
+
+    def report(self):
+        stages = {}
+        for stage, values in sorted(self.seconds.items()):
+            values = np.asarray(values)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {
+                "count": len(values),
+                "mean_s": float(values.mean()),
+                "p50_s": float(p50),
+                "p95_s": float(p95),
+                "p99_s": float(p99),
+                "max_s": float(values.max()),
+                "cpu_s": self.cpu_seconds.get(stage),
+                "peak_bytes": self.peak_bytes.get(stage),
+            }
+        return stages
+
+def sample_frames(paths, count, seed=0):
+    """Yields (name, image) for count frames cycling through paths.
+
+    Past the first pass every frame is a variant with jittered brightness and a
+    small shift, so it hashes as a new frame the way a camera's frames do.
+    """
+    originals = []
+    for path in paths:
+        with Image.open(path) as img:
+            originals.append((os.path.basename(path), img.convert("RGB")))
+    generator = random.Random(seed)
+    for index in range(count):
+        name, image = originals[index % len(originals)]
+        if index >= len(originals):
+            image = ImageEnhance.Brightness(image).enhance(generator.uniform(0.92, 1.08))
+            image = image.rotate(0, translate=(generator.randint(-4, 4), generator.randint(-4, 4)))
+        yield name, image
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(frames, llm, verbose=False):
+    """Runs frames through the pipeline. Returns (frames done, frames failed, wall seconds, CPU seconds)."""
+    import main
+    from metrics import frame_timer
+    direct = {}
+    for name, module_name in DIRECT_SCREENS.items():
+        module = importlib.import_module(module_name)
+        module.ChatGoogleGenerativeAI = lambda **kwargs: llm
+        direct[name] = module.generate
+    done = failed = 0
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for name, image in frames:
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        try:
+            with output:
+                if name in direct:
+                    with frame_timer(name):
+                        direct[name](image)
+                else:
+                    main.process_image(image, llm)
+            done += 1
+        except Exception as e:
+            print(f"Frame {name} failed: {e}")
+            failed += 1
+    return done, failed, time.perf_counter() - started, time.process_time() - cpu_started
+
+def compare(result, baseline, tolerance):
+    """Prints how result moved against baseline. Returns the stages that got slower than tolerance allows."""
+    regressions = []
+    print(f"Against {baseline.get('commit')}: throughput {baseline['throughput_fps']:.3f} -> "
+          f"{result['throughput_fps']:.3f} frames/s")
+    for stage, stats in result["stages"].items():
+        before = baseline["stages"].get(stage)
+        if not before or not before["p50_s"]:
+            continue
+        change = stats["p50_s"] / before["p50_s"] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(stage)
+            flag = "  REGRESSION"
+        print(f"  {stage:<16} p50 {before['p50_s'] * 1000:9.2f} -> {stats['p50_s'] * 1000:9.2f} ms "
+              f"({change:+.1%}){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline offline against replayed replies.")
+    parser.add_argument("--frames", type=int, default=len(SAMPLE_IMAGES),
+                        help="Frames to run; beyond the sample images, synthetic variants are generated")
+    parser.add_argument("--recordings", default="benchmarks/recordings.json", help="Recorded model replies")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="Model reply time: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--first-token", type=float, default=0.6, help="Share of the reply time before the first token")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure peak memory per stage with tracemalloc")
+    parser.add_argument("--output", help="Write the results as JSON here")
+    parser.add_argument("--baseline", help="Results JSON of an earlier commit to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 slowdown per stage")
+    parser.add_argument("--verbose", action="store_true", help="Show the processors' output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="woven-bench-")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["SPOOL_DIR"] = os.path.join(workdir, "spool")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("SLOW_FRAME_S", "inf")
+
+    import main as pipeline
+    from database.migrations import ensure_schema
+    from metrics import register_span_listener
+    from benchmarks.fake_llm import LatencyModel, ReplayChatModel
+
+    ensure_schema()
+    pipeline.register_listeners()
+    recorder = StageRecorder()
+    register_span_listener(recorder)
+    llm = ReplayChatModel.from_file(args.recordings, LatencyModel(args.latency, args.first_token))
+
+    if args.trace_memory:
+        tracemalloc.start()
+    done, failed, wall, cpu = run(sample_frames(SAMPLE_IMAGES, args.frames), llm, args.verbose)
+    result = {
+        "commit": git_commit(),
+        "at": time.time(),
+        "config": {"frames": args.frames, "latency": args.latency, "first_token": args.first_token,
+                   "trace_memory": args.trace_memory},
+        "frames": done,
+        "failed": failed,
+        "llm_calls": llm.calls,
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "throughput_fps": done / wall if wall else 0.0,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "stages": recorder.report(),
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(result, json.load(f), args.tolerance):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
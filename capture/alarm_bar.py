@@ -0,0 +1,67 @@
+import numpy as np
+from PIL import Image
+
+def _longest_runs(mask):
+    """Returns, per row, the longest run of True as a fraction of the row width."""
+    padded = np.pad(mask, ((0, 0), (1, 1))).astype(np.int8)
+    edges = np.diff(padded, axis=1)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    _, end_cols = np.nonzero(edges == -1)
+    runs = np.zeros(mask.shape[0])
+    np.maximum.at(runs, start_rows, (end_cols - start_cols) / mask.shape[1])
+    return runs
+
+class AlarmBarDetector:
+    """Cheap local check for a lit alarm bar, run on every frame before any model call.
+
+    The tiraTex HMIs show active alarms as a solid red bar along the bottom of
+    the screen. The frame (or region, a (left, top, right, bottom) box in
+    fractions of the frame when the camera is fixed) is shrunk to width pixels
+    wide and each row's longest run of saturated red is measured. A run over
+    bar_fraction of the width is an alarm bar. check() reports it as new when
+    it wasn't there on the machine's previous frame or its pixels changed by
+    more than change_threshold (a different alarm text).
+    """
+
+    def __init__(self, region=None, width=320, bar_fraction=0.2, change_threshold=0.04):
+        self.region = region
+        self.width = width
+        self.bar_fraction = bar_fraction
+        self.change_threshold = change_threshold
+        self._last_bar = {}
+
+    def _pixels(self, image):
+        if self.region is not None:
+            w, h = image.size
+            left, top, right, bottom = self.region
+            image = image.crop((int(left * w), int(top * h), int(right * w), int(bottom * h)))
+        w, h = image.size
+        if w // self.width > 1:
+            # Box-reducing first is several times cheaper than one big resample.
+            image = image.reduce(w // self.width)
+            w, h = image.size
+        small = image.convert("RGB").resize((self.width, max(int(h * self.width / w), 1)), Image.BILINEAR)
+        return np.asarray(small, dtype=np.int16)
+
+    def find_bar(self, image):
+        """Returns the alarm bar as a small grayscale strip, or None when no bar is lit."""
+        pixels = self._pixels(image)
+        red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+        mask = (red > 140) & (red - np.maximum(green, blue) > 70)
+        runs = _longest_runs(mask)
+        row = int(np.argmax(runs))
+        if runs[row] < self.bar_fraction:
+            return None
+        strip = pixels[max(row - 2, 0):row + 3].mean(axis=2) / 255.0
+        return strip
+
+    def check(self, frame):
+        """Returns "new" for an alarm bar that just appeared or changed, "active" for a standing one, else None."""
+        bar = self.find_bar(frame.image)
+        previous = self._last_bar.get(frame.machine_id)
+        self._last_bar[frame.machine_id] = bar
+        if bar is None:
+            return None
+        if previous is None or previous.shape != bar.shape:
+            return "new"
+        return "new" if float(np.abs(bar - previous).mean()) > self.change_threshold else "active"
@@ -0,0 +1,79 @@
+import numpy as np
+from PIL import Image
+
+class KeyframeSelector:
+    """Passes on only frames whose screen content changed since the last keyframe.
+
+    Frames are compared as small grayscale thumbnails. The mean absolute
+    difference (0-1) above change_threshold is a content change; above
+    page_threshold the HMI switched pages. A frame is also passed on when
+    max_age seconds went by without a keyframe, so a static screen is still
+    read now and then. page numbers the screen page the last frame showed,
+    matching it against the last max_pages pages seen, so frames of the same
+    page share a number before any model has looked at them.
+    """
+
+    def __init__(self, change_threshold=0.01, page_threshold=0.15, max_age=300.0, thumbnail=(96, 54),
+                 max_pages=16):
+        self.change_threshold = change_threshold
+        self.page_threshold = page_threshold
+        self.max_age = max_age
+        self.thumbnail = thumbnail
+        self.max_pages = max_pages
+        self.page = None
+        self._pages = {}
+        self._next_page = 0
+        self._last = None
+        self._last_at = None
+        self.seen = 0
+        self.selected = 0
+
+    def _signature(self, image):
+        small = image.convert("L").resize(self.thumbnail, Image.BILINEAR)
+        return np.asarray(small, dtype=np.float32) / 255.0
+
+    def _match_page(self, signature):
+        """Returns the number of the known page closest to signature, or a new number."""
+        closest, distance = None, self.page_threshold
+        for number, known in self._pages.items():
+            difference = float(np.abs(signature - known).mean())
+            if difference <= distance:
+                closest, distance = number, difference
+        if closest is None:
+            closest = self._next_page
+            self._next_page += 1
+        # Most recently seen last, so the page seen longest ago goes first.
+        self._pages.pop(closest, None)
+        self._pages[closest] = signature
+        if len(self._pages) > self.max_pages:
+            del self._pages[next(iter(self._pages))]
+        return closest
+
+    def check(self, frame):
+        """Returns why frame is a keyframe ("first", "page", "change" or "stale"), or None to drop it."""
+        self.seen += 1
+        signature = self._signature(frame.image)
+        self.page = self._match_page(signature)
+        if self._last is None:
+            reason = "first"
+        else:
+            difference = float(np.abs(signature - self._last).mean())
+            if difference > self.page_threshold:
+                reason = "page"
+            elif difference > self.change_threshold:
+                reason = "change"
+            elif self.max_age is not None and frame.captured_at - self._last_at >= self.max_age:
+                reason = "stale"
+            else:
+                return None
+        self._last = signature
+        self._last_at = frame.captured_at
+        self.selected += 1
+        return reason
+
+    def select(self, frames):
+        """Yields (frame, reason) for the keyframes among frames."""
+        for frame in frames:
+            reason = self.check(frame)
+            if reason is not None:
+                yield frame, reason
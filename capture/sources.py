@@ -0,0 +1,145 @@
+import os
+import time
+from collections import namedtuple
+import cv2
+from PIL import Image
+from database.db_setup import DEFAULT_MACHINE_ID
+
+# image is an RGB PIL image; captured_at is epoch seconds; index counts frames from the source;
+# machine_id is the machine whose screen the camera shows.
+Frame = namedtuple("Frame", "image captured_at source index machine_id")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+class FrameSource:
+    """An iterable of Frames. Subclasses implement frames()."""
+
+    def frames(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        return self.frames()
+
+class DirectorySource(FrameSource):
+    """Frames from the image files in a directory, oldest first.
+
+    With follow=True it keeps polling for new files, the way a camera dropping
+    JPEGs into a folder is watched. With fps set, files are paced at that rate,
+    which makes a folder of frames a stand-in for a live stream.
+    """
+
+    def __init__(self, directory, follow=False, poll_interval=1.0, fps=None, machine_id=DEFAULT_MACHINE_ID):
+        self.directory = directory
+        self.machine_id = machine_id
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.fps = fps
+
+    def _new_files(self, seen):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.lower().endswith(IMAGE_EXTENSIONS) and name not in seen]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    def frames(self):
+        seen = set()
+        index = 0
+        while True:
+            for path in self._new_files(seen):
+                seen.add(os.path.basename(path))
+                with Image.open(path) as img:
+                    image = img.convert("RGB")
+                captured_at = os.path.getmtime(path) if self.fps is None else time.time()
+                yield Frame(image, captured_at, path, index, self.machine_id)
+                index += 1
+                if self.fps:
+                    time.sleep(1 / self.fps)
+            if not self.follow:
+                return
+            time.sleep(self.poll_interval)
+
+class VideoSource(FrameSource):
+    """Frames sampled from a video file or stream URL through OpenCV, at most sample_fps per second.
+
+    realtime=True paces a file at its recorded frame rate, so a recording
+    stands in for the live camera it came from.
+    """
+
+    def __init__(self, uri, sample_fps=1.0, realtime=False, machine_id=DEFAULT_MACHINE_ID):
+        self.uri = uri
+        self.machine_id = machine_id
+        self.sample_fps = sample_fps
+        self.realtime = realtime
+        self.live = uri.lower().startswith(("rtsp://", "rtsps://"))
+
+    def _open(self):
+        capture = cv2.VideoCapture(self.uri)
+        if not capture.isOpened():
+            raise IOError(f"Cannot open video source {self.uri}")
+        return capture
+
+    def _read(self, capture, started, index):
+        """Yields sampled Frames, numbered from index, until the source ends."""
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        position = 0
+        next_sample = 0.0
+        while True:
+            ok, pixels = capture.read()
+            if not ok:
+                return
+            if self.realtime:
+                delay = started + position / fps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            # sample_fps is re-read every frame so consumers can throttle a running source.
+            if position / fps >= next_sample:
+                next_sample = position / fps + (1 / self.sample_fps if self.sample_fps else 0)
+                image = Image.fromarray(cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB))
+                captured_at = time.time() if self.realtime or self.live else started + position / fps
+                yield Frame(image, captured_at, self.uri, index, self.machine_id)
+                index += 1
+            position += 1
+
+    def frames(self):
+        capture = self._open()
+        try:
+            yield from self._read(capture, time.time(), 0)
+        finally:
+            capture.release()
+
+class RTSPSource(VideoSource):
+    """Frames from an RTSP camera, reconnecting after reconnect_delay when the stream drops.
+
+    A video file path works as the URL; it is then replayed in real time and
+    looped, standing in for the camera.
+    """
+
+    def __init__(self, url, sample_fps=1.0, reconnect_delay=5.0, machine_id=DEFAULT_MACHINE_ID):
+        super().__init__(url, sample_fps, machine_id=machine_id)
+        self.realtime = not self.live
+        self.reconnect_delay = reconnect_delay
+
+    def frames(self):
+        index = 0
+        while True:
+            try:
+                capture = self._open()
+            except IOError as e:
+                print(f"{e}, retrying in {self.reconnect_delay}s")
+                time.sleep(self.reconnect_delay)
+                continue
+            try:
+                for frame in self._read(capture, time.time(), index):
+                    index = frame.index + 1
+                    yield frame
+            finally:
+                capture.release()
+            print(f"Stream {self.uri} ended, reconnecting")
+            time.sleep(self.reconnect_delay if self.live else 0)
+
+def source_from_uri(uri, sample_fps=1.0, follow=False, machine_id=DEFAULT_MACHINE_ID):
+    """Picks a source: a directory, an rtsp:// URL, or a video file."""
+    if os.path.isdir(uri):
+        return DirectorySource(uri, follow=follow, machine_id=machine_id)
+    if uri.lower().startswith(("rtsp://", "rtsps://")):
+        return RTSPSource(uri, sample_fps, machine_id=machine_id)
+    return VideoSource(uri, sample_fps, machine_id=machine_id)
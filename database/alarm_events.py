@@ -0,0 +1,78 @@
+import hashlib
+from .backends import get_backend
+from .db_setup import DEFAULT_MACHINE_ID
+
+# text_hash -> alarm_texts.id, so steady-state readings skip the lookup.
+_alarm_text_ids = {}
+
+def normalize_alarm_text(text):
+    """Collapses whitespace so the same alarm always interns to the same id."""
+    return " ".join(str(text).split())
+
+def intern_alarm_text(cursor, text):
+    """Returns the alarm_texts id for text, inserting it on first sight.
+
+    The insert is an upsert on text_hash, so two writers racing to intern the
+    same new text both end up with the one row. Ids are cached once committed; a
+    rolled back insert leaves nothing behind in the cache.
+    """
+    text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    alarm_text_id = _alarm_text_ids.get(text_hash)
+    if alarm_text_id is not None:
+        return alarm_text_id
+    backend = get_backend()
+    cursor.execute("SELECT id FROM alarm_texts WHERE text_hash = %s", (text_hash,))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f'''INSERT INTO alarm_texts (text_hash, text) VALUES (%s, %s)
+                           {backend.upsert_suffix(["text_hash"], {"text": "replace"})}''', (text_hash, text))
+        cursor.execute("SELECT id FROM alarm_texts WHERE text_hash = %s", (text_hash,))
+        row = cursor.fetchone()
+    alarm_text_id = row[0]
+    backend.after_commit(lambda: _alarm_text_ids.setdefault(text_hash, alarm_text_id))
+    return alarm_text_id
+
+def update_alarm_events(conn, screen, seen_at, alarm_messages, machine_id=DEFAULT_MACHINE_ID):
+    """Folds the alarms visible in one reading into alarm_events.
+
+    Alarms still on screen extend their open event, new ones open an event and
+    open events whose alarm has disappeared are closed. A reading older than
+    what an event has already seen neither closes it nor opens a new one for
+    the same alarm, so late and out-of-order readings leave events alone.
+    The caller commits.
+    """
+    texts = {normalize_alarm_text(m) for m in alarm_messages or [] if m and str(m).strip()}
+
+    with conn.cursor() as c:
+        visible = {intern_alarm_text(c, text) for text in texts}
+
+        c.execute('''SELECT id, alarm_text_id FROM alarm_events
+                     WHERE machine_id = %s AND screen = %s AND active = 1''',
+                  (machine_id, screen))
+        open_events = dict(c.fetchall())
+
+        still_active = [event_id for event_id, text_id in open_events.items() if text_id in visible]
+        cleared = [event_id for event_id, text_id in open_events.items() if text_id not in visible]
+        started = visible - set(open_events.values())
+
+        if still_active:
+            placeholders = ", ".join(["%s"] * len(still_active))
+            c.execute(f'''UPDATE alarm_events SET last_seen = %s
+                          WHERE id IN ({placeholders}) AND last_seen < %s''',
+                      (seen_at, *still_active, seen_at))
+        if cleared:
+            placeholders = ", ".join(["%s"] * len(cleared))
+            # A late reading without the alarm must not close an event seen since.
+            c.execute(f"UPDATE alarm_events SET active = 0 WHERE id IN ({placeholders}) AND last_seen < %s",
+                      (*cleared, seen_at))
+        for alarm_text_id in started:
+            c.execute('''SELECT 1 FROM alarm_events
+                         WHERE alarm_text_id = %s AND machine_id = %s AND screen = %s AND last_seen >= %s
+                         LIMIT 1''',
+                      (alarm_text_id, machine_id, screen, seen_at))
+            if c.fetchone() is not None:
+                # A late reading of an alarm already recorded past this time.
+                continue
+            c.execute('''INSERT INTO alarm_events (alarm_text_id, machine_id, screen, first_seen, last_seen, active)
+                         VALUES (%s, %s, %s, %s, %s, 1)''',
+                      (alarm_text_id, machine_id, screen, seen_at, seen_at))
@@ -0,0 +1,353 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import mysql.connector
+
+_local = threading.local()
+
+class StorageBackend:
+    """Where readings are written. Subclasses provide connections and SQL dialect bits."""
+
+    dialect = None
+
+    def connect(self):
+        raise NotImplementedError
+
+    def initialize(self):
+        """Creates the database itself, if the backend has such a notion."""
+
+    def upsert_suffix(self, key_columns, updates):
+        """Returns the clause turning an INSERT into an upsert.
+
+        updates maps column -> "replace", "min", "max" or "add", describing how
+        the incoming value combines with the stored one on a key conflict.
+        """
+        raise NotImplementedError
+
+    def upsert_row(self, cursor, table, row, key_columns):
+        """Inserts row, or overwrites the row sharing its key. Returns True if it was new."""
+        raise NotImplementedError
+
+    def table_columns(self, cursor, table):
+        """Returns the column names of table, or [] if there is no such table."""
+        raise NotImplementedError
+
+    def column_types(self, cursor, table):
+        """Returns [(column, declared SQL type)] of table in column order."""
+        raise NotImplementedError
+
+    def index_names(self, cursor, table):
+        """Returns the names of table's indexes, unique ones included."""
+        raise NotImplementedError
+
+    def unique_keys(self, cursor, table):
+        """Returns {index name: [columns]} of table's unique keys other than the primary key."""
+        raise NotImplementedError
+
+    def drop_unique_key(self, cursor, table, name):
+        """Drops the unique key name of table, as named by unique_keys()."""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Yields a connection and commits on exit, unless already inside batch()."""
+        conn = getattr(_local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        with self._committing(self.connect()) as conn:
+            yield conn
+
+    @contextmanager
+    def batch(self):
+        """Groups every write on this thread into one transaction."""
+        if getattr(_local, "conn", None) is not None:
+            yield _local.conn
+            return
+        with self._committing(self.connect()) as conn:
+            _local.conn = conn
+            try:
+                yield conn
+            finally:
+                _local.conn = None
+
+    @contextmanager
+    def _committing(self, conn):
+        outer, _local.after_commit = getattr(_local, "after_commit", None), []
+        try:
+            yield conn
+            conn.commit()
+            callbacks = _local.after_commit
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _local.after_commit = outer
+            conn.close()
+        for callback in callbacks:
+            callback()
+
+    def after_commit(self, callback):
+        """Calls callback once this thread's current transaction commits; it is dropped on a rollback.
+
+        Returns False, without keeping callback, outside transaction() and batch().
+        """
+        callbacks = getattr(_local, "after_commit", None)
+        if callbacks is None:
+            return False
+        callbacks.append(callback)
+        return True
+
+class MySQLBackend(StorageBackend):
+    dialect = "mysql"
+
+    _UPDATES = {
+        "replace": "{col} = VALUES({col})",
+        "min": "{col} = LEAST({col}, VALUES({col}))",
+        "max": "{col} = GREATEST({col}, VALUES({col}))",
+        "add": "{col} = {col} + VALUES({col})",
+    }
+
+    def __init__(self, host="localhost", user="root", password="", database="control_panel_db",
+                 connect_timeout=5):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.connect_timeout = connect_timeout
+
+    def connect(self):
+        try:
+            return mysql.connector.connect(host=self.host, user=self.user, password=self.password,
+                                           database=self.database, connection_timeout=self.connect_timeout)
+        except mysql.connector.Error as err:
+            if err.errno == mysql.connector.errorcode.ER_BAD_DB_ERROR:
+                # Database doesn't exist, connect without specifying the DB
+                return mysql.connector.connect(host=self.host, user=self.user, password=self.password,
+                                               connection_timeout=self.connect_timeout)
+            raise
+
+    def initialize(self):
+        conn = mysql.connector.connect(host=self.host, user=self.user, password=self.password)
+        with conn.cursor() as c:
+            c.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
+        conn.close()
+
+    def upsert_suffix(self, key_columns, updates):
+        assignments = ", ".join(self._UPDATES[how].format(col=col) for col, how in updates.items())
+        return f"ON DUPLICATE KEY UPDATE {assignments}"
+
+    def upsert_row(self, cursor, table, row, key_columns):
+        columns = list(row)
+        suffix = self.upsert_suffix(key_columns, {col: "replace" for col in columns if col not in key_columns})
+        cursor.execute(f'''INSERT INTO {table} ({", ".join(columns)})
+                           VALUES ({", ".join(["%s"] * len(columns))}) {suffix}''',
+                       tuple(row.values()))
+        # MySQL reports 1 for an insert and 2 (or 0 if unchanged) for an update.
+        return cursor.rowcount == 1
+
+    def table_columns(self, cursor, table):
+        cursor.execute('''SELECT column_name FROM information_schema.columns
+                          WHERE table_schema = DATABASE() AND table_name = %s''', (table,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def column_types(self, cursor, table):
+        cursor.execute('''SELECT column_name, column_type FROM information_schema.columns
+                          WHERE table_schema = DATABASE() AND table_name = %s
+                          ORDER BY ordinal_position''', (table,))
+        return [(name, kind.upper()) for name, kind in cursor.fetchall()]
+
+    def index_names(self, cursor, table):
+        cursor.execute('''SELECT DISTINCT index_name FROM information_schema.statistics
+                          WHERE table_schema = DATABASE() AND table_name = %s''', (table,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def unique_keys(self, cursor, table):
+        cursor.execute('''SELECT index_name, column_name FROM information_schema.statistics
+                          WHERE table_schema = DATABASE() AND table_name = %s
+                          AND non_unique = 0 AND index_name <> 'PRIMARY'
+                          ORDER BY index_name, seq_in_index''', (table,))
+        keys = {}
+        for name, column in cursor.fetchall():
+            keys.setdefault(name, []).append(column)
+        return keys
+
+    def drop_unique_key(self, cursor, table, name):
+        cursor.execute(f"ALTER TABLE {table} DROP INDEX `{name}`")
+
+class SQLiteCursor:
+    """sqlite3 cursor speaking the MySQL flavour the rest of the package writes."""
+
+    _INLINE_INDEX = re.compile(r",\s*INDEX\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+    _CREATE_TABLE = re.compile(r"CREATE TABLE (?:IF NOT EXISTS )?(\w+)", re.IGNORECASE)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _translate(self, sql):
+        sql = sql.replace("%s", "?")
+        sql = re.sub(r"INT PRIMARY KEY AUTO_INCREMENT", "INTEGER PRIMARY KEY AUTOINCREMENT", sql, flags=re.IGNORECASE)
+        indexes = []
+        table = self._CREATE_TABLE.search(sql)
+        if table:
+            indexes = [f"CREATE INDEX IF NOT EXISTS {name} ON {table.group(1)} ({cols})"
+                       for name, cols in self._INLINE_INDEX.findall(sql)]
+            sql = self._INLINE_INDEX.sub("", sql)
+        return sql, indexes
+
+    def execute(self, sql, params=()):
+        sql, indexes = self._translate(sql)
+        self._cursor.execute(sql, params)
+        for statement in indexes:
+            self._cursor.execute(statement)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        sql, _ = self._translate(sql)
+        self._cursor.executemany(sql, seq_of_params)
+        return self
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, **kwargs):
+        # sqlite3 cursors already step through results lazily, so buffered=False needs no handling.
+        return SQLiteCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+class SQLiteBackend(StorageBackend):
+    """Embedded single-file storage for edge nodes and hermetic tests, in WAL mode."""
+
+    dialect = "sqlite"
+
+    _UPDATES = {
+        "replace": "{col} = excluded.{col}",
+        "min": "{col} = MIN({col}, excluded.{col})",
+        "max": "{col} = MAX({col}, excluded.{col})",
+        "add": "{col} = {col} + excluded.{col}",
+    }
+
+    def __init__(self, path="control_panel.db", synchronous="NORMAL", busy_timeout_ms=5000):
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return SQLiteConnection(conn)
+
+    def upsert_suffix(self, key_columns, updates):
+        assignments = ", ".join(self._UPDATES[how].format(col=col) for col, how in updates.items())
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {assignments}"
+
+    def upsert_row(self, cursor, table, row, key_columns):
+        columns = list(row)
+        cursor.execute(f'''INSERT INTO {table} ({", ".join(columns)})
+                           VALUES ({", ".join(["%s"] * len(columns))})
+                           ON CONFLICT ({", ".join(key_columns)}) DO NOTHING''',
+                       tuple(row.values()))
+        if cursor.rowcount == 1:
+            return True
+        updates = [col for col in columns if col not in key_columns]
+        cursor.execute(f'''UPDATE {table} SET {", ".join(f"{col} = %s" for col in updates)}
+                           WHERE {" AND ".join(f"{col} = %s" for col in key_columns)}''',
+                       tuple(row[col] for col in updates) + tuple(row[col] for col in key_columns))
+        return False
+
+    def table_columns(self, cursor, table):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [row[1] for row in cursor.fetchall()]
+
+    def column_types(self, cursor, table):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [(row[1], row[2].upper()) for row in cursor.fetchall()]
+
+    def index_names(self, cursor, table):
+        cursor.execute(f"PRAGMA index_list({table})")
+        return [row[1] for row in cursor.fetchall()]
+
+    def unique_keys(self, cursor, table):
+        cursor.execute(f"PRAGMA index_list({table})")
+        names = [row[1] for row in cursor.fetchall() if row[2] and row[3] != "pk"]
+        keys = {}
+        for name in names:
+            cursor.execute(f"PRAGMA index_info({name})")
+            keys[name] = [row[2] for row in sorted(cursor.fetchall())]
+        return keys
+
+    def drop_unique_key(self, cursor, table, name):
+        """Drops a unique index; one declared inside CREATE TABLE can only go by rebuilding the table."""
+        if not name.startswith("sqlite_autoindex_"):
+            cursor.execute(f"DROP INDEX {name}")
+            return
+        columns = self.unique_keys(cursor, table)[name]
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        create = cursor.fetchone()[0]
+        clause = r",\s*UNIQUE\s*\(\s*" + r"\s*,\s*".join(map(re.escape, columns)) + r"\s*\)"
+        create = re.sub(clause, "", create, count=1, flags=re.IGNORECASE)
+        create = re.sub(rf"^CREATE TABLE \"?{table}\"?", f"CREATE TABLE {table}_rebuild", create)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                       (table,))
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(create)
+        cursor.execute(f"INSERT INTO {table}_rebuild SELECT * FROM {table}")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+        for statement in indexes:
+            cursor.execute(statement)
+
+def backend_from_env():
+    """Builds the backend selected by STORAGE_BACKEND (mysql or sqlite). MySQL needs MYSQL_PASSWORD."""
+    kind = os.getenv("STORAGE_BACKEND", "mysql").lower()
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SQLITE_PATH", "control_panel.db"))
+    if kind == "mysql":
+        password = os.getenv("MYSQL_PASSWORD")
+        if password is None:
+            raise ValueError("MYSQL_PASSWORD is not set; put it in the environment or .env, "
+                             "or use STORAGE_BACKEND=sqlite")
+        return MySQLBackend(
+            host=os.getenv("MYSQL_HOST", "localhost"),
+            user=os.getenv("MYSQL_USER", "root"),
+            password=password,
+            database=os.getenv("MYSQL_DATABASE", "control_panel_db"),
+            connect_timeout=int(os.getenv("MYSQL_CONNECT_TIMEOUT", "5")),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = backend_from_env()
+    return _backend
+
+def set_backend(backend):
+    """Replaces the process-wide backend, e.g. with an SQLiteBackend in tests."""
+    global _backend
+    _backend = backend
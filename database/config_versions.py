@@ -0,0 +1,72 @@
+from .db_setup import get_db_connection, DEFAULT_MACHINE_ID
+
+# Configuration screens stored change-only: source table -> version table.
+VERSIONED_TABLES = {
+    "control_panel1": "control_panel1_versions",
+}
+
+# Row fields that describe the capture rather than the configuration.
+_NON_CONFIG_COLUMNS = {
+    "machine_id", "captured_at", "source_image_hash", "processor_version", "item_index",
+    "CurrentDateTime", "AlarmMessages",
+}
+
+def config_columns(row):
+    return [col for col in row if col not in _NON_CONFIG_COLUMNS]
+
+def _current_version(cursor, version_table, machine_id, columns):
+    cursor.execute(f'''SELECT id, valid_from, {", ".join(columns)} FROM {version_table}
+                       WHERE machine_id = %s AND valid_to IS NULL
+                       ORDER BY valid_from DESC LIMIT 1''',
+                   (machine_id,))
+    return cursor.fetchone()
+
+def write_config_versions(conn, table, rows, machine_id=DEFAULT_MACHINE_ID):
+    """Records configuration readings as validity intervals instead of raw rows.
+
+    A reading identical to the open version writes nothing. A different one
+    closes the open version at its capture time and opens a new one. Readings
+    older than the open version have been superseded and are skipped, with a
+    note printed. The caller commits.
+    """
+    version_table = VERSIONED_TABLES[table]
+    with conn.cursor() as c:
+        for row in sorted(rows, key=lambda r: r["captured_at"]):
+            columns = config_columns(row)
+            values = tuple(row[col] for col in columns)
+            current = _current_version(c, version_table, machine_id, columns)
+            if current is not None:
+                if row["captured_at"] < current[1]:
+                    print(f"Skipped a {table} reading of {machine_id} captured at {row['captured_at']}, "
+                          f"before the version in force since {current[1]}")
+                    continue
+                if tuple(current[2:]) == values:
+                    continue
+                c.execute(f"UPDATE {version_table} SET valid_to = %s WHERE id = %s",
+                          (row["captured_at"], current[0]))
+            c.execute(f'''INSERT INTO {version_table}
+                          (machine_id, valid_from, valid_to, source_image_hash, {", ".join(columns)})
+                          VALUES (%s, %s, NULL, %s, {", ".join(["%s"] * len(columns))})''',
+                      (machine_id, row["captured_at"], row["source_image_hash"], *values))
+
+def config_as_of(at, machine_id=DEFAULT_MACHINE_ID, table="control_panel1", conn=None):
+    """Returns the configuration in force at time at as a dict, or None."""
+    version_table = VERSIONED_TABLES[table]
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute(f'''SELECT * FROM {version_table}
+                          WHERE machine_id = %s AND valid_from <= %s
+                          ORDER BY valid_from DESC LIMIT 1''',
+                      (machine_id, at))
+            row = c.fetchone()
+            if row is None:
+                return None
+            version = dict(zip([d[0] for d in c.description], row))
+    finally:
+        if own_conn:
+            conn.close()
+    if version["valid_to"] is not None and version["valid_to"] <= at:
+        return None
+    return version
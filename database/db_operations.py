@@ -1,78 +1,197 @@
 import json
-from .db_setup import get_db_connection
+import os
+from .backends import get_backend
+from .db_setup import DEFAULT_MACHINE_ID
+from .migrations import ensure_schema
+from .alarm_events import update_alarm_events
+from .config_versions import VERSIONED_TABLES, write_config_versions
+from .rollups import update_rollups, recompute_rollups
+from .spool import Spool, SpoolingWriter
+from .timestamps import reading_time
+from metrics import span
 
-def insert_control_panel1_data(data):
-    conn = get_db_connection()
-    with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel1 (CurrentDateTime, HDPE_factor, PP_factor, HDPE_Exponent, PP_Exponent,
-                     HDPE_OutputFactorMeltPump, PP_OutputFactorMeltPump, Titer_g_9000m, NumberOfTapes, EdgeTrimSide_mm,
-                     TapeWidth_mm, CuttingWidth_mm, TotalRatioTheoretical, TotalRatioActual, StretchRatioActual,
-                     CalculatedPumpRPM, RawMaterialPercentage, AdditivePercentage, Company, ExtruderType, ScrewType,
-                     DieType, AlarmMessages)
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                  (data.CurrentDateTime, data.HDPE_factor, data.PP_factor, data.HDPE_Exponent, data.PP_Exponent,
-                   data.HDPE_OutputFactorMeltPump, data.PP_OutputFactorMeltPump, data.Titer_g_9000m, data.NumberOfTapes,
-                   data.EdgeTrimSide_mm, data.TapeWidth_mm, data.CuttingWidth_mm, data.TotalRatioTheoretical,
-                   data.TotalRatioActual, data.StretchRatioActual, data.CalculatedPumpRPM, data.RawMaterialPercentage,
-                   json.dumps(data.AdditivePercentage), data.Company, data.ExtruderType, data.ScrewType, data.DieType,
-                   json.dumps(data.AlarmMessages)))
-    conn.commit()
-    conn.close()
-
-def insert_control_panel2_data(data):
-    conn = get_db_connection()
-    with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel2 (CurrentDateTime, OIL_HEATER_Target_Temp_1, OIL_HEATER_Actual_Temp_1,
-                    OIL_HEATER_Target_Temp_2, OIL_HEATER_Actual_Temp_2, HOT_AIR_Target_Temp, HOT_AIR_Actual_Temp,
-                    ANNEALING_Percentage, Line_Speed_1, Amperage_1, Torque_1, Line_Speed_2, Amperage_2, Torque_2,
-                    Line_Speed_3, Amperage_3, Torque_3, AlarmMessages)
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                  (data.CurrentDateTime, data.OIL_HEATER_Target_Temp_1, data.OIL_HEATER_Actual_Temp_1,
-                   data.OIL_HEATER_Target_Temp_2, data.OIL_HEATER_Actual_Temp_2, data.HOT_AIR_Target_Temp,
-                   data.HOT_AIR_Actual_Temp, data.ANNEALING_Percentage, data.Line_Speed_1, data.Amperage_1,
-                   data.Torque_1, data.Line_Speed_2, data.Amperage_2, data.Torque_2, data.Line_Speed_3,
-                   data.Amperage_3, data.Torque_3, json.dumps(data.AlarmMessages)))
-    conn.commit()
-    conn.close()
-
-def insert_control_panel3_data(data):
-    conn = get_db_connection()
-    with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel3 (CurrentDateTime, LineSpeed_rpm, CutTension_kg, ExtruderSpeed_rpm, TakeOffSpeed_mpm, FilmOscillation_mm, WaterExhaust_status, WaterPump_status, AlarmMessages)
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                  (data.CurrentDateTime, data.LineSpeed_rpm, data.CutTension_kg, data.ExtruderSpeed_rpm, data.TakeOffSpeed_mpm, data.FilmOscillation_mm, data.WaterExhaust_status, data.WaterPump_status, json.dumps(data.AlarmMessages)))
-    conn.commit()
-    conn.close()
-
-def insert_control_panel4_data(data):
-    conn = get_db_connection()
-    with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel4 (CurrentDateTime, OilHeater1_Temp_C, OilHeater2_Temp_C, TotalRatio, StretchRatio, Annealing_percent, Godet1_speed_ms, Godet1_temp_C, Godet2_speed_mpm, Godet2_current_A, Godet3_speed_mpm, Godet3_current_A, Godet4_speed_mpm, Godet4_current_A, Godet4_torque_percent, Extruder_speed_rpm, Zone1_temp_C, Zone1_pressure, Zone1_motor_load_percent, Zone2_temp_C, Zone2_pressure, Zone2_motor_load_percent, Zone2_torque_percent, AlarmMessages)
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                  (data.CurrentDateTime, data.OilHeater1_Temp_C, data.OilHeater2_Temp_C, data.TotalRatio, data.StretchRatio, data.Annealing_percent, data.Godet1_speed_ms, data.Godet1_temp_C, data.Godet2_speed_mpm, data.Godet2_current_A, data.Godet3_speed_mpm, data.Godet3_current_A, data.Godet4_speed_mpm, data.Godet4_current_A, data.Godet4_torque_percent, data.Extruder_speed_rpm, data.Zone1_temp_C, data.Zone1_pressure, data.Zone1_motor_load_percent, data.Zone2_temp_C, data.Zone2_pressure, data.Zone2_motor_load_percent, data.Zone2_torque_percent, json.dumps(data.AlarmMessages)))
+# Columns written for each screen table, after machine_id and captured_at.
+TABLE_COLUMNS = {
+    "control_panel1": [
+        "CurrentDateTime", "HDPE_factor", "PP_factor", "HDPE_Exponent", "PP_Exponent",
+        "HDPE_OutputFactorMeltPump", "PP_OutputFactorMeltPump", "Titer_g_9000m", "NumberOfTapes",
+        "EdgeTrimSide_mm", "TapeWidth_mm", "CuttingWidth_mm", "TotalRatioTheoretical",
+        "TotalRatioActual", "StretchRatioActual", "CalculatedPumpRPM", "RawMaterialPercentage",
+        "AdditivePercentage", "Company", "ExtruderType", "ScrewType", "DieType", "AlarmMessages",
+    ],
+    "control_panel2": [
+        "CurrentDateTime", "OIL_HEATER_Target_Temp_1", "OIL_HEATER_Actual_Temp_1",
+        "OIL_HEATER_Target_Temp_2", "OIL_HEATER_Actual_Temp_2", "HOT_AIR_Target_Temp",
+        "HOT_AIR_Actual_Temp", "ANNEALING_Percentage", "Line_Speed_1", "Amperage_1", "Torque_1",
+        "Line_Speed_2", "Amperage_2", "Torque_2", "Line_Speed_3", "Amperage_3", "Torque_3",
+        "AlarmMessages",
+    ],
+    "control_panel3": [
+        "CurrentDateTime", "LineSpeed_rpm", "CutTension_kg", "ExtruderSpeed_rpm", "TakeOffSpeed_mpm",
+        "FilmOscillation_mm", "WaterExhaust_status", "WaterPump_status", "AlarmMessages",
+    ],
+    "control_panel4": [
+        "CurrentDateTime", "OilHeater1_Temp_C", "OilHeater2_Temp_C", "TotalRatio", "StretchRatio",
+        "Annealing_percent", "Godet1_speed_ms", "Godet1_temp_C", "Godet2_speed_mpm", "Godet2_current_A",
+        "Godet3_speed_mpm", "Godet3_current_A", "Godet4_speed_mpm", "Godet4_current_A",
+        "Godet4_torque_percent", "Extruder_speed_rpm", "Zone1_temp_C", "Zone1_pressure",
+        "Zone1_motor_load_percent", "Zone2_temp_C", "Zone2_pressure", "Zone2_motor_load_percent",
+        "Zone2_torque_percent", "AlarmMessages",
+    ],
+    "control_panel5": [
+        "CurrentDateTime", "LineSpeed_rpm", "CutTension_kg", "ExtruderSpeed_rpm", "TakeOffSpeed_mpm",
+        "FilmOscillation_mm", "WaterExhaust_status", "WaterPump_status", "Extruder_status",
+        "AlarmMessages",
+    ],
+    "control_panel6": [
+        "CurrentDateTime", "LineSpeed_m_min", "Output_kg", "Extruder_rpm", "Extruder_Nm",
+        "Z1_temp", "Z2_temp", "Z3_temp", "Z4_temp", "Z5_temp", "Z6_temp",
+        "Z11_temp", "Z13_temp", "Z14_temp", "AlarmMessages",
+    ],
+    "control_panel7": [
+        "CurrentDateTime", "Voltmeter_V", "Ammeter_A", "RedLight_status", "YellowLight_status",
+        "BlueLight_status",
+    ],
+    "control_panel8": [
+        "CurrentDateTime", "JD_PR18_SV", "JD_PR18_PV", "JD_950F_P_main_display",
+        "JD_950F_P_secondary_display", "YellowLight_status", "GreenLight_status", "RedLight_status",
+    ],
+    "control_panel9": [
+        "CurrentDateTime", "ACT1_kg", "ACT2_kg", "Fabric_Mtr", "Efficiency_percent", "MainSwitchTime_Hrs",
+        "OperatingTime_Hrs", "WarpBreak", "WeftBreak", "WeftEnd", "Tapes_per_10cm", "Picks_per_Min",
+    ],
+    "control_panel10": [
+        "CurrentDateTime", "Run_status", "Run_value", "P_per_10cm", "Speed_m_min", "Shift",
+        "Efficiency_percent", "Total_m2", "Total_m", "Value_300", "Value_150_g_1", "Value_150_g_2",
+        "Value_432_4", "Value_118_kg",
+    ],
+}
 
-def insert_control_panel5_data(data):
-    conn = get_db_connection()
-    with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel5 (
-            CurrentDateTime, LineSpeed_rpm, CutTension_kg, ExtruderSpeed_rpm,
-            TakeOffSpeed_mpm, FilmOscillation_mm, WaterExhaust_status,
-            WaterPump_status, Extruder_status, AlarmMessages
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-        (
-            data.CurrentDateTime, data.LineSpeed_rpm, data.CutTension_kg,
-            data.ExtruderSpeed_rpm, data.TakeOffSpeed_mpm, data.FilmOscillation_mm,
-            data.WaterExhaust_status, data.WaterPump_status, data.Extruder_status,
-            json.dumps(data.AlarmMessages)
-        ))
-    conn.commit()
-    conn.close()
-
-def insert_control_panel6_data(data):
-    conn = get_db_connection()
+# List-valued fields stored as JSON text.
+JSON_COLUMNS = {"AdditivePercentage", "AlarmMessages"}
+
+# Identifies a reading: the machine, the frame it came from, the processor code that read it and its
+# position in the reply.
+IDEMPOTENCY_KEY = ("machine_id", "source_image_hash", "processor_version", "item_index")
+
+def reading_row(table, data, machine_id=DEFAULT_MACHINE_ID, source_image_hash=None, processor_version=None,
+                item_index=0):
+    """Flattens a validated reading into the column -> value dict stored for table.
+
+    Fields the screen model doesn't carry are stored as NULL.
+    """
+    row = {
+        "machine_id": machine_id,
+        "captured_at": reading_time(data.CurrentDateTime),
+        "source_image_hash": source_image_hash,
+        "processor_version": processor_version,
+        "item_index": item_index,
+    }
+    for column in TABLE_COLUMNS[table]:
+        value = getattr(data, column, None)
+        if column in JSON_COLUMNS:
+            value = json.dumps(value if value is not None else [])
+        row[column] = value
+    return row
+
+def write_rows(conn, table, rows, machine_id=DEFAULT_MACHINE_ID):
+    """Writes a batch of rows for one machine plus their alarm events and rollups.
+
+    Rows carrying a source image hash are upserted on IDEMPOTENCY_KEY, so
+    retries, spool replays and parallel workers never duplicate a reading.
+    Only new rows feed the alarm events and the rollup merge. Overwritten rows
+    have their rollup buckets recomputed instead.
+    Configuration screens in VERSIONED_TABLES are stored as change-only versions.
+    """
+    if table in VERSIONED_TABLES:
+        write_config_versions(conn, table, rows, machine_id)
+        for row in rows:
+            update_alarm_events(conn, table, row["captured_at"], json.loads(row["AlarmMessages"]), machine_id)
+        return
+    backend = get_backend()
+    fresh, unkeyed, rewritten_at = [], [], []
     with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel6 (CurrentDateTime, LineSpeed_m_min, Output_kg, Extruder_rpm, Extruder_Nm, Z1_temp, Z2_temp, Z3_temp, Z4_temp, Z5_temp, Z6_temp, Z11_temp, Z13_temp, Z14_temp, AlarmMessages)
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,. %s, %s, %s)''',
-                  (data.CurrentDateTime, data.LineSpeed_m_min, data.Output_kg, data.Extruder_rpm, data.Extruder_Nm, data.Z1_temp, data.Z2_temp, data.Z3_temp, data.Z4_temp, data.Z5_temp, data.Z6_temp, data.Z11_temp, data.Z13_temp, data.Z14_temp, json.dumps(data.AlarmMessages)))
-    conn.commit()
-    conn.close()
+        for row in rows:
+            if row.get("source_image_hash") is None:
+                unkeyed.append(row)
+                continue
+            c.execute(f'''SELECT captured_at FROM {table}
+                          WHERE machine_id = %s AND source_image_hash = %s AND processor_version = %s
+                          AND item_index = %s''',
+                      tuple(row[col] for col in IDEMPOTENCY_KEY))
+            previous = c.fetchone()
+            if backend.upsert_row(c, table, row, IDEMPOTENCY_KEY) and previous is None:
+                fresh.append(row)
+            else:
+                rewritten_at.append(row["captured_at"])
+                if previous is not None and previous[0] is not None:
+                    rewritten_at.append(previous[0])
+        if unkeyed:
+            columns = list(unkeyed[0])
+            c.executemany(f'''INSERT INTO {table} ({", ".join(columns)})
+                              VALUES ({", ".join(["%s"] * len(columns))})''',
+                          [tuple(row[col] for col in columns) for row in unkeyed])
+            fresh.extend(unkeyed)
+    if "AlarmMessages" in TABLE_COLUMNS[table]:
+        for row in fresh:
+            update_alarm_events(conn, table, row["captured_at"], json.loads(row["AlarmMessages"]), machine_id)
+    update_rollups(conn, table, [(row["captured_at"], row) for row in fresh], machine_id)
+    if rewritten_at:
+        recompute_rollups(conn, table, rewritten_at, machine_id)
+
+def write_to_database(table, rows, machine_id=DEFAULT_MACHINE_ID):
+    ensure_schema()
+    with get_backend().transaction() as conn:
+        write_rows(conn, table, rows, machine_id)
+
+_writer = None
+
+def get_writer():
+    """Returns the process-wide writer that spools readings while the database is unavailable."""
+    global _writer
+    if _writer is None:
+        spool = Spool(
+            directory=os.getenv("SPOOL_DIR", "spool"),
+            fsync_policy=os.getenv("SPOOL_FSYNC", "interval"),
+        )
+        _writer = SpoolingWriter(spool, write_to_database,
+                                 latency_budget=float(os.getenv("DB_LATENCY_BUDGET_S", "2.0")))
+    return _writer
+
+_reading_listeners = []
+
+def register_reading_listener(listener):
+    """Calls listener(table, row, machine_id) with every reading as it arrives, before it is stored."""
+    _reading_listeners.append(listener)
+
+def insert_reading(table, data, machine_id=DEFAULT_MACHINE_ID, **source):
+    """Stores one validated reading, spooling it to disk if the database can't take it now.
+
+    source takes source_image_hash, processor_version and item_index.
+    """
+    row = reading_row(table, data, machine_id, **source)
+    for listener in _reading_listeners:
+        try:
+            listener(table, row, machine_id)
+        except Exception as e:
+            print(f"Reading listener failed: {e}")
+    with span("db_insert"):
+        get_writer().write(table, [row], machine_id)
+
+def insert_control_panel1_data(data, machine_id=DEFAULT_MACHINE_ID, **source):
+    insert_reading("control_panel1", data, machine_id, **source)
+
+def insert_control_panel2_data(data, machine_id=DEFAULT_MACHINE_ID, **source):
+    insert_reading("control_panel2", data, machine_id, **source)
+
+def insert_control_panel3_data(data, machine_id=DEFAULT_MACHINE_ID, **source):
+    insert_reading("control_panel3", data, machine_id, **source)
+
+def insert_control_panel4_data(data, machine_id=DEFAULT_MACHINE_ID, **source):
+    insert_reading("control_panel4", data, machine_id, **source)
+
+def insert_control_panel5_data(data, machine_id=DEFAULT_MACHINE_ID, **source):
+    insert_reading("control_panel5", data, machine_id, **source)
+
+def insert_control_panel6_data(data, machine_id=DEFAULT_MACHINE_ID, **source):
+    insert_reading("control_panel6", data, machine_id, **source)
@@ -0,0 +1,512 @@
+from datetime import datetime
+from .backends import get_backend
+from .timestamps import parse_screen_datetime
+
+# Columns the baseline control_panel1-6 tables were created without.
+READING_COLUMNS = [
+    ("machine_id", "VARCHAR(64)"),
+    ("captured_at", "DATETIME"),
+    ("source_image_hash", "CHAR(64)"),
+    ("processor_version", "VARCHAR(32)"),
+    ("item_index", "INT"),
+]
+
+def _upgrade_reading_tables(c):
+    """Brings control_panel1-6 tables created before migration 1 up to its shape.
+
+    CREATE TABLE IF NOT EXISTS leaves such tables alone, so they get the
+    reading columns, the machine/time index and the idempotency key here, and
+    their rows the default machine and a captured_at read off CurrentDateTime.
+    """
+    from .db_setup import DEFAULT_MACHINE_ID
+    backend = get_backend()
+    for number in range(1, 7):
+        table = f"control_panel{number}"
+        columns = backend.table_columns(c, table)
+        if not columns:
+            continue
+        missing = [(name, kind) for name, kind in READING_COLUMNS if name not in columns]
+        for name, kind in missing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+        indexes = backend.index_names(c, table)
+        if f"idx_{table}_machine_time" not in indexes:
+            c.execute(f"CREATE INDEX idx_{table}_machine_time ON {table} (machine_id, captured_at)")
+        if "source_image_hash" in dict(missing) and f"uq_{table}_reading" not in indexes:
+            c.execute(f"CREATE UNIQUE INDEX uq_{table}_reading ON {table} "
+                      "(source_image_hash, processor_version, item_index)")
+        if not missing:
+            continue
+        c.execute(f"UPDATE {table} SET machine_id = %s WHERE machine_id IS NULL", (DEFAULT_MACHINE_ID,))
+        c.execute(f"SELECT id, CurrentDateTime FROM {table} WHERE captured_at IS NULL")
+        times = [(parse_screen_datetime(text), row_id) for row_id, text in c.fetchall()]
+        times = [(captured_at, row_id) for captured_at, row_id in times if captured_at is not None]
+        if times:
+            c.executemany(f"UPDATE {table} SET captured_at = %s WHERE id = %s", times)
+        print(f"Upgraded {table}: added {', '.join(name for name, _ in missing)}")
+
+READING_KEY = ["machine_id", "source_image_hash", "processor_version", "item_index"]
+
+def _key_readings_by_machine(c):
+    """Replaces the idempotency key of every screen table with one that includes machine_id."""
+    backend = get_backend()
+    for number in range(1, 11):
+        table = f"control_panel{number}"
+        if not backend.table_columns(c, table):
+            continue
+        keys = backend.unique_keys(c, table)
+        if READING_KEY in keys.values():
+            continue
+        for name, columns in keys.items():
+            if columns == READING_KEY[1:]:
+                backend.drop_unique_key(c, table, name)
+        c.execute(f"CREATE UNIQUE INDEX uq_{table}_reading ON {table} ({', '.join(READING_KEY)})")
+
+# (version, description, statements), applied in order. A statement is SQL or
+# a function taking the cursor. Append new migrations; never edit one that has
+# shipped.
+MIGRATIONS = [
+    (1, "Screen tables control_panel1-6, metric rollups and alarm events", [
+        # Table for main_control_panel_processor
+        '''CREATE TABLE IF NOT EXISTS control_panel1 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            HDPE_factor REAL,
+            PP_factor REAL,
+            HDPE_Exponent REAL,
+            PP_Exponent REAL,
+            HDPE_OutputFactorMeltPump REAL,
+            PP_OutputFactorMeltPump REAL,
+            Titer_g_9000m REAL,
+            NumberOfTapes INTEGER,
+            EdgeTrimSide_mm REAL,
+            TapeWidth_mm REAL,
+            CuttingWidth_mm REAL,
+            TotalRatioTheoretical REAL,
+            TotalRatioActual REAL,
+            StretchRatioActual REAL,
+            CalculatedPumpRPM REAL,
+            RawMaterialPercentage REAL,
+            AdditivePercentage TEXT,
+            Company TEXT,
+            ExtruderType TEXT,
+            ScrewType TEXT,
+            DieType TEXT,
+            AlarmMessages TEXT,
+            INDEX idx_control_panel1_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for temperature_and_motor_data_processor
+        '''CREATE TABLE IF NOT EXISTS control_panel2 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            OIL_HEATER_Target_Temp_1 REAL,
+            OIL_HEATER_Actual_Temp_1 REAL,
+            OIL_HEATER_Target_Temp_2 REAL,
+            OIL_HEATER_Actual_Temp_2 REAL,
+            HOT_AIR_Target_Temp REAL,
+            HOT_AIR_Actual_Temp REAL,
+            ANNEALING_Percentage REAL,
+            Line_Speed_1 REAL,
+            Amperage_1 REAL,
+            Torque_1 REAL,
+            Line_Speed_2 REAL,
+            Amperage_2 REAL,
+            Torque_2 REAL,
+            Line_Speed_3 REAL,
+            Amperage_3 REAL,
+            Torque_3 REAL,
+            AlarmMessages TEXT,
+            INDEX idx_control_panel2_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for extrusion_line_overview_processor
+        '''CREATE TABLE IF NOT EXISTS control_panel3 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            LineSpeed_rpm REAL,
+            CutTension_kg REAL,
+            ExtruderSpeed_rpm REAL,
+            TakeOffSpeed_mpm REAL,
+            FilmOscillation_mm REAL,
+            WaterExhaust_status TEXT,
+            WaterPump_status TEXT,
+            AlarmMessages TEXT,
+            INDEX idx_control_panel3_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for godet_and_extruder_data_processor
+        '''CREATE TABLE IF NOT EXISTS control_panel4 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            OilHeater1_Temp_C REAL,
+            OilHeater2_Temp_C REAL,
+            TotalRatio REAL,
+            StretchRatio REAL,
+            Annealing_percent TEXT,
+            Godet1_speed_ms REAL,
+            Godet1_temp_C REAL,
+            Godet2_speed_mpm REAL,
+            Godet2_current_A REAL,
+            Godet3_speed_mpm REAL,
+            Godet3_current_A REAL,
+            Godet4_speed_mpm REAL,
+            Godet4_current_A REAL,
+            Godet4_torque_percent REAL,
+            Extruder_speed_rpm REAL,
+            Zone1_temp_C REAL,
+            Zone1_pressure REAL,
+            Zone1_motor_load_percent REAL,
+            Zone2_temp_C REAL,
+            Zone2_pressure REAL,
+            Zone2_motor_load_percent REAL,
+            Zone2_torque_percent REAL,
+            AlarmMessages TEXT,
+            INDEX idx_control_panel4_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for main_control_panel_alarm_processor
+        '''CREATE TABLE IF NOT EXISTS control_panel5 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            LineSpeed_rpm REAL,
+            CutTension_kg REAL,
+            ExtruderSpeed_rpm REAL,
+            TakeOffSpeed_mpm REAL,
+            FilmOscillation_mm REAL,
+            WaterExhaust_status TEXT,
+            WaterPump_status TEXT,
+            Extruder_status TEXT,
+            AlarmMessages TEXT,
+            INDEX idx_control_panel5_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for extruder_details_processor
+        '''CREATE TABLE IF NOT EXISTS control_panel6 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            LineSpeed_m_min REAL,
+            Output_kg REAL,
+            Extruder_rpm REAL,
+            Extruder_Nm REAL,
+            Z1_temp REAL,
+            Z2_temp REAL,
+            Z3_temp REAL,
+            Z4_temp REAL,
+            Z5_temp REAL,
+            Z6_temp REAL,
+            Z11_temp REAL,
+            Z13_temp REAL,
+            Z14_temp REAL,
+            AlarmMessages TEXT,
+            INDEX idx_control_panel6_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Per-minute and per-hour metric aggregates, merged as readings are written
+        '''CREATE TABLE IF NOT EXISTS rollup_1m (
+            machine_id VARCHAR(64) NOT NULL,
+            source_table VARCHAR(32) NOT NULL,
+            metric VARCHAR(64) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            min_value DOUBLE NOT NULL,
+            max_value DOUBLE NOT NULL,
+            sum_value DOUBLE NOT NULL,
+            sample_count INT NOT NULL,
+            PRIMARY KEY (machine_id, source_table, metric, bucket_start)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS rollup_1h (
+            machine_id VARCHAR(64) NOT NULL,
+            source_table VARCHAR(32) NOT NULL,
+            metric VARCHAR(64) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            min_value DOUBLE NOT NULL,
+            max_value DOUBLE NOT NULL,
+            sum_value DOUBLE NOT NULL,
+            sample_count INT NOT NULL,
+            PRIMARY KEY (machine_id, source_table, metric, bucket_start)
+        )''',
+        # Interned alarm texts, shared by every machine and screen
+        '''CREATE TABLE IF NOT EXISTS alarm_texts (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            text_hash CHAR(40) NOT NULL UNIQUE,
+            text TEXT NOT NULL
+        )''',
+        # One row per alarm occurrence, kept up to date as readings arrive
+        '''CREATE TABLE IF NOT EXISTS alarm_events (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            alarm_text_id INT NOT NULL,
+            machine_id VARCHAR(64) NOT NULL,
+            screen VARCHAR(32) NOT NULL,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            active TINYINT NOT NULL DEFAULT 1,
+            INDEX idx_alarm_events_active (machine_id, screen, active),
+            INDEX idx_alarm_events_history (alarm_text_id, first_seen)
+        )''',
+    ]),
+    # image7-10 used to drop and recreate their tables on every frame, so the
+    # old tables never hold more than the last reading and are recreated here.
+    (2, "Standalone screen tables control_panel7-10", [
+        # Table for image7.py: analog meters and indicator lights
+        "DROP TABLE IF EXISTS control_panel7",
+        '''CREATE TABLE IF NOT EXISTS control_panel7 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            Voltmeter_V REAL,
+            Ammeter_A REAL,
+            RedLight_status TEXT,
+            YellowLight_status TEXT,
+            BlueLight_status TEXT,
+            INDEX idx_control_panel7_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for image8.py: JIADI controllers and indicator lights
+        "DROP TABLE IF EXISTS control_panel8",
+        '''CREATE TABLE IF NOT EXISTS control_panel8 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            JD_PR18_SV REAL,
+            JD_PR18_PV REAL,
+            JD_950F_P_main_display REAL,
+            JD_950F_P_secondary_display REAL,
+            YellowLight_status TEXT,
+            GreenLight_status TEXT,
+            RedLight_status TEXT,
+            INDEX idx_control_panel8_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for image9.py: Lohia loom
+        "DROP TABLE IF EXISTS control_panel9",
+        '''CREATE TABLE IF NOT EXISTS control_panel9 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            ACT1_kg REAL,
+            ACT2_kg REAL,
+            Fabric_Mtr REAL,
+            Efficiency_percent REAL,
+            MainSwitchTime_Hrs TEXT,
+            OperatingTime_Hrs TEXT,
+            WarpBreak REAL,
+            WeftBreak REAL,
+            WeftEnd REAL,
+            Tapes_per_10cm REAL,
+            Picks_per_Min REAL,
+            INDEX idx_control_panel9_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+        # Table for image10.py: BSW intelliCon loom
+        "DROP TABLE IF EXISTS control_panel10",
+        '''CREATE TABLE IF NOT EXISTS control_panel10 (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            captured_at DATETIME,
+            source_image_hash CHAR(64),
+            processor_version VARCHAR(32),
+            item_index INT,
+            CurrentDateTime TEXT,
+            Run_status TEXT,
+            Run_value REAL,
+            P_per_10cm REAL,
+            Speed_m_min REAL,
+            Shift REAL,
+            Efficiency_percent REAL,
+            Total_m2 REAL,
+            Total_m REAL,
+            Value_300 REAL,
+            Value_150_g_1 REAL,
+            Value_150_g_2 REAL,
+            Value_432_4 REAL,
+            Value_118_kg REAL,
+            INDEX idx_control_panel10_machine_time (machine_id, captured_at),
+            UNIQUE (source_image_hash, processor_version, item_index)
+        )''',
+    ]),
+    (3, "Change-only version table for the control_panel1 configuration screen", [
+        # One row per distinct configuration; valid_to is NULL for the current one
+        '''CREATE TABLE IF NOT EXISTS control_panel1_versions (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64) NOT NULL,
+            valid_from DATETIME NOT NULL,
+            valid_to DATETIME,
+            source_image_hash CHAR(64),
+            HDPE_factor REAL,
+            PP_factor REAL,
+            HDPE_Exponent REAL,
+            PP_Exponent REAL,
+            HDPE_OutputFactorMeltPump REAL,
+            PP_OutputFactorMeltPump REAL,
+            Titer_g_9000m REAL,
+            NumberOfTapes INTEGER,
+            EdgeTrimSide_mm REAL,
+            TapeWidth_mm REAL,
+            CuttingWidth_mm REAL,
+            TotalRatioTheoretical REAL,
+            TotalRatioActual REAL,
+            StretchRatioActual REAL,
+            CalculatedPumpRPM REAL,
+            RawMaterialPercentage REAL,
+            AdditivePercentage TEXT,
+            Company TEXT,
+            ExtruderType TEXT,
+            ScrewType TEXT,
+            DieType TEXT,
+            INDEX idx_control_panel1_versions_asof (machine_id, valid_from)
+        )''',
+    ]),
+    (4, "Fused cross-screen values and suspect fields awaiting re-extraction", [
+        '''CREATE TABLE IF NOT EXISTS fused_readings (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64) NOT NULL,
+            quantity VARCHAR(64) NOT NULL,
+            captured_at DATETIME NOT NULL,
+            value REAL,
+            source_count INT,
+            spread REAL,
+            UNIQUE (machine_id, quantity, captured_at)
+        )''',
+        # One row per screen field that disagreed with the other screens
+        '''CREATE TABLE IF NOT EXISTS suspect_fields (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64) NOT NULL,
+            screen VARCHAR(32) NOT NULL,
+            reading_id INT NOT NULL,
+            field VARCHAR(64) NOT NULL,
+            source_image_hash CHAR(64),
+            captured_at DATETIME,
+            value REAL,
+            expected REAL,
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            UNIQUE (screen, reading_id, field),
+            INDEX idx_suspect_fields_status (status, captured_at)
+        )''',
+    ]),
+    (5, "Token usage and wall time of every LLM call", [
+        '''CREATE TABLE IF NOT EXISTS llm_usage (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            machine_id VARCHAR(64),
+            processor VARCHAR(64) NOT NULL,
+            model VARCHAR(64),
+            source_image_hash CHAR(64),
+            called_at DATETIME NOT NULL,
+            input_tokens INT,
+            output_tokens INT,
+            image_tokens INT,
+            total_tokens INT,
+            wall_s REAL,
+            first_token_s REAL,
+            INDEX idx_llm_usage_time (called_at),
+            INDEX idx_llm_usage_machine_time (machine_id, called_at),
+            INDEX idx_llm_usage_image (source_image_hash)
+        )''',
+    ]),
+    (6, "Reading columns, index and idempotency key on pre-existing screen tables", [
+        _upgrade_reading_tables,
+    ]),
+    # Two machines can show the same frame hash, e.g. a blank or identical idle screen.
+    (7, "Screen table idempotency key includes machine_id", [
+        _key_readings_by_machine,
+    ]),
+    (8, "Conflict flag on fused readings whose screens all disagree", [
+        "ALTER TABLE fused_readings ADD COLUMN conflict TINYINT NOT NULL DEFAULT 0",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_schema_ready = False
+
+def current_version(conn):
+    """Returns the applied schema version, or 0 on a database without schema_version."""
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT MAX(version) FROM schema_version")
+            row = c.fetchone()
+    except Exception:
+        conn.rollback()
+        return 0
+    return row[0] or 0
+
+def apply_migrations():
+    """Applies every migration newer than the database's version. Returns the new version."""
+    backend = get_backend()
+    with backend.transaction() as conn:
+        version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+    if version == 0:
+        backend.initialize()
+        with backend.transaction() as conn:
+            with conn.cursor() as c:
+                c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description TEXT,
+                    applied_at DATETIME
+                )''')
+                # Migration 1 indexes columns that tables from before the migrations lack.
+                _upgrade_reading_tables(c)
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+        with backend.transaction() as conn:
+            with conn.cursor() as c:
+                for statement in statements:
+                    if callable(statement):
+                        statement(c)
+                    else:
+                        c.execute(statement)
+                c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+                          (number, description, datetime.now().replace(microsecond=0)))
+        print(f"Applied schema migration {number}: {description}")
+        version = number
+    return version
+
+def ensure_schema():
+    """Brings the schema up to date once per process; later calls cost nothing."""
+    global _schema_ready
+    if not _schema_ready:
+        apply_migrations()
+        _schema_ready = True
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import re
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .config_versions import VERSIONED_TABLES
+from .db_operations import TABLE_COLUMNS, JSON_COLUMNS
+from .backends import get_backend
+from .db_setup import get_db_connection
+from .queries import stream_chunks, DEFAULT_CHUNK_SIZE
+
+# SQL column type -> Arrow type for the exported files.
+SQL_TO_ARROW = {
+    "INT": pa.int64(),
+    "INTEGER": pa.int64(),
+    "BIGINT": pa.int64(),
+    "TINYINT": pa.int8(),
+    "REAL": pa.float64(),
+    "DOUBLE": pa.float64(),
+    "FLOAT": pa.float64(),
+    "DATETIME": pa.timestamp("s"),
+    "TEXT": pa.string(),
+    "VARCHAR": pa.string(),
+    "CHAR": pa.string(),
+}
+
+# JSON text columns become native list columns.
+LIST_TYPES = {
+    "AlarmMessages": pa.list_(pa.string()),
+    "AdditivePercentage": pa.list_(pa.float64()),
+}
+
+WATERMARK_FILE = "_watermarks.json"
+
+# Seconds an id below the watermark may still turn up: a transaction that took
+# its id before a later one committed. Missing ids older than this were rolled back.
+GAP_LAG_S = 3600
+
+def table_schema(table, conn):
+    """Builds the Arrow schema of a table from the columns it has in the database."""
+    with conn.cursor() as c:
+        columns = get_backend().column_types(c, table)
+    if not columns:
+        raise ValueError(f"No table {table} in the database")
+    fields = []
+    for name, sql_type in columns:
+        if name in JSON_COLUMNS:
+            fields.append(pa.field(name, LIST_TYPES.get(name, pa.list_(pa.string()))))
+        else:
+            fields.append(pa.field(name, SQL_TO_ARROW.get(re.match(r"[A-Z]*", sql_type).group(0), pa.string())))
+    return pa.schema(fields)
+
+def load_watermarks(out_dir):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_watermarks(out_dir, watermarks):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _partition(captured_at):
+    return captured_at.strftime("%Y-%m-%d") if captured_at is not None else "unknown"
+
+def _write_partition(out_dir, table, date, schema, columns):
+    ids = columns["id"]
+    directory = os.path.join(out_dir, table, f"date={date}")
+    os.makedirs(directory, exist_ok=True)
+    # Named by id range, so a rerun after a crash overwrites rather than duplicates.
+    path = os.path.join(directory, f"part-{ids[0]:012d}-{ids[-1]:012d}.parquet")
+    arrow_table = pa.Table.from_pydict(columns, schema=schema)
+    pq.write_table(arrow_table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+    return path
+
+def _read_gaps(watermark, now, gap_lag):
+    """Returns the watermark as {"id", "gaps"}, without gaps older than gap_lag seconds."""
+    if isinstance(watermark, int):
+        watermark = {"id": watermark, "gaps": {}}
+    watermark["gaps"] = {gap: seen for gap, seen in watermark["gaps"].items() if now - seen < gap_lag}
+    return watermark
+
+def export_table(table, out_dir, chunk_size=DEFAULT_CHUNK_SIZE, conn=None, gap_lag=GAP_LAG_S):
+    """Exports rows newer than the table's id watermark into date-partitioned Parquet files.
+
+    Returns the number of rows exported. Rows overwritten in place by an upsert keep
+    their id and are not re-exported. Ids are handed out when a row is inserted
+    but rows become visible when their transaction commits, so ids skipped below
+    the watermark are kept as gaps and read again on later runs, for up to
+    gap_lag seconds. Configuration screens in VERSIONED_TABLES export their
+    version table, without valid_to, which is filled in after export: a version
+    runs until the next one's valid_from.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    source = VERSIONED_TABLES.get(table, table)
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    exported = 0
+    try:
+        schema = table_schema(source, conn)
+        if "valid_to" in schema.names:
+            schema = schema.remove(schema.get_field_index("valid_to"))
+        names = schema.names
+        captured_index = names.index("valid_from" if "valid_from" in names else "captured_at")
+        watermarks = load_watermarks(out_dir)
+        watermark = _read_gaps(watermarks.get(source, 0), time.time(), gap_lag)
+        gaps = sorted(int(gap) for gap in watermark["gaps"])
+        queries = [(f"SELECT {', '.join(names)} FROM {source} WHERE id IN ({', '.join(['%s'] * len(batch))}) "
+                    "ORDER BY id", tuple(batch)) for batch in (gaps[i:i + 500] for i in range(0, len(gaps), 500))]
+        queries.append((f"SELECT {', '.join(names)} FROM {source} WHERE id > %s ORDER BY id", (watermark["id"],)))
+        for sql, params in queries:
+            for rows in stream_chunks(conn, sql, params, chunk_size):
+                partitions = {}
+                for row in rows:
+                    columns = partitions.setdefault(_partition(row[captured_index]), {name: [] for name in names})
+                    for name, value in zip(names, row):
+                        if name in JSON_COLUMNS:
+                            value = json.loads(value) if value else []
+                        columns[name].append(value)
+                for date, columns in partitions.items():
+                    _write_partition(out_dir, source, date, schema, columns)
+                now = time.time()
+                for row in rows:
+                    watermark["gaps"].pop(str(row[0]), None)
+                    if row[0] > watermark["id"]:
+                        for gap in range(watermark["id"] + 1, row[0]):
+                            watermark["gaps"][str(gap)] = now
+                        watermark["id"] = row[0]
+                exported += len(rows)
+                watermarks[source] = watermark
+                save_watermarks(out_dir, watermarks)
+        watermarks[source] = watermark
+        save_watermarks(out_dir, watermarks)
+    finally:
+        if own_conn:
+            conn.close()
+    return exported
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export new readings to Parquet.")
+    parser.add_argument("--out", default="exports", help="Output directory")
+    parser.add_argument("tables", nargs="*", default=list(TABLE_COLUMNS), help="Tables to export")
+    args = parser.parse_args()
+    for table in args.tables:
+        print(f"{table}: exported {export_table(table, args.out)} rows")
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from .config_versions import VERSIONED_TABLES, config_columns
+from .db_operations import TABLE_COLUMNS
+from .db_setup import get_db_connection, DEFAULT_MACHINE_ID
+from .rollups import ROLLUP_METRICS, ROLLUP_RESOLUTIONS
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+def stream_chunks(conn, sql, params, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields lists of rows from an unbuffered (server-side) cursor."""
+    with conn.cursor(buffered=False) as c:
+        c.execute(sql, params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+_CHUNK_DTYPE = np.dtype([("t", "datetime64[us]"), ("v", np.float64)])
+
+def _chunk_arrays(rows):
+    """Turns a chunk of (captured_at, value) rows into typed arrays, NULL values as NaN."""
+    chunk = np.fromiter(rows, dtype=_CHUNK_DTYPE, count=len(rows))
+    return chunk["t"], chunk["v"]
+
+def check_metric(table, metric):
+    """Rejects a table or metric that isn't a known screen column; both go into the SQL text."""
+    if table not in TABLE_COLUMNS:
+        raise ValueError(f"Unknown table: {table!r}")
+    if metric not in TABLE_COLUMNS[table]:
+        raise ValueError(f"Unknown metric of {table}: {metric!r}")
+    if table in VERSIONED_TABLES and metric not in config_columns(TABLE_COLUMNS[table]):
+        raise ValueError(f"{table} keeps only its configuration, not {metric!r}")
+
+def iter_metric_chunks(table, metric, start, end, machine_id=DEFAULT_MACHINE_ID,
+                       chunk_size=DEFAULT_CHUNK_SIZE, conn=None):
+    """Yields (timestamps, values) NumPy array pairs for one metric, chunk by chunk.
+
+    Configuration screens in VERSIONED_TABLES yield one value per version in
+    force during the range, timestamped when it took effect, or at start for
+    the one already in force then.
+    """
+    check_metric(table, metric)
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        if table in VERSIONED_TABLES:
+            sql = f'''SELECT valid_from, {metric} FROM {VERSIONED_TABLES[table]}
+                      WHERE machine_id = %s AND valid_from < %s AND (valid_to IS NULL OR valid_to > %s)
+                      ORDER BY valid_from'''
+            for rows in stream_chunks(conn, sql, (machine_id, end, start), chunk_size):
+                timestamps, values = _chunk_arrays(rows)
+                yield np.maximum(timestamps, np.datetime64(start, "us")), values
+            return
+        sql = f'''SELECT captured_at, {metric} FROM {table}
+                  WHERE machine_id = %s AND captured_at >= %s AND captured_at < %s
+                  ORDER BY captured_at'''
+        for rows in stream_chunks(conn, sql, (machine_id, start, end), chunk_size):
+            yield _chunk_arrays(rows)
+    finally:
+        if own_conn:
+            conn.close()
+
+def _rollup_table_for(table, metric, step):
+    """Picks the coarsest rollup table whose buckets divide the resample step."""
+    if metric not in ROLLUP_METRICS.get(table, []):
+        return None
+    candidates = [(seconds, name) for name, seconds in ROLLUP_RESOLUTIONS.items()
+                  if step % pd.Timedelta(seconds=seconds) == pd.Timedelta(0)]
+    return max(candidates)[1] if candidates else None
+
+def _resample_frame(bins, mins, maxs, sums, counts, step):
+    order = np.argsort(bins)
+    frame = pd.DataFrame({
+        "min": mins[order],
+        "max": maxs[order],
+        "mean": sums[order] / counts[order],
+        "count": counts[order],
+    }, index=pd.to_datetime(bins[order] * step.value))
+    frame.index.name = "bucket_start"
+    return frame
+
+def _merge_bins(state, bins, mins, maxs, sums, counts):
+    """Merges per-chunk bucket aggregates into the running state dict."""
+    for b, lo, hi, total, n in zip(bins.tolist(), mins.tolist(), maxs.tolist(), sums.tolist(), counts.tolist()):
+        agg = state.get(b)
+        if agg is None:
+            state[b] = [lo, hi, total, n]
+        else:
+            agg[0] = min(agg[0], lo)
+            agg[1] = max(agg[1], hi)
+            agg[2] += total
+            agg[3] += n
+
+def _aggregate_chunk(timestamps, values, step):
+    """Buckets one chunk with NumPy and returns per-bucket min/max/sum/count."""
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+    if not len(values):
+        return None
+    bins = timestamps.astype("datetime64[ns]").astype(np.int64) // step.value
+    uniq, inverse = np.unique(bins, return_inverse=True)
+    mins = np.full(len(uniq), np.inf)
+    maxs = np.full(len(uniq), -np.inf)
+    np.minimum.at(mins, inverse, values)
+    np.maximum.at(maxs, inverse, values)
+    sums = np.bincount(inverse, weights=values, minlength=len(uniq))
+    counts = np.bincount(inverse, minlength=len(uniq))
+    return uniq, mins, maxs, sums, counts
+
+def query_metric(table, metric, start, end, machine_id=DEFAULT_MACHINE_ID, resample=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, conn=None):
+    """Reads one metric for a machine and time range into a pandas frame.
+
+    Without resample, returns the raw series indexed by captured_at. With a
+    resample interval (e.g. "5min"), returns min/max/mean/count per bucket,
+    served from the rollup tables when their buckets line up and otherwise
+    aggregated chunk by chunk so memory is bounded by the number of buckets.
+    Buckets starting before start, which would only be partly covered, are left out.
+    """
+    check_metric(table, metric)
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        if resample is None:
+            ts_parts, value_parts = [], []
+            for timestamps, values in iter_metric_chunks(table, metric, start, end, machine_id, chunk_size, conn):
+                ts_parts.append(timestamps)
+                value_parts.append(values)
+            timestamps = np.concatenate(ts_parts) if ts_parts else np.array([], dtype="datetime64[us]")
+            values = np.concatenate(value_parts) if value_parts else np.array([], dtype=np.float64)
+            return pd.DataFrame({metric: values}, index=pd.DatetimeIndex(timestamps, name="captured_at"))
+
+        step = pd.Timedelta(resample)
+        state = {}
+        rollup_table = _rollup_table_for(table, metric, step)
+        if rollup_table is not None:
+            sql = f'''SELECT bucket_start, min_value, max_value, sum_value, sample_count FROM {rollup_table}
+                      WHERE machine_id = %s AND source_table = %s AND metric = %s
+                      AND bucket_start >= %s AND bucket_start < %s'''
+            for rows in stream_chunks(conn, sql, (machine_id, table, metric, start, end), chunk_size):
+                starts = np.array([row[0] for row in rows], dtype="datetime64[ns]").astype(np.int64)
+                columns = np.array([row[1:] for row in rows], dtype=np.float64)
+                _merge_bins(state, starts // step.value, columns[:, 0], columns[:, 1], columns[:, 2],
+                            columns[:, 3].astype(np.int64))
+        else:
+            for timestamps, values in iter_metric_chunks(table, metric, start, end, machine_id, chunk_size, conn):
+                aggregated = _aggregate_chunk(timestamps, values, step)
+                if aggregated is not None:
+                    _merge_bins(state, *aggregated)
+
+        first_bin = -(-pd.Timestamp(start).value // step.value)
+        state = {b: agg for b, agg in state.items() if b >= first_bin}
+        bins = np.fromiter(state.keys(), dtype=np.int64, count=len(state))
+        aggs = np.array(list(state.values()), dtype=np.float64).reshape(-1, 4)
+        return _resample_frame(bins, aggs[:, 0], aggs[:, 1], aggs[:, 2], aggs[:, 3].astype(np.int64), step)
+    finally:
+        if own_conn:
+            conn.close()
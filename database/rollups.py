@@ -0,0 +1,119 @@
+from datetime import timedelta
+from .backends import get_backend
+from .db_setup import DEFAULT_MACHINE_ID
+
+# Rollup table -> bucket width in seconds.
+ROLLUP_RESOLUTIONS = {
+    "rollup_1m": 60,
+    "rollup_1h": 3600,
+}
+
+# Numeric columns aggregated per source table.
+ROLLUP_METRICS = {
+    "control_panel2": [
+        "OIL_HEATER_Target_Temp_1", "OIL_HEATER_Actual_Temp_1",
+        "OIL_HEATER_Target_Temp_2", "OIL_HEATER_Actual_Temp_2",
+        "HOT_AIR_Target_Temp", "HOT_AIR_Actual_Temp", "ANNEALING_Percentage",
+        "Line_Speed_1", "Amperage_1", "Torque_1",
+        "Line_Speed_2", "Amperage_2", "Torque_2",
+        "Line_Speed_3", "Amperage_3", "Torque_3",
+    ],
+    "control_panel6": [
+        "LineSpeed_m_min", "Output_kg", "Extruder_rpm", "Extruder_Nm",
+        "Z1_temp", "Z2_temp", "Z3_temp", "Z4_temp", "Z5_temp", "Z6_temp",
+        "Z11_temp", "Z13_temp", "Z14_temp",
+    ],
+}
+
+def bucket_start(captured_at, seconds):
+    """Truncates a timestamp to the start of its bucket."""
+    if seconds == 3600:
+        return captured_at.replace(minute=0, second=0, microsecond=0)
+    return captured_at.replace(second=0, microsecond=0)
+
+def aggregate_readings(table, readings):
+    """Folds (captured_at, values) pairs into per-bucket partial aggregates.
+
+    Returns {rollup_table: {(metric, bucket): [min, max, sum, count]}}.
+    """
+    metrics = ROLLUP_METRICS.get(table, [])
+    partials = {rollup_table: {} for rollup_table in ROLLUP_RESOLUTIONS}
+    for captured_at, values in readings:
+        for metric in metrics:
+            value = values.get(metric)
+            if value is None:
+                continue
+            value = float(value)
+            for rollup_table, seconds in ROLLUP_RESOLUTIONS.items():
+                key = (metric, bucket_start(captured_at, seconds))
+                agg = partials[rollup_table].get(key)
+                if agg is None:
+                    partials[rollup_table][key] = [value, value, value, 1]
+                else:
+                    if value < agg[0]:
+                        agg[0] = value
+                    if value > agg[1]:
+                        agg[1] = value
+                    agg[2] += value
+                    agg[3] += 1
+    return partials
+
+def update_rollups(conn, table, readings, machine_id=DEFAULT_MACHINE_ID):
+    """Merges a batch of readings into the rollup tables.
+
+    min/max/sum/count merge exactly in any order, so late rows only touch the
+    buckets they fall into. The caller commits.
+    """
+    if table not in ROLLUP_METRICS:
+        return
+    partials = aggregate_readings(table, readings)
+    merge = get_backend().upsert_suffix(
+        ("machine_id", "source_table", "metric", "bucket_start"),
+        {"min_value": "min", "max_value": "max", "sum_value": "add", "sample_count": "add"},
+    )
+    with conn.cursor() as c:
+        for rollup_table, buckets in partials.items():
+            if not buckets:
+                continue
+            c.executemany(f'''INSERT INTO {rollup_table}
+                    (machine_id, source_table, metric, bucket_start, min_value, max_value, sum_value, sample_count)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s) {merge}''',
+                [(machine_id, table, metric, start, *agg) for (metric, start), agg in buckets.items()])
+
+def recompute_rollups(conn, table, captured_ats, machine_id=DEFAULT_MACHINE_ID):
+    """Rebuilds the buckets covering the given timestamps from the raw table.
+
+    Used after rows were backfilled or rewritten in place, where merging would
+    double count. Only the hours touched are read and rewritten. The caller commits.
+    """
+    if table not in ROLLUP_METRICS:
+        return
+    hours = sorted({bucket_start(ts, 3600) for ts in captured_ats})
+    if not hours:
+        return
+    metrics = ROLLUP_METRICS[table]
+    readings = []
+    with conn.cursor() as c:
+        for hour in hours:
+            hour_end = hour + timedelta(hours=1)
+            c.execute(f'''SELECT captured_at, {", ".join(metrics)} FROM {table}
+                          WHERE machine_id = %s AND captured_at >= %s AND captured_at < %s''',
+                      (machine_id, hour, hour_end))
+            readings.extend((row[0], dict(zip(metrics, row[1:]))) for row in c.fetchall())
+            for rollup_table in ROLLUP_RESOLUTIONS:
+                c.execute(f'''DELETE FROM {rollup_table}
+                              WHERE machine_id = %s AND source_table = %s
+                              AND bucket_start >= %s AND bucket_start < %s''',
+                          (machine_id, table, hour, hour_end))
+    update_rollups(conn, table, readings, machine_id)
+
+def read_rollups(conn, table, metric, start, end, machine_id=DEFAULT_MACHINE_ID, rollup_table="rollup_1m"):
+    """Returns (bucket_start, min, max, mean, count) rows for one metric and range."""
+    with conn.cursor() as c:
+        c.execute(f'''SELECT bucket_start, min_value, max_value, sum_value / sample_count, sample_count
+                      FROM {rollup_table}
+                      WHERE machine_id = %s AND source_table = %s AND metric = %s
+                      AND bucket_start >= %s AND bucket_start < %s
+                      ORDER BY bucket_start''',
+                  (machine_id, table, metric, start, end))
+        return c.fetchall()
@@ -0,0 +1,249 @@
+import os
+import threading
+import time
+from datetime import datetime
+import orjson
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+class Spool:
+    """Append-only, segmented on-disk log of rows waiting for the database.
+
+    Records go to an open segment (NNNNNNNNNNNN.open). When it exceeds
+    segment_bytes, or when the replayer asks for it, it is renamed to .seg and
+    becomes replayable. fsync_policy is "always" (every append), "interval"
+    (at most every fsync_interval seconds) or "never" (left to the OS).
+    """
+
+    def __init__(self, directory="spool", segment_bytes=4 * 1024 * 1024, fsync_policy="interval",
+                 fsync_interval=1.0):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_fsync = 0.0
+        os.makedirs(directory, exist_ok=True)
+        # Segments left open by a crash are complete up to their last full line.
+        for name in os.listdir(directory):
+            if name.endswith(".open"):
+                path = os.path.join(directory, name)
+                os.replace(path, path[:-len(".open")] + ".seg")
+        self._next_seq = max((int(name.split(".")[0]) for name in os.listdir(directory)
+                              if name.endswith(".seg")), default=0) + 1
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{self._next_seq:012d}.open")
+        self._next_seq += 1
+        self._file = open(path, "ab")
+
+    def _seal_locked(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync_policy != "never":
+            os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._file.name, self._file.name[:-len(".open")] + ".seg")
+        self._file = None
+
+    def append(self, records):
+        """Appends a list of JSON-serializable records."""
+        payload = b"".join(orjson.dumps(record) + b"\n" for record in records)
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(payload)
+            self._file.flush()
+            now = time.monotonic()
+            if self.fsync_policy == "always" or (
+                    self.fsync_policy == "interval" and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+            if self._file.tell() >= self.segment_bytes:
+                self._seal_locked()
+
+    def seal(self):
+        """Closes the open segment so everything appended so far can be replayed."""
+        with self._lock:
+            self._seal_locked()
+
+    @property
+    def dead_letter_path(self):
+        return os.path.join(self.directory, "dead-letter.jsonl")
+
+    def set_aside(self, records):
+        """Moves records the database keeps rejecting to the dead-letter file, for someone to look at."""
+        with open(self.dead_letter_path, "ab") as f:
+            f.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def segments(self):
+        """Returns sealed segment paths, oldest first."""
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(".seg"))
+
+    def has_backlog(self):
+        with self._lock:
+            return self._file is not None or bool(self.segments())
+
+    @staticmethod
+    def read(path):
+        """Reads a segment, skipping a torn final line."""
+        records = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    records.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue
+        return records
+
+    @staticmethod
+    def rewrite(path, records):
+        """Atomically replaces a segment with the records still to replay."""
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+class SpoolingWriter:
+    """Routes row batches to the database, or to the spool when it is down or slow.
+
+    A write that fails, or takes longer than latency_budget seconds, switches
+    writes to the spool. Writes keep going there while a backlog exists, which
+    keeps rows in order. A background thread replays the backlog in batches
+    of up to batch_size rows and retries every retry_interval seconds. Rows
+    the database rejects are set aside so they don't hold up the rest.
+    """
+
+    def __init__(self, spool, write_fn, latency_budget=2.0, retry_interval=5.0, batch_size=500, probe_limit=3):
+        self.spool = spool
+        self.write_fn = write_fn
+        self.latency_budget = latency_budget
+        self.retry_interval = retry_interval
+        self.batch_size = batch_size
+        self.probe_limit = probe_limit
+        self.set_aside = 0
+        self._degraded = spool.has_backlog()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._replayer = None
+        if self._degraded:
+            self._start_replayer()
+
+    def _start_replayer(self):
+        if self._replayer is None or not self._replayer.is_alive():
+            self._replayer = threading.Thread(target=self._replay_loop, name="spool-replayer", daemon=True)
+            self._replayer.start()
+
+    def write(self, table, rows, machine_id):
+        if not self._degraded:
+            started = time.monotonic()
+            try:
+                self.write_fn(table, rows, machine_id)
+            except Exception as e:
+                print(f"Database write failed, spooling reading: {e}")
+                self._degraded = True
+            else:
+                if time.monotonic() - started > self.latency_budget:
+                    print("Database write exceeded the latency budget, spooling subsequent readings.")
+                    self._degraded = True
+                return
+        with self._lock:
+            self._degraded = True
+            self.spool.append([{"table": table, "machine_id": machine_id, "row": row} for row in rows])
+            self._start_replayer()
+
+    def _replay_loop(self):
+        while True:
+            if self.replay():
+                with self._lock:
+                    if not self.spool.has_backlog():
+                        self._degraded = False
+                        self._replayer = None
+                        return
+                continue
+            self._wake.wait(self.retry_interval)
+
+    def replay(self):
+        """Drains sealed segments into the database. Returns True when fully drained.
+
+        When a batch fails its records are written one by one. A record that
+        fails while a later one goes through is rejected by the database
+        rather than unable to reach it, so it is set aside in the dead-letter
+        file and the rest keep draining. If probe_limit records in a row fail,
+        the database is taken to be down and replay pauses.
+        """
+        self.spool.seal()
+        segments = self.spool.segments()
+        for number, path in enumerate(segments):
+            records = Spool.read(path)
+            done, failed, single_until = 0, [], 0
+            while done < len(records):
+                if done < single_until:
+                    batch = records[done:done + 1]
+                else:
+                    batch = _same_target_run(records, done, self.batch_size)
+                try:
+                    self._write_records(batch)
+                except Exception as e:
+                    if len(batch) > 1:
+                        single_until = done + len(batch)
+                        continue
+                    batch[0]["attempts"] = batch[0].get("attempts", 0) + 1
+                    batch[0]["error"] = str(e)
+                    failed.append(batch[0])
+                    done += 1
+                    if len(failed) >= self.probe_limit:
+                        print(f"Spool replay paused: {e}")
+                        Spool.rewrite(path, records[done - len(failed):])
+                        return False
+                    continue
+                done += len(batch)
+                if failed:
+                    # A record after them went through, so the database is up and rejects these.
+                    self._set_aside(failed)
+                    failed = []
+            if failed and number + 1 < len(segments):
+                # Retry them ahead of the next segment, where a later record can show the database is up.
+                Spool.rewrite(segments[number + 1], failed + Spool.read(segments[number + 1]))
+            elif failed:
+                print(f"Spool replay paused: {failed[-1]['error']}")
+                Spool.rewrite(path, failed)
+                return False
+            os.remove(path)
+        return True
+
+    def _write_records(self, records):
+        first = records[0]
+        self.write_fn(first["table"], [_decode_row(r["row"]) for r in records], first["machine_id"])
+
+    def _set_aside(self, records):
+        self.spool.set_aside(records)
+        self.set_aside += len(records)
+        for record in records:
+            print(f"Set aside a spooled {record['table']} row the database rejected "
+                  f"{record['attempts']} time(s): {record['error']}")
+        print(f"{self.set_aside} spooled rows set aside so far in {self.spool.dead_letter_path}")
+
+def _same_target_run(records, start, limit):
+    """Returns the run of consecutive records sharing table and machine, up to limit."""
+    table, machine_id = records[start]["table"], records[start]["machine_id"]
+    end = start
+    while (end < len(records) and end - start < limit and records[end]["table"] == table
+           and records[end]["machine_id"] == machine_id):
+        end += 1
+    return records[start:end]
+
+def _decode_row(row):
+    row = dict(row)
+    if row.get("captured_at"):
+        row["captured_at"] = datetime.fromisoformat(row["captured_at"])
+    return row
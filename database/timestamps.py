@@ -0,0 +1,31 @@
+from datetime import datetime
+
+# Formats seen on the HMI clocks, most common first.
+SCREEN_DATETIME_FORMATS = (
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y.%m.%d %H:%M:%S",
+    "%Y.%m.%d %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%m-%Y %H:%M:%S",
+)
+
+def parse_screen_datetime(text):
+    """Parses a CurrentDateTime string read off a screen, or returns None."""
+    if not text:
+        return None
+    text = " ".join(str(text).split())
+    for fmt in SCREEN_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def reading_time(text):
+    """Returns the screen timestamp of a reading, falling back to the current time."""
+    return parse_screen_datetime(text) or datetime.now().replace(microsecond=0)
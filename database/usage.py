@@ -0,0 +1,103 @@
+import argparse
+from datetime import datetime, timedelta
+from .backends import get_backend
+from .migrations import ensure_schema
+
+# USD per million (input, output) tokens. Local Ollama models cost nothing per call.
+PRICES = {
+    "gemini-1.5-flash": (0.075, 0.30),
+    "qwen3:4b": (0.0, 0.0),
+}
+
+# Free-tier limits of hosted models: requests per minute, tokens per minute, requests per day.
+QUOTAS = {
+    "gemini-1.5-flash": {"rpm": 15, "tpm": 1_000_000, "rpd": 1500},
+}
+
+GROUP_COLUMNS = ("processor", "model", "machine_id")
+
+def record_llm_usage(usage):
+    """Usage listener (metrics.register_usage_listener): stores one model call in llm_usage."""
+    ensure_schema()
+    with get_backend().transaction() as conn:
+        with conn.cursor() as c:
+            c.execute('''INSERT INTO llm_usage (machine_id, processor, model, source_image_hash, called_at,
+                                                input_tokens, output_tokens, image_tokens, total_tokens,
+                                                wall_s, first_token_s)
+                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                      (usage["machine_id"], usage["processor"], usage["model"], usage["source_image_hash"],
+                       datetime.fromtimestamp(usage["called_at"]).replace(microsecond=0),
+                       usage["input_tokens"], usage["output_tokens"], usage["image_tokens"], usage["total_tokens"],
+                       usage["wall_s"], usage["first_token_s"]))
+
+def cost_usd(model, input_tokens, output_tokens):
+    """List-price cost of the tokens, or None for a model without a price."""
+    price = PRICES.get(model)
+    if price is None:
+        return None
+    return ((input_tokens or 0) * price[0] + (output_tokens or 0) * price[1]) / 1_000_000
+
+def usage_summary(start, end, by=GROUP_COLUMNS):
+    """Calls, tokens, wall time and cost between start and end, grouped by the columns in by."""
+    for column in by:
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Cannot group usage by {column}")
+    columns = ", ".join(by)
+    ensure_schema()
+    with get_backend().transaction() as conn:
+        with conn.cursor() as c:
+            c.execute(f'''SELECT {columns}, COUNT(*), SUM(input_tokens), SUM(output_tokens), SUM(image_tokens),
+                                 SUM(wall_s), AVG(wall_s)
+                          FROM llm_usage WHERE called_at >= %s AND called_at < %s
+                          GROUP BY {columns} ORDER BY SUM(total_tokens) DESC''', (start, end))
+            rows = c.fetchall()
+    summary = []
+    for row in rows:
+        group = dict(zip(by, row[:len(by)]))
+        calls, input_tokens, output_tokens, image_tokens, wall_s, mean_wall_s = row[len(by):]
+        group.update({
+            "calls": calls,
+            "input_tokens": input_tokens or 0,
+            "output_tokens": output_tokens or 0,
+            "image_tokens": image_tokens or 0,
+            "wall_s": wall_s or 0.0,
+            "mean_wall_s": mean_wall_s,
+            "cost_usd": cost_usd(group["model"], input_tokens, output_tokens) if "model" in group else None,
+        })
+        summary.append(group)
+    return summary
+
+def quota_burn(model, now=None):
+    """Share of model's QUOTAS used in the last minute and day, e.g. {"rpm": 0.4, "tpm": 0.1, "rpd": 0.05}."""
+    quota = QUOTAS[model]
+    now = now or datetime.now()
+    ensure_schema()
+    with get_backend().transaction() as conn:
+        with conn.cursor() as c:
+            c.execute('''SELECT COUNT(*), SUM(total_tokens) FROM llm_usage
+                         WHERE model = %s AND called_at >= %s''', (model, now - timedelta(minutes=1)))
+            minute_calls, minute_tokens = c.fetchone()
+            c.execute("SELECT COUNT(*) FROM llm_usage WHERE model = %s AND called_at >= %s",
+                      (model, now - timedelta(days=1)))
+            day_calls = c.fetchone()[0]
+    return {
+        "rpm": minute_calls / quota["rpm"],
+        "tpm": (minute_tokens or 0) / quota["tpm"],
+        "rpd": day_calls / quota["rpd"],
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Token usage and cost of the model calls.")
+    parser.add_argument("--hours", type=float, default=24, help="How far back to look")
+    parser.add_argument("--by", default="processor,model,machine_id",
+                        help="Comma-separated grouping out of processor, model and machine_id")
+    args = parser.parse_args()
+
+    end = datetime.now()
+    for row in usage_summary(end - timedelta(hours=args.hours), end, tuple(args.by.split(","))):
+        cost = row.pop("cost_usd")
+        print(", ".join(f"{key}={value}" for key, value in row.items())
+              + (f", cost_usd={cost:.4f}" if cost is not None else ""))
+    for model in QUOTAS:
+        burn = quota_burn(model, end)
+        print(f"{model} quota used: " + ", ".join(f"{key} {value:.0%}" for key, value in burn.items()))
@@ -0,0 +1,305 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from database.migrations import ensure_schema
+from processors.common import mark_frame_captured
+from analytics.deviation import LatencyStats
+from capture.sources import source_from_uri
+from capture.keyframes import KeyframeSelector
+from capture.alarm_bar import AlarmBarDetector
+from metrics import serve_metrics
+from profiling import add_profiling_arguments, profiler_from_args
+
+QUEUE_POLICIES = ("block", "drop-oldest", "latest")
+
+class MachineQueue:
+    """Bounded work queues of one machine (priority and routine lanes), with its share weight and counters.
+
+    policy decides what a full routine lane does with a new item: "block" the
+    producer, "drop-oldest" queued item, or keep only the "latest" item per key
+    (a newer frame of the same screen replaces the queued one, and the oldest
+    item goes when the lane is still full). Routine items older than max_age
+    seconds are shed instead of processed. The priority lane always blocks.
+    """
+
+    def __init__(self, machine_id, weight=1.0, maxsize=8, policy="block", max_age=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"policy must be one of {QUEUE_POLICIES}")
+        self.machine_id = machine_id
+        self.weight = weight
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_age = max_age
+        self.items = deque()
+        self.urgent = deque()
+        self.virtual_time = 0.0
+        self.in_flight = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_s = 0.0
+        self.service_s = 0.0
+        self.shed = {"dropped": 0, "replaced": 0, "stale": 0, "superseded": 0}
+        self.sample_fps = None
+        self._completed = deque()
+
+    def pressure(self):
+        """Fill level of the routine lane, from 0 (empty) to 1 (full)."""
+        return len(self.items) / self.maxsize
+
+    def shed_stale(self, now):
+        """Drops routine items older than max_age. Returns how many went."""
+        shed = 0
+        while self.max_age is not None and self.items and now - self.items[0][1] > self.max_age:
+            self.items.popleft()
+            shed += 1
+        self.shed["stale"] += shed
+        return shed
+
+    def shed_superseded(self, key, before):
+        """Drops routine items with key queued before the given time. Returns how many went."""
+        kept = deque(entry for entry in self.items if entry[2] != key or entry[1] >= before)
+        shed = len(self.items) - len(kept)
+        self.items = kept
+        self.shed["superseded"] += shed
+        return shed
+
+    def throughput(self, now, window=60.0):
+        """Items completed per minute over the last window seconds."""
+        while self._completed and now - self._completed[0] > window:
+            self._completed.popleft()
+        return len(self._completed) * 60.0 / window
+
+class FairScheduler:
+    """Hands out LLM slots across per-machine queues by weighted fair queuing.
+
+    Each machine is charged the service time its items take divided by its
+    weight; the next slot goes to the machine with work waiting and the least
+    charged time. A machine coming back from idle starts at the least charged
+    time of the busy ones, so idling earns no burst credit. At most
+    max_in_flight items per machine are processed at once, which keeps a
+    machine's readings in order. What put() does on a full queue follows the
+    machine's queue policy.
+
+    Urgent items (frames showing a new alarm) wait in a separate priority lane
+    that is served, oldest first, before any routine item. Routine items of
+    the same screen queued before it are dropped as superseded when it is
+    served, so a machine's readings of one screen are still stored in
+    capture order. Frame-to-stored latency is tracked separately for the two
+    lanes.
+    """
+
+    def __init__(self, max_in_flight=1):
+        self.max_in_flight = max_in_flight
+        self.queues = {}
+        self.latency = {"alarm": LatencyStats(), "routine": LatencyStats()}
+        self._cond = threading.Condition()
+
+    def add_machine(self, machine_id, weight=1.0, maxsize=8, policy="block", max_age=None):
+        with self._cond:
+            self.queues[machine_id] = MachineQueue(machine_id, weight, maxsize, policy, max_age)
+
+    def put(self, machine_id, item, urgent=False, key=None):
+        """Queues item. key identifies the screen for the "latest" policy and superseded items.
+
+        enqueued counts items added to a lane, not ones that replaced a queued item.
+        """
+        with self._cond:
+            queue = self.queues[machine_id]
+            now = time.monotonic()
+            if not queue.items and not queue.urgent and not queue.in_flight:
+                busy = [q.virtual_time for q in self.queues.values() if q.items or q.urgent or q.in_flight]
+                if busy:
+                    queue.virtual_time = max(queue.virtual_time, min(busy))
+            if urgent or queue.policy == "block":
+                lane = queue.urgent if urgent else queue.items
+                while len(lane) >= queue.maxsize:
+                    self._cond.wait()
+                lane.append((item, now, key))
+                queue.enqueued += 1
+                self._cond.notify_all()
+                return
+            if queue.policy == "latest" and key is not None:
+                for position, (_, _, queued_key) in enumerate(queue.items):
+                    if queued_key == key:
+                        # Requeued at the back, so the lane stays in capture order.
+                        del queue.items[position]
+                        queue.items.append((item, now, key))
+                        queue.shed["replaced"] += 1
+                        self._cond.notify_all()
+                        return
+            if len(queue.items) >= queue.maxsize:
+                queue.items.popleft()
+                queue.shed["dropped"] += 1
+            queue.items.append((item, now, key))
+            queue.enqueued += 1
+            self._cond.notify_all()
+
+    def pressure(self, machine_id):
+        with self._cond:
+            return self.queues[machine_id].pressure()
+
+    def _ready(self):
+        """Returns the queue and lane to serve next, or (None, None)."""
+        now = time.monotonic()
+        if sum(queue.shed_stale(now) for queue in self.queues.values()):
+            self._cond.notify_all()
+        free = [q for q in self.queues.values() if q.in_flight < self.max_in_flight]
+        urgent = [q for q in free if q.urgent]
+        if urgent:
+            queue = min(urgent, key=lambda q: q.urgent[0][1])
+            return queue, queue.urgent
+        ready = [q for q in free if q.items]
+        if ready:
+            queue = min(ready, key=lambda q: q.virtual_time)
+            return queue, queue.items
+        return None, None
+
+    def get(self):
+        """Blocks until work is available. Returns (machine_id, item, started, urgent); pass started to done()."""
+        with self._cond:
+            queue, lane = self._ready()
+            while queue is None:
+                self._cond.wait(timeout=1.0)
+                queue, lane = self._ready()
+            item, enqueued_at, key = lane.popleft()
+            if lane is queue.urgent and key is not None:
+                # Stored after this frame, their older readings would be taken as out of order and skipped.
+                queue.shed_superseded(key, enqueued_at)
+            queue.in_flight += 1
+            started = time.monotonic()
+            queue.wait_s += started - enqueued_at
+            self._cond.notify_all()
+            return queue.machine_id, item, started, lane is queue.urgent
+
+    def done(self, machine_id, started, ok=True):
+        with self._cond:
+            queue = self.queues[machine_id]
+            now = time.monotonic()
+            queue.in_flight -= 1
+            queue.service_s += now - started
+            queue.virtual_time += (now - started) / queue.weight
+            if ok:
+                queue.processed += 1
+            else:
+                queue.failed += 1
+            queue._completed.append(now)
+            self._cond.notify_all()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {q.machine_id: {
+                "weight": q.weight,
+                "queue_depth": len(q.items),
+                "priority_depth": len(q.urgent),
+                "in_flight": q.in_flight,
+                "processed": q.processed,
+                "failed": q.failed,
+                "per_minute": q.throughput(now),
+                "policy": q.policy,
+                "shed": dict(q.shed),
+                "sample_fps": q.sample_fps,
+                "mean_wait_s": q.wait_s / (q.processed + q.failed) if q.processed + q.failed else None,
+                "mean_service_s": q.service_s / (q.processed + q.failed) if q.processed + q.failed else None,
+            } for q in self.queues.values()}
+
+def throttle_source(source, pressure, base_fps, min_fps=0.05):
+    """Halves a video source's sample rate while its queue is full and wins it back as the queue drains."""
+    if getattr(source, "sample_fps", None) is None:
+        return
+    if pressure >= 1.0:
+        source.sample_fps = max(source.sample_fps / 2, min_fps)
+    elif pressure <= 0.25 and source.sample_fps < base_fps:
+        source.sample_fps = min(source.sample_fps * 1.25, base_fps)
+
+def produce(scheduler, machine_id, source, alarm_region=None):
+    """Feeds a machine's keyframes into its queue, and frames with a new alarm bar into the priority lane.
+
+    The alarm check runs on every frame, so a new alarm goes through even when
+    the rest of the screen barely changed. Queue pressure slows the source down.
+    """
+    keyframes = KeyframeSelector()
+    alarms = AlarmBarDetector(alarm_region)
+    base_fps = getattr(source, "sample_fps", None)
+    for frame in source:
+        alarm = alarms.check(frame)
+        keyframe = keyframes.check(frame)
+        if alarm == "new":
+            scheduler.put(machine_id, frame, urgent=True, key=(machine_id, keyframes.page))
+        elif keyframe is not None:
+            # The page number, not frame.source: a directory source names every frame differently.
+            scheduler.put(machine_id, frame, key=(machine_id, keyframes.page))
+        throttle_source(source, scheduler.pressure(machine_id), base_fps)
+        scheduler.queues[machine_id].sample_fps = getattr(source, "sample_fps", None)
+
+def work(scheduler, process):
+    """Processes queued frames forever; process(frame) reads and stores one frame."""
+    while True:
+        machine_id, frame, started, urgent = scheduler.get()
+        ok = True
+        try:
+            mark_frame_captured(frame.captured_at)
+            process(frame)
+            scheduler.latency["alarm" if urgent else "routine"].record(time.time() - frame.captured_at)
+        except Exception as e:
+            print(f"Processing frame {frame.index} of {machine_id} failed: {e}")
+            ok = False
+        scheduler.done(machine_id, started, ok)
+
+def start_fleet(machines, process_factory, slots=2):
+    """Starts one producer per machine and slots workers. Returns the scheduler.
+
+    machines is a list of dicts with machine_id, source and optionally weight,
+    queue_size, queue_policy, max_age_s, sample_fps and alarm_region.
+    process_factory() builds a frame processor per worker.
+    """
+    scheduler = FairScheduler()
+    for machine in machines:
+        scheduler.add_machine(machine["machine_id"], machine.get("weight", 1.0), machine.get("queue_size", 8),
+                              machine.get("queue_policy", "latest"), machine.get("max_age_s"))
+    for machine in machines:
+        source = source_from_uri(machine["source"], machine.get("sample_fps", 1.0), follow=True,
+                                 machine_id=machine["machine_id"])
+        threading.Thread(target=produce, args=(scheduler, machine["machine_id"], source, machine.get("alarm_region")),
+                         name=f"frames-{machine['machine_id']}", daemon=True).start()
+    for index in range(slots):
+        threading.Thread(target=work, args=(scheduler, process_factory()), name=f"llm-slot-{index}",
+                         daemon=True).start()
+    return scheduler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Read the screens of several machines with fair LLM sharing.")
+    parser.add_argument("config", help='JSON file: {"machines": [{"machine_id", "source", "weight", "queue_size", "queue_policy", "max_age_s"}]}')
+    parser.add_argument("--slots", type=int, default=2, help="Concurrent LLM calls")
+    parser.add_argument("--stats-interval", type=float, default=60, help="Seconds between stats printouts")
+    parser.add_argument("--metrics-port", type=int, help="Serve per-stage latency histograms on this port")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    profiler = profiler_from_args(args)
+
+    import main
+    with open(args.config) as f:
+        config = json.load(f)
+    ensure_schema()
+    main.register_listeners()
+
+    def process_factory():
+        llm = main.create_llm()
+        def process(frame):
+            with profiler.frame(f"{frame.machine_id} frame {frame.index}"):
+                main.process_image(frame.image, llm, frame.machine_id)
+        return process
+
+    profiler.start()
+    fleet = start_fleet(config["machines"], process_factory, config.get("slots", args.slots))
+    while True:
+        time.sleep(args.stats_interval)
+        profiler.write()
+        print(json.dumps(fleet.stats(), indent=2))
+        print(json.dumps({lane: stats.report() for lane, stats in fleet.latency.items()}, indent=2))
@@ -1,16 +1,16 @@
 import os
 from dotenv import load_dotenv
 import json
-import json_repair
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
 from datetime import datetime
-from PIL import Image
-import base64
-import io
-import mysql.connector
 from typing import Optional, List
+from database.db_operations import insert_reading
+from database.db_setup import DEFAULT_MACHINE_ID
+from database.migrations import ensure_schema
+from processors.common import image_sha256, encode_image, parse_json, validate_items
+from metrics import span, label_stages, invoke_llm
 
 # Load environment variables
 load_dotenv()
@@ -19,48 +19,7 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("GOOGLE_API_KEY is not set in the environment variables.")
 
-def parse_json(text):
-    try:
-        return json_repair.loads(text)
-    except Exception:
-        return None
-
-def initialize_database():
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password= "#ahlawy#bod@74#"
-    )
-    with conn.cursor() as c:
-        c.execute("CREATE DATABASE IF NOT EXISTS control_panel_db")
-        c.execute("USE control_panel_db")
-        c.execute("DROP TABLE IF EXISTS control_panel10")
-        c.execute('''CREATE TABLE IF NOT EXISTS control_panel10 (
-            id INT PRIMARY KEY AUTO_INCREMENT,
-            CurrentDateTime TEXT,
-            Run_status TEXT,
-            Run_value REAL,
-            P_per_10cm REAL,
-            Speed_m_min REAL,
-            Shift REAL,
-            Efficiency_percent REAL,
-            Total_m2 REAL,
-            Total_m REAL,
-            Value_300 REAL,
-            Value_150_g_1 REAL,
-            Value_150_g_2 REAL,
-            Value_432_4 REAL,
-            Value_118_kg REAL
-        )''')
-    conn.commit()
-    return conn
-
-def insert_data(conn, data):
-    with conn.cursor() as c:
-        c.execute('''INSERT INTO control_panel10 (CurrentDateTime, Run_status, Run_value, P_per_10cm, Speed_m_min, Shift, Efficiency_percent, Total_m2, Total_m, Value_300, Value_150_g_1, Value_150_g_2, Value_432_4, Value_118_kg)
-                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                  (data.CurrentDateTime, data.Run_status, data.Run_value, data.P_per_10cm, data.Speed_m_min, data.Shift, data.Efficiency_percent, data.Total_m2, data.Total_m, data.Value_300, data.Value_150_g_1, data.Value_150_g_2, data.Value_432_4, data.Value_118_kg))
-    conn.commit()
+PROCESSOR_VERSION = "1"
 
 prompt = """Analyze the provided control panel image from a BSW intelliCon machine. Extract the following specific fields:
 
@@ -101,17 +60,15 @@ class ControlPanelData(BaseModel):
 class Items(BaseModel):
     items: List[ControlPanelData] = Field(..., min_items=1, description="List of control panel data entries")
 
-def generate(image_path):
-    conn = initialize_database()
+def generate(image_path, machine_id=DEFAULT_MACHINE_ID):
     llm = ChatGoogleGenerativeAI(
         model="gemini-1.5-flash",
         google_api_key=GOOGLE_API_KEY,
     )
+    label_stages("image10", llm)
 
-    with Image.open(image_path) as img:
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    img_base64 = encode_image(image_path)
+    image_hash = image_sha256(image_path)
 
     system_message = SystemMessage(content="""You are a helpful assistant specialized in extracting structured data from images of industrial control panels. 
 The user will provide an image of a control panel. Your task is to extract all visible data points as specified in the Pydantic schema. Return the extracted information in strict JSON format under a key called 'items'. Do not include any explanations or comments.""")
@@ -125,34 +82,36 @@ The user will provide an image of a control panel. Your task is to extract all v
     ]))
 
     try:
-        response = llm.invoke([
+        response = invoke_llm(llm, [
             system_message,
             user_message,
             HumanMessage(content=[
                 {"type": "image_url", "image_url": f"data:image/png;base64,{img_base64}"}
             ])
-        ])
+        ], machine_id, image_hash)
     except Exception as e:
         print(f"Error calling LLM: {e}")
-        conn.close()
         return None
 
-    json_response = parse_json(response.content)
+    with span("parse"):
+        json_response = parse_json(response.content)
 
     if json_response and 'items' in json_response:
-        for item in json_response['items']:
-            data = ControlPanelData(**item)
-            insert_data(conn, data)
+        with span("validate"):
+            readings = validate_items(ControlPanelData, json_response['items'])
+        for index, data in readings:
+            insert_reading("control_panel10", data, machine_id, source_image_hash=image_hash,
+                           processor_version=PROCESSOR_VERSION, item_index=index)
         print("\nExtracted Control Panel Data (JSON):")
         print(json.dumps(json_response, indent=4, ensure_ascii=False))
     else:
         print("Failed to extract data or 'items' key not found in response.")
         print(f"Raw model response: {response.content}")
 
-    conn.close()
     return json_response
 
 if __name__ == "__main__":
     image_path = r"images/10.jpg"
     print(f"Running data capture at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    ensure_schema()
     generate(image_path)
@@ -1,11 +1,10 @@
+import argparse
 import os
+import time
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_ollama import ChatOllama
 from langchain.schema.messages import SystemMessage, HumanMessage
-from PIL import Image
-import base64
-import io
 import json
 
 from processors.image1 import generate as generate_main_control_panel
@@ -15,14 +14,23 @@ from processors.imag3 import generate as generate_godet_and_extruder_data
 
 from processors.imag6 import generate as machine_3d
 from processors.extruder_details_processor import generate as generate_extruder_details
+from database.migrations import ensure_schema
+from database.db_setup import DEFAULT_MACHINE_ID
+from database.db_operations import register_reading_listener
+from analytics.anomaly import AnomalyDetector
+from analytics.kpi import KPIEngine
+from analytics.deviation import DeviationTracker, sinks_from_env
+from processors.common import mark_frame_captured, encode_image, image_sha256
+from capture.sources import IMAGE_EXTENSIONS, source_from_uri
+from capture.keyframes import KeyframeSelector
+from metrics import label_stages, invoke_llm, span, frame_timer, serve_metrics, register_usage_listener
+from database.usage import record_llm_usage
+from profiling import add_profiling_arguments, profiler_from_args
 load_dotenv()
 
-def get_image_type(image_path , llm):
+def get_image_type(image_path , llm, machine_id=DEFAULT_MACHINE_ID):
 
-    with Image.open(image_path) as img:
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    img_base64 = encode_image(image_path)
 
 
     system_message_content = """
@@ -136,40 +144,104 @@ def get_image_type(image_path , llm):
         }
     ])
 
-    response = llm.invoke([system_message, user_prompt])
+    label_stages("classifier", llm)
+    with span("classify"):
+        response = invoke_llm(llm, [system_message, user_prompt], machine_id, image_sha256(image_path))
     try:
         return int(response.content.strip())
     except (ValueError, TypeError):
         print("Error: The model did not return a valid number.")
 
-def main():
-    """Main function to run the program."""
-    image_path = 'images/1.jpg'
-    llm = ChatOllama(
-    model="qwen3:4b",
-    reasoning= False
-    # temperature=0.2
-)
+def register_listeners():
+    """Hooks the online analytics into every stored reading and stores the usage of every model call.
 
-    image_type = get_image_type(image_path, llm)
+    Returns the anomaly detector and deviation tracker.
+    """
+    detector = AnomalyDetector()
+    register_reading_listener(detector.observe_row)
+    register_reading_listener(KPIEngine().observe_row)
+    deviations = DeviationTracker(sinks_from_env(), latency_budget=float(os.getenv("ALERT_LATENCY_BUDGET_S", "5.0")))
+    register_reading_listener(deviations.observe_row)
+    register_usage_listener(record_llm_usage)
+    return detector, deviations
+
+def process_image(image_path, llm, machine_id=DEFAULT_MACHINE_ID):
+    """Classifies one screen image (a path or PIL image) and runs the matching processor on it."""
+    label = image_path if isinstance(image_path, str) else f"{machine_id} frame"
+    with frame_timer(label):
+        _process_image(image_path, llm, machine_id)
+
+def _process_image(image_path, llm, machine_id):
+    image_type = get_image_type(image_path, llm, machine_id)
     print(f"Identified image type: {image_type}")
 
     if image_type == 1:
-        generate_main_control_panel(image_path,llm)
+        generate_main_control_panel(image_path, llm, machine_id)
     elif image_type == 2:
-        generate_temperature_and_motor_data(image_path,llm)
+        generate_temperature_and_motor_data(image_path, llm, machine_id)
     elif image_type == 3:
-        generate_extrusion_line_overview(image_path,llm)
+        generate_extrusion_line_overview(image_path, llm, machine_id)
     elif image_type == 4:
-        generate_godet_and_extruder_data(image_path, llm)
+        generate_godet_and_extruder_data(image_path, llm, machine_id)
     elif image_type == 5:
-        machine_3d(image_path,llm)
+        machine_3d(image_path, llm, machine_id)
     elif image_type == 6:
-        generate_extruder_details(image_path, llm)
+        generate_extruder_details(image_path, llm, machine_id)
     elif image_type == 'null':
         print("No valid image type identified.")
     else:
         print("Invalid image type.")
 
+def create_llm():
+    return ChatOllama(
+    model="qwen3:4b",
+    reasoning= False
+    # temperature=0.2
+)
+
+def main():
+    """Main function to run the program."""
+    run_started = time.time()
+    parser = argparse.ArgumentParser(description="Read HMI screens into the database.")
+    parser.add_argument("source", nargs="?", default="images/1.jpg",
+                        help="An image, a directory of frames, a video file or an rtsp:// URL")
+    parser.add_argument("--machine", default=DEFAULT_MACHINE_ID, help="Machine the screens belong to")
+    parser.add_argument("--follow", action="store_true", help="Keep watching a directory for new frames")
+    parser.add_argument("--sample-fps", type=float, default=1.0, help="Frames per second sampled from video")
+    parser.add_argument("--change-threshold", type=float, default=0.01,
+                        help="Mean pixel difference (0-1) that makes a new keyframe")
+    parser.add_argument("--metrics-port", type=int, help="Serve per-stage latency histograms on this port")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    profiler = profiler_from_args(args)
+
+    ensure_schema()
+    _, deviations = register_listeners()
+    llm = create_llm()
+
+    profiler.start()
+    try:
+        if args.source.lower().endswith(IMAGE_EXTENSIONS):
+            # A file's mtime isn't when the screen was captured; latency counts from the start of this run.
+            mark_frame_captured(run_started)
+            with profiler.frame(args.source):
+                process_image(args.source, llm, args.machine)
+        else:
+            keyframes = KeyframeSelector(change_threshold=args.change_threshold)
+            source = source_from_uri(args.source, args.sample_fps, args.follow, args.machine)
+            for frame, reason in keyframes.select(source):
+                print(f"Keyframe {frame.index} from {frame.source} ({reason})")
+                mark_frame_captured(frame.captured_at)
+                with profiler.frame(f"{frame.source}#{frame.index}"):
+                    process_image(frame.image, llm, frame.machine_id)
+            print(f"Processed {keyframes.selected} keyframes out of {keyframes.seen} frames.")
+    finally:
+        profiler.stop()
+    if deviations.latency.samples:
+        print(f"Capture-to-alert latency: {deviations.latency.report()}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
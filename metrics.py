@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets, from a PNG encode to a slow model call.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for position, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[position] += 1
+
+_histograms = {}
+_lock = threading.Lock()
+_context = threading.local()
+_span_listeners = []
+_usage_listeners = []
+_tokens = {}
+# Thread id -> stages being timed on that thread, outermost first, for samplers looking in from other threads.
+_active_stages = {}
+
+def register_span_listener(listener):
+    """Calls listener(stage, processor, model, seconds, cpu_seconds, peak_bytes) with every timing.
+
+    cpu_seconds and peak_bytes are None for timings that aren't spans; peak_bytes
+    is only measured while tracemalloc is tracing.
+    """
+    _span_listeners.append(listener)
+
+def register_usage_listener(listener):
+    """Calls listener(usage) after every model call made through invoke_llm.
+
+    usage is a dict with processor, model, machine_id, source_image_hash,
+    called_at, input_tokens, output_tokens, image_tokens, total_tokens, wall_s
+    and first_token_s. Token counts are None when the model reports no usage.
+    """
+    _usage_listeners.append(listener)
+
+def model_name(llm):
+    """Returns the model a LangChain chat model talks to, or "" when it can't tell."""
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or ""
+
+def label_stages(processor, llm=None):
+    """Tags the spans that follow on this thread with the processor and model doing the work."""
+    _context.processor = processor
+    _context.model = model_name(llm) if llm is not None else ""
+
+def current_processor():
+    return getattr(_context, "processor", "")
+
+def active_stages(thread_id):
+    """Returns the stages a thread is inside right now, outermost first."""
+    return tuple(_active_stages.get(thread_id, ()))
+
+def observe(stage, seconds, processor=None, model=None, cpu_seconds=None, peak_bytes=None):
+    """Adds one timing to the stage histogram, this thread's frame breakdown and the span listeners."""
+    processor = getattr(_context, "processor", "") if processor is None else processor
+    model = getattr(_context, "model", "") if model is None else model
+    with _lock:
+        histogram = _histograms.get((stage, processor, model))
+        if histogram is None:
+            histogram = _histograms[(stage, processor, model)] = Histogram()
+        histogram.observe(seconds)
+    stages = getattr(_context, "stages", None)
+    if stages is not None:
+        stages.append({"stage": stage, "processor": processor, "model": model, "seconds": round(seconds, 4)})
+    for listener in _span_listeners:
+        try:
+            listener(stage, processor, model, seconds, cpu_seconds, peak_bytes)
+        except Exception as e:
+            print(f"Span listener failed: {e}")
+
+@contextmanager
+def span(stage, processor=None, model=None):
+    """Times the enclosed block as stage; failures are timed too.
+
+    Also measures the thread's CPU time and, while tracemalloc is tracing, the
+    peak of traced memory above what was allocated when the block started.
+    Nested spans hand their peak up to the enclosing one.
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        stack = _context.__dict__.setdefault("memory", [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        stack.append({"start": current, "peak": current})
+    active = _active_stages.setdefault(threading.get_ident(), [])
+    active.append(stage)
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        cpu_seconds = time.thread_time() - cpu_started
+        active.pop()
+        peak_bytes = None
+        if tracing:
+            own = stack.pop()
+            own["peak"] = max(own["peak"], tracemalloc.get_traced_memory()[1])
+            peak_bytes = own["peak"] - own["start"]
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], own["peak"])
+        observe(stage, seconds, processor, model, cpu_seconds, peak_bytes)
+
+def invoke_llm(llm, messages, machine_id=None, image_hash=None):
+    """Calls the model like llm.invoke(messages), streaming to time the first token.
+
+    Records llm_first_token (time to the first chunk) and llm (whole reply),
+    counts the tokens the reply reports and hands the call's usage, tagged with
+    the machine and source image, to the usage listeners.
+    """
+    called_at = time.time()
+    started = time.perf_counter()
+    response = None
+    first_token_s = None
+    with span("llm"):
+        for chunk in llm.stream(messages):
+            if response is None:
+                first_token_s = time.perf_counter() - started
+                observe("llm_first_token", first_token_s)
+                response = chunk
+            else:
+                response = response + chunk
+    wall_s = time.perf_counter() - started
+    if response is None:
+        raise ValueError("The model returned an empty stream.")
+    _record_usage(response, called_at, wall_s, first_token_s, machine_id, image_hash)
+    return response
+
+def _record_usage(response, called_at, wall_s, first_token_s, machine_id, image_hash):
+    reported = getattr(response, "usage_metadata", None) or {}
+    usage = {
+        "processor": getattr(_context, "processor", ""),
+        "model": getattr(_context, "model", ""),
+        "machine_id": machine_id,
+        "source_image_hash": image_hash,
+        "called_at": called_at,
+        "input_tokens": reported.get("input_tokens"),
+        "output_tokens": reported.get("output_tokens"),
+        "image_tokens": (reported.get("input_token_details") or {}).get("image"),
+        "total_tokens": reported.get("total_tokens"),
+        "wall_s": wall_s,
+        "first_token_s": first_token_s,
+    }
+    with _lock:
+        for kind in ("input", "output", "image"):
+            if usage[f"{kind}_tokens"]:
+                key = (usage["processor"], usage["model"], machine_id or "", kind)
+                _tokens[key] = _tokens.get(key, 0) + usage[f"{kind}_tokens"]
+    for listener in _usage_listeners:
+        try:
+            listener(usage)
+        except Exception as e:
+            print(f"Usage listener failed: {e}")
+
+class SlowFrameLog:
+    """Writes the stage breakdown of frames slower than threshold seconds as JSON lines (stdout without a path)."""
+
+    def __init__(self, threshold=30.0, path=None):
+        self.threshold = threshold
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds, stages):
+        if seconds < self.threshold:
+            return
+        line = json.dumps({"frame": label, "seconds": round(seconds, 3), "at": time.time(), "stages": stages},
+                          ensure_ascii=False)
+        if self.path is None:
+            print(f"Slow frame: {line}")
+            return
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+slow_frames = SlowFrameLog(float(os.getenv("SLOW_FRAME_S", "30")), os.getenv("SLOW_FRAME_LOG"))
+
+@contextmanager
+def frame_timer(label):
+    """Collects the spans of one frame on this thread and logs the breakdown if the frame was slow."""
+    _context.stages = []
+    started = time.perf_counter()
+    try:
+        with span("frame", "", ""):
+            yield
+    finally:
+        seconds = time.perf_counter() - started
+        stages, _context.stages = _context.stages, None
+        slow_frames.record(str(label), seconds, stages[:-1])
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render():
+    """Returns every stage histogram in the Prometheus text exposition format."""
+    lines = ["# HELP woven_stage_seconds Time spent per pipeline stage.",
+             "# TYPE woven_stage_seconds histogram"]
+    with _lock:
+        for (stage, processor, model), histogram in sorted(_histograms.items()):
+            labels = f'stage="{_escape(stage)}",processor="{_escape(processor)}",model="{_escape(model)}"'
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'woven_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'woven_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"woven_stage_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"woven_stage_seconds_count{{{labels}}} {histogram.count}")
+        lines += ["# HELP woven_llm_tokens_total Tokens reported by model replies.",
+                  "# TYPE woven_llm_tokens_total counter"]
+        for (processor, model, machine_id, kind), count in sorted(_tokens.items()):
+            lines.append(f'woven_llm_tokens_total{{processor="{_escape(processor)}",model="{_escape(model)}",'
+                         f'machine_id="{_escape(machine_id)}",kind="{kind}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port=9108, host="127.0.0.1"):
+    """Serves /metrics for Prometheus from a background thread. Returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
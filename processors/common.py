@@ -0,0 +1,103 @@
+import base64
+import hashlib
+import io
+import threading
+import time
+from typing import List
+import json_repair
+import orjson
+from PIL import Image
+from pydantic import TypeAdapter, ValidationError
+from metrics import span
+from processors.normalize import normalize_item
+
+# Every processor module stores its PROCESSOR_VERSION with each reading, next to the frame hash. Bump a
+# module's version when its prompt or model changes, so re-extractions are stored next to the old readings.
+
+def image_sha256(image):
+    """Returns the hex SHA-256 identifying the frame a reading came from.
+
+    image is a file path (the file's bytes are hashed) or an in-memory PIL
+    image (its size, mode and pixels are hashed).
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, Image.Image):
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+    with open(image, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def encode_image(image):
+    """Returns a file path or PIL image as base64 PNG, ready for a data: URL."""
+    if isinstance(image, Image.Image):
+        return _png_base64(image)
+    with Image.open(image) as img:
+        with span("decode"):
+            img.load()
+        return _png_base64(img)
+
+def _png_base64(image):
+    with span("encode"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+def parse_json(text):
+    """Parses a model reply, strictly with orjson first and with json_repair only when that fails.
+
+    A reply wrapped in a ```json fence is unwrapped before the strict parse.
+    Returns None when not even json_repair can make sense of it.
+    """
+    stripped = text.strip()
+    if stripped.startswith("```") and stripped.endswith("```") and len(stripped) > 6:
+        stripped = stripped[3:-3].removeprefix("json")
+    try:
+        return orjson.loads(stripped)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return json_repair.loads(text)
+    except Exception:
+        return None
+
+_adapters = {}
+
+def validate_items(model, items):
+    """Normalizes and validates a reply's items as model in one pass. Returns [(item index, model instance)].
+
+    When some items fail, those are reported and left out and the rest are
+    still returned, so one bad item doesn't cost the others.
+    """
+    if isinstance(items, list):
+        items = [normalize_item(model, item) for item in items]
+    adapter = _adapters.get(model)
+    if adapter is None:
+        adapter = _adapters[model] = TypeAdapter(List[model])
+    try:
+        return list(enumerate(adapter.validate_python(items)))
+    except ValidationError as e:
+        if not isinstance(items, list):
+            print(f"Invalid items, expected a list: {e}")
+            return []
+        errors = e.errors()
+    failed = {}
+    for error in errors:
+        failed.setdefault(error["loc"][0], []).append(error)
+    for index, item_errors in sorted(failed.items()):
+        print(f"Skipping item {index}: " + "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'][1:]) or 'item'}: {error['msg']}" for error in item_errors))
+    good = [index for index in range(len(items)) if index not in failed]
+    return list(zip(good, adapter.validate_python([items[index] for index in good])))
+
+_frame = threading.local()
+
+def mark_frame_captured(at=None):
+    """Records when the frame being processed on this thread was captured (epoch seconds, default now)."""
+    _frame.captured_at = time.time() if at is None else at
+
+def frame_captured_at():
+    """Returns the capture time recorded by mark_frame_captured on this thread, or None."""
+    return getattr(_frame, "captured_at", None)
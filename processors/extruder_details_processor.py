@@ -1,19 +1,14 @@
 import json
-import json_repair
 from langchain.schema.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
 from datetime import datetime
-from PIL import Image
-import base64
-import io
 from typing import Optional, List
-from database.db_operations import insert_control_panel5_data
+from database.db_operations import insert_control_panel6_data
+from database.db_setup import DEFAULT_MACHINE_ID
+from processors.common import image_sha256, encode_image, parse_json, validate_items
+from metrics import span, label_stages, invoke_llm
 
-def parse_json(text):
-    try:
-        return json_repair.loads(text)
-    except Exception:
-        return None
+PROCESSOR_VERSION = "1"
 
 
 prompt = """Analyze the provided control panel image from a BSW MACHINERY tiraTex 1600 tape extrusion line. The image shows the 'Extruder' screen. Extract the following specific fields:
@@ -57,12 +52,11 @@ class ControlPanelData(BaseModel):
 class Items(BaseModel):
     items: List[ControlPanelData] = Field(..., min_items=1, description="List of control panel data entries")
 
-def generate(image_path, llm):
+def generate(image_path, llm, machine_id=DEFAULT_MACHINE_ID):
+    label_stages("extruder_details_processor", llm)
     
-    with Image.open(image_path) as img:
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    img_base64 = encode_image(image_path)
+    image_hash = image_sha256(image_path)
 
     system_message = SystemMessage(content="""You are a helpful assistant specialized in extracting structured data from images of industrial control panels, specifically the BSW MACHINERY tiraTex 1600. 
 The user will provide an image of a control panel. Your task is to extract all visible data points as specified in the Pydantic schema. Crucially, you must also identify any alarm messages , based on the tiraTex 1600 operating manual. Return the extracted information in strict JSON format under a key called 'items'. Do not include any explanations or comments.""")
@@ -76,24 +70,27 @@ The user will provide an image of a control panel. Your task is to extract all v
     ]))
 
     try:
-        response = llm.invoke([
+        response = invoke_llm(llm, [
             system_message,
             user_message,
             HumanMessage(content=[
                 {"type": "image_url", "image_url": f"data:image/png;base64,{img_base64}"}
             ])
-        ])
+        ], machine_id, image_hash)
     except Exception as e:
         print(f"Error calling LLM: {e}")
 
         return None
 
-    json_response = parse_json(response.content)
+    with span("parse"):
+        json_response = parse_json(response.content)
 
     if json_response and 'items' in json_response:
-        for item in json_response['items']:
-            data = ControlPanelData(**item)
-            insert_control_panel5_data( data)
+        with span("validate"):
+            readings = validate_items(ControlPanelData, json_response['items'])
+        for index, data in readings:
+            insert_control_panel6_data(data, machine_id, source_image_hash=image_hash, processor_version=PROCESSOR_VERSION,
+                                       item_index=index)
         print("\nExtracted Control Panel Data (JSON):")
         print(json.dumps(json_response, indent=4, ensure_ascii=False))
     else:
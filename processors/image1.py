@@ -1,21 +1,14 @@
 import json
-import json_repair
 from langchain.schema.messages import SystemMessage, HumanMessage
 from pydantic import BaseModel, Field
 from datetime import datetime
-from PIL import Image
-import base64
-import io
 from typing import Optional, List
 from database.db_operations import insert_control_panel1_data
+from database.db_setup import DEFAULT_MACHINE_ID
+from processors.common import image_sha256, encode_image, parse_json, validate_items
+from metrics import span, label_stages, invoke_llm
 
-
-
-def parse_json(text):
-    try:
-        return json_repair.loads(text)
-    except Exception:
-        return None
+PROCESSOR_VERSION = "1"
 
 
 prompt = """Analyze the provided control panel image from a machine used in woven bag manufacturing. Extract the following specific fields:
@@ -75,12 +68,11 @@ class ControlPanelData(BaseModel):
 class Items(BaseModel):
     items: List[ControlPanelData] = Field(..., min_items=1, description="List of control panel data entries")
 
-def generate(image_path, llm):
+def generate(image_path, llm, machine_id=DEFAULT_MACHINE_ID):
+    label_stages("image1", llm)
     
-    with Image.open(image_path) as img:
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    img_base64 = encode_image(image_path)
+    image_hash = image_sha256(image_path)
 
     system_message = SystemMessage(content="""You are a helpful assistant specialized in extracting structured data from images of industrial control panels.
 The user will provide an image of a control panel.
@@ -110,18 +102,21 @@ Do not include any explanations, comments, or additional text outside the JSON o
     ])
 
     try:
-        response = llm.invoke([system_message, user_prompt])
+        response = invoke_llm(llm, [system_message, user_prompt], machine_id, image_hash)
     except Exception as e:
         print(f"Error calling LLM: {e}")
 
         return None
 
-    json_response = parse_json(response.content)
+    with span("parse"):
+        json_response = parse_json(response.content)
 
     if json_response and 'items' in json_response:
-        for item in json_response['items']:
-            data = ControlPanelData(**item)
-            insert_control_panel1_data(data)
+        with span("validate"):
+            readings = validate_items(ControlPanelData, json_response['items'])
+        for index, data in readings:
+            insert_control_panel1_data(data, machine_id, source_image_hash=image_hash, processor_version=PROCESSOR_VERSION,
+                                       item_index=index)
         print("\nExtracted Control Panel Data (JSON):")
         print(json.dumps(json_response, indent=4, ensure_ascii=False))
     else:
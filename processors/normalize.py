@@ -0,0 +1,150 @@
+import re
+from typing import Union, get_args, get_origin
+from database.timestamps import parse_screen_datetime
+
+# Spellings of indicator states that are stored as "ON" / "OFF".
+ON_VALUES = {"on", "an", "ein", "1", "true", "yes", "active", "running"}
+OFF_VALUES = {"off", "aus", "0", "false", "no", "inactive", "stopped"}
+
+# What a model writes for a field with nothing on the screen; stored as null.
+EMPTY_VALUES = {"", "-", "--", "---", "n/a", "na", "none", "null"}
+
+# A number with thousands or decimal separators and an optional unit: "1.234,5 kg", "1 500 rpm", "183 °C", "45%", "722 1/min".
+_NUMBER = re.compile(r"^([+-]?(?:\d{1,3}(?:[ ']\d{3})+|\d+)(?:[.,]\d+)*)\s*(?:[^\d\s.,+-][^\d]*|1/\D+)?$")
+_HOURS = re.compile(r"^(\d(?:[\d.,' ]*\d)?)\s*(?::|h|hrs?|std)\s*(\d{1,2})\s*(?:m|min)?$", re.IGNORECASE)
+_HOURS_UNIT = re.compile(r"\s*(?:h|hrs?|hours|std)\.?$", re.IGNORECASE)
+
+def parse_number(text, integer=False):
+    """Reads a number off a screen value such as "183 °C", "1.234,5" or "45 %". Returns None if it isn't one.
+
+    With both separators the last one is the decimal point; a lone "," or "."
+    is a decimal point and a repeated one separates thousands. For an integer
+    field a lone separator before three digits, as in "3.372", separates
+    thousands too.
+    """
+    match = _NUMBER.match(text.strip())
+    if not match:
+        return None
+    digits = match.group(1).replace(" ", "").replace("'", "")
+    if "," in digits and "." in digits:
+        decimal = "," if digits.rfind(",") > digits.rfind(".") else "."
+    elif digits.count(",") == 1:
+        decimal = ","
+    elif digits.count(".") == 1:
+        decimal = "."
+    else:
+        decimal = None
+    if integer and decimal and digits.count(decimal) == 1 and len(digits) - digits.index(decimal) == 4:
+        decimal = None
+    if decimal is None:
+        digits = digits.replace(",", "").replace(".", "")
+    else:
+        digits = digits.replace("." if decimal == "," else ",", "").replace(decimal, ".")
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+def normalize_number(value, integer=False):
+    if isinstance(value, str):
+        if value.strip().lower() in EMPTY_VALUES:
+            return None
+        number = parse_number(value, integer)
+        if number is None:
+            return value
+        value = number
+    if integer and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def normalize_status(value):
+    if isinstance(value, bool):
+        return "ON" if value else "OFF"
+    text = str(value).strip().lower() if value is not None else ""
+    if text in ON_VALUES:
+        return "ON"
+    if text in OFF_VALUES:
+        return "OFF"
+    return None if text in EMPTY_VALUES else value
+
+def normalize_hours(value):
+    """Writes an hour counter as "H:MM": "1644:58 Hrs", "1644h 58min", "1.644:58" and 1644.5 all become so."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        hours = float(value)
+    elif isinstance(value, str):
+        text = _HOURS_UNIT.sub("", value.strip())
+        if text.lower() in EMPTY_VALUES:
+            return None
+        match = _HOURS.match(text)
+        if match:
+            hours = re.sub(r"[.,' ]", "", match.group(1))
+            return f"{int(hours)}:{int(match.group(2)):02d}"
+        hours = parse_number(text)
+        if hours is None:
+            return value
+    else:
+        return value
+    minutes = round(hours * 60)
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+def normalize_datetime(value):
+    """Rewrites a screen clock reading as "YYYY-MM-DD HH:MM:SS", leaving formats it doesn't know alone."""
+    parsed = parse_screen_datetime(value) if isinstance(value, str) else None
+    return parsed.strftime("%Y-%m-%d %H:%M:%S") if parsed else value
+
+def _list(value, element):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        if isinstance(value, str) and value.strip().lower() in EMPTY_VALUES:
+            return []
+        value = [value]
+    if element is str:
+        return [item if isinstance(item, str) else str(item) for item in value if item is not None]
+    return [normalize_number(item, element is int) for item in value]
+
+def _field_kind(name, annotation):
+    if get_origin(annotation) is Union:
+        types = [arg for arg in get_args(annotation) if arg is not type(None)]
+        annotation = types[0] if len(types) == 1 else None
+    if get_origin(annotation) is list:
+        return "list", get_args(annotation)[0]
+    if name == "CurrentDateTime":
+        return "datetime", None
+    if annotation is str and name.endswith("_status"):
+        return "status", None
+    if annotation is str and name.endswith("_Hrs"):
+        return "hours", None
+    if annotation in (int, float):
+        return "number", annotation
+    return None, None
+
+_kinds = {}
+
+def normalize_item(model, item):
+    """Cleans the formatting noise out of one reply item before it is validated as model.
+
+    Numeric fields lose units and locale separators, "_status" fields become
+    ON/OFF, "_Hrs" counters H:MM, CurrentDateTime ISO, and list fields a list.
+    Values it can't make sense of are passed through for validation to reject.
+    """
+    if not isinstance(item, dict):
+        return item
+    kinds = _kinds.get(model)
+    if kinds is None:
+        kinds = _kinds[model] = {name: _field_kind(name, field.annotation)
+                                 for name, field in model.model_fields.items()}
+    normalized = dict(item)
+    for name, value in item.items():
+        kind, detail = kinds.get(name, (None, None))
+        if kind == "number":
+            normalized[name] = normalize_number(value, detail is int)
+        elif kind == "status":
+            normalized[name] = normalize_status(value)
+        elif kind == "hours":
+            normalized[name] = normalize_hours(value)
+        elif kind == "datetime":
+            normalized[name] = normalize_datetime(value)
+        elif kind == "list":
+            normalized[name] = _list(value, detail)
+    return normalized
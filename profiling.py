@@ -0,0 +1,249 @@
+import json
+import linecache
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from metrics import active_stages, register_span_listener
+
+# Allocations made by the profiler itself and the import machinery, left out of the memory reports.
+_IGNORED_FILES = {tracemalloc.__file__, linecache.__file__, __file__, "<frozen importlib._bootstrap>",
+                  "<frozen importlib._bootstrap_external>", "<unknown>"}
+
+def rss_bytes():
+    """Resident set size of this process now, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def pillow_blocks():
+    """Pixel blocks Pillow holds for open images, memory that tracemalloc doesn't see, or None."""
+    try:
+        from PIL import Image
+        stats = Image.core.get_stats()
+    except (ImportError, AttributeError):
+        return None
+    return stats["allocated_blocks"] - stats["freed_blocks"] - stats["blocks_cached"]
+
+def _mib(size):
+    return f"{size / (1 << 20):+.2f} MiB" if size is not None else "n/a"
+
+_locations = {}
+
+def _location(code):
+    location = _locations.get(code)
+    if location is None:
+        path = code.co_filename
+        if path.startswith(os.getcwd() + os.sep):
+            path = os.path.relpath(path)
+        else:
+            path = os.sep.join(path.split(os.sep)[-2:])
+        location = _locations[code] = f"{path}:{code.co_name}"
+    return location
+
+def _top(snapshot, key_type, top):
+    """The top entries of snapshot by size, leaving out the profiler's own allocations."""
+    return [stat for stat in snapshot.statistics(key_type)
+            if stat.traceback[0].filename not in _IGNORED_FILES][:top]
+
+class SamplingProfiler:
+    """Samples the stacks of the pipeline threads every interval seconds from a background thread.
+
+    Samples are wall-clock, so a thread waiting on the model counts as much as one
+    encoding a PNG. Each stack is rooted at the metrics stages the thread was in,
+    e.g. "frame;image1;encode;...", and written in the collapsed format that
+    flamegraph.pl and speedscope read. The highest RSS seen is kept per stage as
+    well, which covers memory tracemalloc can't see, like Pillow's pixel buffers.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.stage_samples = Counter()
+        self.stage_rss = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stages = active_stages(thread_id) or ("-",)
+                calls = []
+                while frame is not None:
+                    calls.append(_location(frame.f_code))
+                    frame = frame.f_back
+                self.samples[";".join(stages + tuple(reversed(calls)))] += 1
+                self.stage_samples[stages[-1]] += 1
+                if rss is not None and rss > self.stage_rss.get(stages[-1], 0):
+                    self.stage_rss[stages[-1]] = rss
+
+    def write(self, directory):
+        with open(os.path.join(directory, "cpu.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        total = sum(self.stage_samples.values()) or 1
+        summary = {"interval_s": self.interval, "samples": sum(self.stage_samples.values()), "stages": {
+            stage: {"samples": count, "share": count / total, "max_rss_bytes": self.stage_rss.get(stage)}
+            for stage, count in self.stage_samples.most_common()}}
+        with open(os.path.join(directory, "cpu-stages.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+class MemoryTracer:
+    """Traces allocations with tracemalloc and reports what holds the memory of every Nth frame.
+
+    Traces are cleared when a traced frame starts, so a snapshot taken at the
+    end of each of its stages, while the stage's buffers (the PNG in memory,
+    the base64 string) are still referenced, holds just what the frame has
+    allocated and not yet freed. The report lists per stage the peak of traced
+    memory, the change in RSS and the pixel blocks Pillow holds, both covering
+    image memory outside tracemalloc's view, the lines holding the most memory and
+    the call chain of the largest block. It opens with what the N frames before
+    were still holding when this one started; a line that shows up there report
+    after report is a leak. Snapshots are slow, so traced frames take longer,
+    and with several workers the other threads' allocations show up as well.
+    """
+
+    def __init__(self, every, directory, top=10, frames=8):
+        self.every = every
+        self.directory = directory
+        self.top = top
+        self.frames = frames
+        self.count = 0
+        self.reports = 0
+        self._lock = threading.Lock()
+        self._traced = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        register_span_listener(self._stage_done)
+
+    def begin_frame(self, label):
+        with self._lock:
+            self.count += 1
+            if self.count % self.every or self._traced is not None:
+                return
+            self._traced = {"thread": threading.get_ident(), "label": str(label), "number": self.count,
+                            "rss": rss_bytes(), "stages": []}
+        held = _top(tracemalloc.take_snapshot(), "lineno", self.top)
+        held_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.clear_traces()
+        self._traced.update(held=held, held_bytes=held_bytes)
+
+    def _stage_done(self, stage, processor, model, seconds, cpu_seconds, peak_bytes):
+        traced = self._traced
+        if (traced is None or traced["thread"] != threading.get_ident() or "held" not in traced
+                or peak_bytes is None):
+            return
+        rss = rss_bytes()
+        snapshot = tracemalloc.take_snapshot()
+        traced["stages"].append({"stage": stage, "processor": processor, "seconds": seconds,
+                                 "peak_bytes": peak_bytes, "lines": _top(snapshot, "lineno", self.top),
+                                 "chain": _top(snapshot, "traceback", 1), "pillow_blocks": pillow_blocks(),
+                                 "rss_change": rss - traced["rss"] if rss is not None and traced["rss"] else None})
+        del snapshot
+        # The snapshot's own allocations would otherwise count towards the enclosing spans' peaks.
+        tracemalloc.reset_peak()
+
+    def end_frame(self):
+        traced = self._traced
+        if traced is None or traced["thread"] != threading.get_ident():
+            return
+        self._write(traced)
+        self._traced = None
+
+    def _write(self, traced):
+        self.reports += 1
+        path = os.path.join(self.directory, f"memory-frame-{traced['number']:06d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Frame {traced['number']}: {traced['label']}\n")
+            if traced["rss"]:
+                f.write(f"RSS at frame start {traced['rss'] / (1 << 20):.2f} MiB\n")
+            f.write(f"\nStill held from before this frame: {traced['held_bytes'] / (1 << 20):.2f} MiB\n")
+            for stat in traced["held"]:
+                f.write(f"  {stat}\n")
+            for stage in traced["stages"]:
+                name = f"{stage['processor']}/{stage['stage']}" if stage["processor"] else stage["stage"]
+                f.write(f"\n[{name}] {stage['seconds']:.3f}s, traced peak {_mib(stage['peak_bytes'])}, "
+                        f"RSS change since frame start {_mib(stage['rss_change'])}, "
+                        f"Pillow pixel blocks held {stage['pillow_blocks']}\n")
+                for stat in stage["lines"]:
+                    f.write(f"  {stat}\n")
+                for stat in stage["chain"]:
+                    f.write(f"  largest block ({stat.size / (1 << 20):.2f} MiB) allocated at:\n")
+                    for line in stat.traceback.format(most_recent_first=True):
+                        f.write(f"    {line}\n")
+
+class RunProfiler:
+    """The profiling switches of a pipeline run; without any switch on, every method does nothing.
+
+    cpu turns on the SamplingProfiler; memory_every > 0 traces every Nth frame
+    with a MemoryTracer. Reports go to directory.
+    """
+
+    def __init__(self, directory="profiles", cpu=False, interval=0.005, memory_every=0):
+        self.directory = directory
+        self.cpu = SamplingProfiler(interval) if cpu else None
+        self.memory = MemoryTracer(memory_every, directory) if memory_every > 0 else None
+
+    def start(self):
+        if self.cpu is None and self.memory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory is not None:
+            self.memory.start()
+        if self.cpu is not None:
+            self.cpu.start()
+
+    @contextmanager
+    def frame(self, label):
+        """Wraps the processing of one frame, so every Nth one is traced."""
+        if self.memory is None:
+            yield
+            return
+        self.memory.begin_frame(label)
+        try:
+            yield
+        finally:
+            self.memory.end_frame()
+
+    def write(self):
+        """Writes the CPU profile so far; memory reports are written as their frames finish."""
+        if self.cpu is not None:
+            self.cpu.write(self.directory)
+
+    def stop(self):
+        if self.cpu is not None:
+            self.cpu.stop()
+            self.write()
+            print(f"CPU profile written to {os.path.join(self.directory, 'cpu.collapsed')}")
+        if self.memory is not None:
+            print(f"Memory reports of {self.memory.reports} frames written to {self.directory}")
+
+def add_profiling_arguments(parser):
+    parser.add_argument("--profile-cpu", action="store_true",
+                        help="Sample the pipeline's stacks and write a collapsed profile per stage")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="Seconds between stack samples")
+    parser.add_argument("--trace-memory-every", type=int, default=0, metavar="N",
+                        help="Trace allocations and report what holds the memory of every Nth frame")
+    parser.add_argument("--profile-dir", default="profiles", help="Where profiles and memory reports are written")
+
+def profiler_from_args(args):
+    return RunProfiler(args.profile_dir, args.profile_cpu, args.profile_interval, args.trace_memory_every)
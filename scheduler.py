@@ -0,0 +1,201 @@
+import argparse
+import importlib
+import os
+import time
+from collections import deque
+import schedule
+from database.db_setup import DEFAULT_MACHINE_ID
+from database.db_operations import register_reading_listener
+from database.migrations import ensure_schema
+from processors.common import image_sha256, mark_frame_captured
+
+class CallBudget:
+    """Caps LLM calls over a sliding minute, shared by every capture target."""
+
+    def __init__(self, calls_per_minute):
+        self.calls_per_minute = calls_per_minute
+        self._calls = deque()
+
+    def _expire(self, now):
+        while self._calls and now - self._calls[0] >= 60:
+            self._calls.popleft()
+
+    def try_acquire(self, calls=1):
+        now = time.monotonic()
+        self._expire(now)
+        if len(self._calls) + calls > self.calls_per_minute:
+            return False
+        self._calls.extend([now] * calls)
+        return True
+
+    def wait_time(self, calls=1):
+        """Seconds until calls more would fit in the budget."""
+        now = time.monotonic()
+        self._expire(now)
+        excess = len(self._calls) + calls - self.calls_per_minute
+        if excess <= 0:
+            return 0.0
+        return 60 - (now - self._calls[excess - 1])
+
+class CaptureTarget:
+    """One camera looking at one screen, captured from the frame file it keeps updating.
+
+    process(image_path, machine_id) extracts and stores the readings; llm_calls
+    is how many model calls that costs.
+    """
+
+    def __init__(self, name, image_path, process, llm_calls=1, min_interval=10, max_interval=300,
+                 machine_id=DEFAULT_MACHINE_ID):
+        self.name = name
+        self.image_path = image_path
+        self.process = process
+        self.llm_calls = llm_calls
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.machine_id = machine_id
+        self.interval = min_interval
+        self.frame_hash = None
+        self.last_values = {}
+        self.last_alarms = {}
+        self.moving = False
+        self.captures = 0
+        self.skipped = 0
+
+class AdaptiveScheduler:
+    """Captures each target on its own cadence, faster while its process is moving.
+
+    A target whose frame hash is unchanged is not sent to the model and its
+    interval grows by backoff up to max_interval. Its interval drops back to
+    min_interval when a capture's readings drift by more than drift_threshold
+    (relative) from the previous ones, new alarms show up, or the anomaly
+    detector flags one of its readings. Every capture first takes its LLM calls
+    from a global CallBudget; without budget it is retried when calls free up.
+    """
+
+    def __init__(self, targets, calls_per_minute=30, drift_threshold=0.02, backoff=1.5):
+        self.targets = list(targets)
+        for target in self.targets:
+            if target.llm_calls > calls_per_minute:
+                raise ValueError(f"Target {target.name} needs {target.llm_calls} calls per capture, "
+                                 f"more than the budget of {calls_per_minute} per minute")
+        self.budget = CallBudget(calls_per_minute)
+        self.drift_threshold = drift_threshold
+        self.backoff = backoff
+        self._scheduler = schedule.Scheduler()
+        self._current = None
+
+    def observe_row(self, table, row, machine_id):
+        """Reading listener: compares readings of the target being captured with its previous ones."""
+        target = self._current
+        if target is None:
+            return
+        previous = target.last_values.get(table)
+        values = {key: value for key, value in row.items() if isinstance(value, (int, float))
+                  and not isinstance(value, bool) and key != "item_index"}
+        target.last_values[table] = values
+        alarms = row.get("AlarmMessages")
+        if alarms is not None:
+            if alarms != target.last_alarms.get(table, "[]") and alarms != "[]":
+                target.moving = True
+            target.last_alarms[table] = alarms
+        if previous is None:
+            return
+        for key, value in values.items():
+            before = previous.get(key)
+            if before is not None and abs(value - before) > self.drift_threshold * max(abs(before), 1.0):
+                target.moving = True
+                return
+
+    def note_anomaly(self, anomaly):
+        """Anomaly sink: speeds up the target whose capture produced the anomaly."""
+        if self._current is not None:
+            self._current.moving = True
+
+    def _schedule(self, target, delay):
+        self._scheduler.every(max(delay, 1.0)).seconds.do(self._capture, target)
+
+    def _capture(self, target):
+        try:
+            delay = self._capture_once(target)
+        except Exception as e:
+            print(f"Capture of {target.name} failed: {e}")
+            delay = target.interval
+        self._schedule(target, delay)
+        return schedule.CancelJob
+
+    def _capture_once(self, target):
+        """Captures target if its frame changed and budget allows. Returns seconds until the next try."""
+        frame_hash = image_sha256(target.image_path)
+        if frame_hash == target.frame_hash:
+            target.skipped += 1
+            target.interval = min(target.interval * self.backoff, target.max_interval)
+            return target.interval
+        if not self.budget.try_acquire(target.llm_calls):
+            return self.budget.wait_time(target.llm_calls)
+        target.moving = False
+        self._current = target
+        try:
+            mark_frame_captured(os.path.getmtime(target.image_path))
+            target.process(target.image_path, target.machine_id)
+        finally:
+            self._current = None
+        # Only a processed frame counts as seen; a failed one is retried.
+        target.frame_hash = frame_hash
+        target.captures += 1
+        if target.moving:
+            target.interval = target.min_interval
+        else:
+            target.interval = min(target.interval * self.backoff, target.max_interval)
+        return target.interval
+
+    def run_forever(self):
+        for target in self.targets:
+            self._schedule(target, 0)
+        while True:
+            self._scheduler.run_pending()
+            idle = self._scheduler.idle_seconds
+            time.sleep(min(max(idle, 0.1), 1.0) if idle is not None else 1.0)
+
+    def status(self):
+        return {target.name: {"interval_s": target.interval, "captures": target.captures,
+                              "unchanged_frames": target.skipped}
+                for target in self.targets}
+
+def target_from_spec(spec, llm_factory, min_interval, max_interval):
+    """Builds a target from name=image_path[:screen][@machine_id].
+
+    screen is "auto" (classify first) or a module like image9.
+    """
+    name, _, rest = spec.partition("=")
+    rest, _, machine_id = rest.partition("@")
+    image_path, _, screen = rest.partition(":")
+    screen = screen or "auto"
+    if screen == "auto":
+        import main
+        llm = llm_factory()
+        process = lambda path, machine: main.process_image(path, llm, machine)
+        llm_calls = 2
+    else:
+        process = importlib.import_module(screen).generate
+        llm_calls = 1
+    return CaptureTarget(name, image_path, process, llm_calls, min_interval, max_interval,
+                         machine_id or DEFAULT_MACHINE_ID)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Capture screens on an adaptive cadence.")
+    parser.add_argument("--target", action="append", required=True,
+                        help="name=image_path[:screen][@machine_id], screen being auto (default) or a module like image9")
+    parser.add_argument("--calls-per-minute", type=int, default=30, help="Global LLM call budget")
+    parser.add_argument("--min-interval", type=float, default=10, help="Fastest cadence in seconds")
+    parser.add_argument("--max-interval", type=float, default=300, help="Slowest cadence in seconds")
+    args = parser.parse_args()
+
+    import main
+    ensure_schema()
+    detector, _ = main.register_listeners()
+    targets = [target_from_spec(spec, main.create_llm, args.min_interval, args.max_interval) for spec in args.target]
+    scheduler = AdaptiveScheduler(targets, args.calls_per_minute)
+    register_reading_listener(scheduler.observe_row)
+    on_anomaly = detector.on_anomaly
+    detector.on_anomaly = lambda anomaly: (on_anomaly(anomaly), scheduler.note_anomaly(anomaly))
+    scheduler.run_forever()